@@ -0,0 +1,80 @@
+"""
+Benchmark of merging datasets with the minimum viable datasetv2 (helpers._merge_dictionaries).
+
+Compares the compiled template merge with the previous approach of re-flattening the dataset
+for every template field, for datasets with increasingly large nested metadata.
+
+Usage:
+    python benchmarks/bench_merge.py [--repeat 200]
+"""
+
+import os
+import sys
+import copy
+import json
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from functions.helpers import (
+    MINIMUM_VIABLE_DATASETV2,
+    _merge_dictionaries,
+    _flatten,
+    _unflatten,
+)
+
+MOCK_DATASET = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "tests",
+    "mocks",
+    "dataset_valid.json",
+)
+
+
+def merge_by_flattening(dictionary: dict = None) -> dict:
+    """
+    The previous merge: flattens the dataset twice per field of the flattened template.
+    """
+    merged_dictionary = dictionary.copy()
+    for key, value in _flatten(copy.deepcopy(MINIMUM_VIABLE_DATASETV2)).items():
+        if key not in _flatten(dictionary) or _flatten(dictionary)[key] == "":
+            merged_dictionary[key] = value
+
+    return _unflatten(merged_dictionary)
+
+
+def get_dataset(fields: int = 0) -> dict:
+    """
+    Get the mock dataset with a number of extra nested fields.
+    """
+    with open(MOCK_DATASET) as file:
+        dataset = json.load(file)
+
+    dataset["extensions"] = {f"field{i}": {"value": str(i)} for i in range(fields)}
+
+    return dataset
+
+
+def main(repeat: int = 200) -> None:
+    print(f"{'extra fields':>12} {'flattening (ms)':>16} {'compiled (ms)':>14} {'speedup':>8}")
+
+    for fields in [0, 100, 1000, 10000]:
+        datasets = [get_dataset(fields) for _ in range(repeat)]
+        results = []
+
+        for merge in [merge_by_flattening, _merge_dictionaries]:
+            copies = iter(copy.deepcopy(datasets))
+            results.append(
+                timeit.timeit(lambda: merge(next(copies)), number=repeat) / repeat * 1000
+            )
+
+        print(
+            f"{fields:>12} {results[0]:>16.3f} {results[1]:>14.3f} {results[0] / results[1]:>7.0f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--repeat", type=int, default=200, help="merges per measurement")
+    main(parser.parse_args().repeat)
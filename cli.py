@@ -0,0 +1,91 @@
+"""
+Command line tools for the FMA ingestion.
+
+Usage:
+    python cli.py plan <custodian_id> [--warm] [--output plan.json]
+    python cli.py indexes [--explain] [--publisher <name>] [--pid <pid>]
+"""
+
+import sys
+import json
+import logging
+import argparse
+
+from dotenv import load_dotenv
+
+from functions import *
+
+load_dotenv()
+logging.basicConfig(level=logging.INFO)
+
+
+def plan(args: argparse.Namespace = None) -> None:
+    """
+    Print (or write) the dry-run sync plan of a custodian, see plan_sync.
+    """
+    sync_plan = plan_sync(db=get_db(), custodian_id=args.custodian_id, warm=args.warm)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(sync_plan, file, indent=2)
+    else:
+        json.dump(sync_plan, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+
+def indexes(args: argparse.Namespace = None) -> None:
+    """
+    Create the Gateway indexes and optionally check the ingestion queries use them.
+    """
+    db = get_db()
+
+    ensure_indexes(db)
+
+    if args.explain:
+        stages = check_query_plans(db, publisher_name=args.publisher, pid=args.pid)
+        json.dump(stages, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+
+def parse_args(argv: list = None) -> argparse.Namespace:
+    """
+    Parse the command line arguments.
+    """
+    parser = argparse.ArgumentParser(description="FMA ingestion tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    plan_parser = subparsers.add_parser(
+        "plan", help="dry run: print what a sync of a custodian would do"
+    )
+    plan_parser.add_argument("custodian_id", help="Gateway publisher _id")
+    plan_parser.add_argument(
+        "--warm", action="store_true", help="pre-compile the schemas the sync needs"
+    )
+    plan_parser.add_argument("--output", help="write the plan to a file")
+    plan_parser.set_defaults(handler=plan)
+
+    indexes_parser = subparsers.add_parser(
+        "indexes", help="create the Gateway indexes used by the ingestion"
+    )
+    indexes_parser.add_argument(
+        "--explain",
+        action="store_true",
+        help="fail if an ingestion query would scan a whole collection",
+    )
+    indexes_parser.add_argument("--publisher", default="", help="publisher to explain with")
+    indexes_parser.add_argument("--pid", default="", help="dataset PID to explain with")
+    indexes_parser.set_defaults(handler=indexes)
+
+    return parser.parse_args(argv)
+
+
+def main(argv: list = None) -> None:
+    """
+    Run the command given on the command line.
+    """
+    args = parse_args(argv)
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,3 +5,14 @@ from functions.extract import *
 from functions.helpers import *
 from functions.queries import *
 from functions.validate import *
+from functions.session import *
+from functions.cache import *
+from functions.audit import *
+from functions.ratelimit import *
+from functions.aio import *
+from functions.engine import *
+from functions.plan import *
+from functions.indexes import *
+from functions.pipeline import *
+from functions.database import *
+from functions.checkpoint import *
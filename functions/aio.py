@@ -0,0 +1,605 @@
+"""
+Asynchronous counterparts of the extract and query functions, for the asyncio engine.
+"""
+
+import json
+import time
+import asyncio
+import functools
+import aiohttp
+
+from typing import Any
+from datetime import datetime
+from bson.objectid import ObjectId
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from .exceptions import *
+from .cache import *
+from .audit import audit_payload
+from .ratelimit import get_rate_limiter, parse_retry_after, MAX_RETRY_DELAY
+from .extract import DEFAULT_FETCH_CONCURRENCY
+from .checkpoint import (
+    create_run,
+    get_plan_counts,
+    get_claim_update,
+    get_stale_query,
+    get_run_result,
+    get_checkpoint_operations,
+    get_resumable_query,
+)
+from .queries import (
+    SYNC_BATCH_SIZE,
+    ARCHIVE_BATCH_SIZE,
+    GATEWAY_READ_BATCH_SIZE,
+    get_projection,
+    with_read_preference,
+    with_batch_size,
+    get_sync_batches,
+    get_sync_operations,
+    get_write_errors,
+    get_stale_sync_queries,
+    get_archive_chunks,
+    get_archive_query,
+    add_archive_counts,
+    get_latest_versions_pipeline,
+    get_latest_version,
+)
+
+
+async def get_dataset_async(
+    http: aiohttp.ClientSession = None,
+    url: str = "",
+    headers: Any = None,
+    dataset_id: str = "",
+    publisher_name: str = "",
+) -> dict:
+    """
+    GET: extract a single dataset from the target server, see extract.get_dataset.
+
+    Requests go through the host's rate limiter, as in extract._send, and the response
+    cache and payload audit (disk I/O) run off the event loop.
+    """
+    loop = asyncio.get_running_loop()
+    updated_url = url.replace("{id}", str(dataset_id))
+    limiter = get_rate_limiter(updated_url)
+
+    async def _in_thread(function, *args, **kwargs):
+        return await loop.run_in_executor(None, functools.partial(function, *args, **kwargs))
+
+    cached = (
+        await _in_thread(get_cached_response, publisher_name, dataset_id)
+        if publisher_name
+        else None
+    )
+    started = time.monotonic()
+
+    # Header providers may request a token, so are called off the event loop
+    request_headers = await _in_thread(headers) if callable(headers) else headers or {}
+
+    refreshed = False
+    retries = 0
+
+    while True:
+        await limiter.acquire_async()
+        sent = time.monotonic()
+
+        try:
+            response = await http.get(
+                updated_url,
+                headers={**request_headers, **get_conditional_headers(cached)},
+            )
+        except BaseException:
+            limiter.release()
+            raise
+
+        async with response:
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            limiter.release(response.status, time.monotonic() - sent, retry_after)
+
+            if response.status == 401 and callable(headers) and not refreshed:
+                refreshed = True
+                request_headers = await _in_thread(headers, stale=request_headers)
+                continue
+
+            # The limiter pauses the host for the Retry-After before the next acquire
+            if (
+                response.status in [429, 503]
+                and retries < limiter.max_retries
+                and (retry_after or 0) <= MAX_RETRY_DELAY
+            ):
+                retries += 1
+                continue
+
+            if response.status == 304 and cached:
+                return json.loads(cached["body"])
+
+            if response.status == 200:
+                body = await response.read()
+
+                await _in_thread(
+                    audit_payload,
+                    "dataset",
+                    dataset_id,
+                    body,
+                    publisher_name,
+                    started=started,
+                )
+
+                try:
+                    data = json.loads(body)
+                except ValueError as error:
+                    raise RequestError(
+                        f"Error decoding dataset {dataset_id}: {error}", url=url
+                    ) from error
+
+                if publisher_name and (
+                    response.headers.get("ETag") or response.headers.get("Last-Modified")
+                ):
+                    await _in_thread(
+                        set_cached_response,
+                        publisher_name,
+                        dataset_id,
+                        body,
+                        etag=response.headers.get("ETag"),
+                        last_modified=response.headers.get("Last-Modified"),
+                    )
+
+                return data
+
+            if response.status in [401, 403]:
+                raise AuthError(
+                    f"Authorisation error: unauthorised {response.status} error was received from {url}",
+                    url=url,
+                )
+
+            raise RequestError(f"A status code of {response.status} was received", url=url)
+
+
+async def fetch_dataset_async(
+    http: aiohttp.ClientSession = None,
+    url: str = "",
+    headers: Any = None,
+    dataset_id: str = "",
+    publisher_name: str = "",
+) -> tuple:
+    """
+    GET: extract a single dataset, returning a (dataset, error) tuple where error is the
+    RequestError of a failed fetch. Any other error (e.g., AuthError) is raised.
+    """
+    try:
+        return await get_dataset_async(http, url, headers, dataset_id, publisher_name), None
+    except RequestError as error:
+        return None, error
+    except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+        return None, RequestError(f"Error retrieving dataset {dataset_id}: {error}", url=url)
+
+
+async def fetch_datasets_async(
+    http: aiohttp.ClientSession = None,
+    url: str = "",
+    headers: Any = None,
+    dataset_ids: list = None,
+    max_workers: int = DEFAULT_FETCH_CONCURRENCY,
+    publisher_name: str = "",
+) -> list:
+    """
+    GET: extract several datasets concurrently, see extract.fetch_datasets.
+    """
+    semaphore = asyncio.Semaphore(max(1, max_workers))
+
+    async def _fetch(dataset_id: str = "") -> tuple:
+        async with semaphore:
+            return await fetch_dataset_async(
+                http, url, headers, dataset_id, publisher_name
+            )
+
+    tasks = [asyncio.ensure_future(_fetch(i)) for i in dataset_ids or []]
+
+    try:
+        return list(await asyncio.gather(*tasks))
+    except Exception:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+async def get_publisher_async(
+    db: AsyncIOMotorDatabase = None, custodian_id: str = ""
+) -> dict:
+    """
+    Get the relevant publisher documentation given a publisher _id, see queries.get_publisher.
+    """
+    try:
+        publisher = await db.publishers.find_one({"_id": ObjectId(custodian_id)})
+
+        if publisher:
+            return publisher
+
+        raise Exception(f"publisher not found for _id {custodian_id}")
+    except Exception as error:
+        raise Exception(
+            f"Error retrieving the publisher details from the publisher collection for publisher _id {custodian_id}: {error}"
+        ) from error
+
+
+async def get_gateway_datasets_async(
+    db: AsyncIOMotorDatabase = None,
+    publisher: str = None,
+    pids: list = None,
+    fields: list = None,
+    read_preference: str = None,
+    batch_size: int = None,
+) -> list:
+    """
+    Get the list of Gateway sync entries for a publisher, see queries.get_gateway_datasets.
+    """
+    try:
+        query = {"publisherName": publisher}
+
+        if pids is not None:
+            query["pid"] = {"$in": list(pids)}
+
+        datasets = with_read_preference(db.sync_status, read_preference).find(
+            query, get_projection(fields)
+        )
+
+        return await with_batch_size(datasets, batch_size).to_list(None)
+    except Exception as error:
+        raise CriticalError(
+            f"Error retrieving gateway datasets for publisher {publisher}: {error}"
+        ) from error
+
+
+async def get_latest_gateway_dataset_async(
+    db: AsyncIOMotorDatabase = None,
+    pid: str = "",
+    fields: list = None,
+    read_preference: str = None,
+) -> dict:
+    """
+    Get the latest version of a dataset in the tools collection, see queries.get_latest_gateway_dataset.
+    """
+    try:
+        datasets = (
+            await with_read_preference(db.tools, read_preference)
+            .find({"type": "dataset", "pid": pid}, get_projection(fields))
+            .sort("createdAt", -1)
+            .to_list(1)
+        )
+
+        return datasets[0] if datasets else None
+    except Exception as error:
+        raise CriticalError(
+            f"Error retrieving latest version of dataset {pid} from the Gateway: {error}"
+        ) from error
+
+
+async def get_latest_gateway_datasets_async(
+    db: AsyncIOMotorDatabase = None,
+    pids: list = None,
+    read_preference: str = None,
+    batch_size: int = None,
+    chunk_size: int = ARCHIVE_BATCH_SIZE,
+) -> dict:
+    """
+    Get the latest version of each given dataset in chunks, see queries.get_latest_gateway_datasets.
+    """
+    batch_size = batch_size if batch_size is not None else GATEWAY_READ_BATCH_SIZE
+    latest = {}
+
+    try:
+        for chunk in get_archive_chunks(pids, chunk_size):
+            async for i in with_read_preference(db.tools, read_preference).aggregate(
+                get_latest_versions_pipeline(chunk),
+                allowDiskUse=True,
+                **({"batchSize": batch_size} if batch_size else {}),
+            ):
+                latest[i["_id"]] = get_latest_version(i)
+
+        return latest
+    except Exception as error:
+        raise CriticalError(
+            f"Error retrieving latest versions of datasets from the Gateway: {error}"
+        ) from error
+
+
+async def archive_gateway_datasets_async(
+    db: AsyncIOMotorDatabase = None,
+    archived_datasets: list = None,
+    previous_versions: list = None,
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+) -> dict:
+    """
+    Archive datasets on the Gateway in chunks, see queries.archive_gateway_datasets.
+    """
+    archived_pids = [i["pid"] for i in archived_datasets]
+    pids = [*archived_pids, *[i["pid"] for i in previous_versions]]
+    deleted = set(archived_pids)
+    counts = {"matched": 0, "modified": 0, "deleted": 0, "chunks": []}
+
+    try:
+        for chunk in get_archive_chunks(pids, batch_size):
+            result = await db.tools.update_many(
+                get_archive_query(chunk), {"$set": {"activeflag": "archive"}}
+            )
+            chunk_counts = {
+                "matched": result.matched_count,
+                "modified": result.modified_count,
+                "deleted": 0,
+            }
+
+            if chunk_deleted := [i for i in chunk if i in deleted]:
+                result = await db.sync_status.delete_many(
+                    {"pid": {"$in": chunk_deleted}}
+                )
+                chunk_counts["deleted"] = result.deleted_count
+
+            add_archive_counts(counts, chunk_counts)
+    except Exception as error:
+        raise CriticalError(
+            f"Error archiving datasets on the Gateway: {error}"
+        ) from error
+
+    return counts
+
+
+async def add_new_datasets_async(
+    db: AsyncIOMotorDatabase = None, new_datasets: list = None
+) -> None:
+    """
+    Add new datasets to the Gateway, see queries.add_new_datasets.
+    """
+    try:
+        await db.tools.insert_many(new_datasets)
+    except Exception as error:
+        raise CriticalError(
+            f"Error inserting list of new datasets into the Gateway: {error}"
+        ) from error
+
+
+async def update_publisher_async(
+    db: AsyncIOMotorDatabase = None, status: str = "", custodian_id: str = ""
+) -> None:
+    """
+    Update the federation status of a publisher, see queries.update_publisher.
+    """
+    try:
+        await db.publishers.update_one(
+            {"_id": ObjectId(custodian_id)},
+            {"$set": {"federation.active": status}},
+        )
+    except Exception as error:
+        raise CriticalError(
+            f"Error setting the federation.status of publisher _id {custodian_id}: {error}"
+        ) from error
+
+
+async def write_batch_async(db: AsyncIOMotorDatabase = None, batch: dict = None) -> None:
+    """
+    Write a batch of Gateway writes, see pipeline.write_batch.
+    """
+    if batch["previous"]:
+        await archive_gateway_datasets_async(
+            db=db, archived_datasets=[], previous_versions=batch["previous"]
+        )
+    if batch["insert"]:
+        await add_new_datasets_async(db=db, new_datasets=batch["insert"])
+    if batch["sync"]:
+        await sync_datasets_async(db=db, sync_list=batch["sync"])
+    if batch.get("checkpoint"):
+        await save_checkpoints_async(db=db, checkpoints=batch["checkpoint"])
+
+
+async def update_sync_watermark_async(
+    db: AsyncIOMotorDatabase = None,
+    custodian_id: str = "",
+    watermark: datetime = None,
+    full_sync: bool = False,
+) -> None:
+    """
+    Record the start time of a publisher's last successful sync, see queries.update_sync_watermark.
+    """
+    try:
+        update = {"federation.syncWatermark": watermark}
+
+        if full_sync:
+            update["federation.lastFullSync"] = watermark
+
+        await db.publishers.update_one({"_id": ObjectId(custodian_id)}, {"$set": update})
+    except Exception as error:
+        raise CriticalError(
+            f"Error setting the sync watermark of publisher _id {custodian_id}: {error}"
+        ) from error
+
+
+async def sync_datasets_async(
+    db: AsyncIOMotorDatabase = None,
+    sync_list: list = None,
+    batch_size: int = SYNC_BATCH_SIZE,
+) -> dict:
+    """
+    Replace (or add) the sync status of each (publisherName, pid), see queries.sync_datasets.
+    """
+    counts = {"matched": 0, "modified": 0, "upserted": 0, "deleted": 0}
+    errors = []
+
+    for batch in get_sync_batches(sync_list, batch_size):
+        try:
+            result = await db.sync_status.bulk_write(
+                get_sync_operations(batch), ordered=False
+            )
+            details = result.bulk_api_result
+        except BulkWriteError as error:
+            details = error.details
+            errors.extend(get_write_errors(batch, details))
+        except Exception as error:
+            raise CriticalError(
+                f"Error updating the sync_status collection on the Gateway: {error}"
+            ) from error
+
+        try:
+            for query in get_stale_sync_queries(batch):
+                result = await db.sync_status.delete_many(query)
+                counts["deleted"] += result.deleted_count
+        except Exception as error:
+            raise CriticalError(
+                f"Error updating the sync_status collection on the Gateway: {error}"
+            ) from error
+
+        counts["matched"] += details.get("nMatched", 0)
+        counts["modified"] += details.get("nModified", 0)
+        counts["upserted"] += details.get("nUpserted", 0)
+
+    if errors:
+        raise CriticalError(
+            f"Error updating the sync_status collection on the Gateway: {len(errors)} failed writes, e.g., {errors[:5]}"
+        )
+
+    return counts
+
+
+async def get_resumable_run_async(
+    db: AsyncIOMotorDatabase = None, custodian_id: str = "", now: datetime = None
+) -> dict:
+    """
+    Claim the latest resumable run of a publisher, see checkpoint.get_resumable_run.
+    """
+    now = now or datetime.utcnow()
+
+    try:
+        return await db.sync_runs.find_one_and_update(
+            get_resumable_query(custodian_id, now),
+            get_claim_update(now),
+            sort=[("startedAt", -1)],
+            return_document=ReturnDocument.AFTER,
+        )
+    except Exception as error:
+        raise CriticalError(
+            f"Error retrieving the last run of publisher _id {custodian_id}: {error}"
+        ) from error
+
+
+async def start_run_async(
+    db: AsyncIOMotorDatabase = None,
+    custodian_id: str = "",
+    publisher_name: str = "",
+    modified_since: dict = None,
+    now: datetime = None,
+) -> ObjectId:
+    """
+    Start a new run of a publisher, see checkpoint.start_run.
+    """
+    now = now or datetime.utcnow()
+
+    try:
+        await db.sync_runs.update_many(
+            get_stale_query(custodian_id, now),
+            {"$set": {"status": "abandoned", "updatedAt": now}},
+        )
+
+        live = await db.sync_runs.find_one(
+            {"publisherId": custodian_id, "status": "running"}
+        )
+
+        if not live:
+            result = await db.sync_runs.insert_one(
+                create_run(custodian_id, publisher_name, modified_since, now)
+            )
+            return result.inserted_id
+    except DuplicateKeyError:
+        live = {"_id": "started concurrently"}
+    except Exception as error:
+        raise CriticalError(
+            f"Error recording the run of publisher _id {custodian_id}: {error}"
+        ) from error
+
+    raise RunInProgressError(
+        f"Run {live['_id']} of publisher _id {custodian_id} is in progress"
+    )
+
+
+async def record_plan_async(
+    db: AsyncIOMotorDatabase = None,
+    run_id: ObjectId = None,
+    plan: dict = None,
+    now: datetime = None,
+) -> None:
+    """
+    Record the plan of a new or resumed run, see checkpoint.record_plan.
+    """
+    try:
+        await db.sync_runs.update_one(
+            {"_id": run_id},
+            {
+                "$set": {
+                    "plan": get_plan_counts(plan),
+                    "updatedAt": now or datetime.utcnow(),
+                }
+            },
+        )
+    except Exception as error:
+        raise CriticalError(f"Error recording the plan of run {run_id}: {error}") from error
+
+
+async def finish_run_async(
+    db: AsyncIOMotorDatabase = None,
+    run_id: ObjectId = None,
+    status: str = "completed",
+    summary: dict = None,
+) -> None:
+    """
+    Record the outcome of a run, see checkpoint.finish_run.
+    """
+    try:
+        await db.sync_runs.update_one(
+            {"_id": run_id}, {"$set": get_run_result(status, summary)}
+        )
+
+        if status == "completed":
+            await db.sync_run_checkpoints.delete_many({"runId": run_id})
+    except Exception as error:
+        raise CriticalError(f"Error recording the end of run {run_id}: {error}") from error
+
+
+async def get_checkpoints_async(
+    db: AsyncIOMotorDatabase = None, run_id: ObjectId = None
+) -> dict:
+    """
+    Get the checkpoints of a run by PID, see checkpoint.get_checkpoints.
+    """
+    try:
+        checkpoints = await db.sync_run_checkpoints.find(
+            {"runId": run_id}, {"_id": 0}
+        ).to_list(None)
+
+        return {i["pid"]: i for i in checkpoints}
+    except Exception as error:
+        raise CriticalError(
+            f"Error retrieving the checkpoints of run {run_id}: {error}"
+        ) from error
+
+
+async def save_checkpoints_async(
+    db: AsyncIOMotorDatabase = None, checkpoints: list = None
+) -> None:
+    """
+    Replace (or add) the checkpoint of each (runId, pid) and renew the lease of their run,
+    see checkpoint.save_checkpoints.
+    """
+    run_id = checkpoints[0]["runId"]
+
+    try:
+        await db.sync_run_checkpoints.bulk_write(
+            get_checkpoint_operations(checkpoints), ordered=False
+        )
+        result = await db.sync_runs.update_one(
+            {"_id": run_id, "status": "running"},
+            {"$set": {"updatedAt": datetime.utcnow()}},
+        )
+    except Exception as error:
+        raise CriticalError(f"Error saving the run checkpoints: {error}") from error
+
+    if not result.matched_count:
+        raise RunLeaseLostError(f"Run {run_id} is no longer running")
@@ -0,0 +1,194 @@
+"""
+Functions for auditing custodian payloads: bounded log summaries and a compressed raw archive.
+"""
+
+import os
+import re
+import gzip
+import json
+import time
+import queue
+import atexit
+import hashlib
+import logging
+import threading
+
+from datetime import datetime
+
+# Directory (e.g., a mounted bucket) for compressed raw payloads, archiving is off if unset
+PAYLOAD_ARCHIVE_DIR = os.getenv("PAYLOAD_ARCHIVE_DIR", "")
+# Maximum number of payload chunks waiting for the background writer
+PAYLOAD_ARCHIVE_QUEUE_SIZE = int(os.getenv("PAYLOAD_ARCHIVE_QUEUE_SIZE", "256"))
+
+_queue = queue.Queue(maxsize=PAYLOAD_ARCHIVE_QUEUE_SIZE)
+_writer = None
+_writer_lock = threading.Lock()
+
+
+class PayloadAudit:
+    """
+    Record a response payload as it is read: count and hash its bytes, queue them for the
+    archive and log a bounded summary (no payload content) when closed.
+    """
+
+    def __init__(
+        self,
+        kind: str = "",
+        key: str = "",
+        publisher_name: str = "",
+        started: float = None,
+    ):
+        self.kind = kind
+        self.key = key
+        self.size = 0
+        self.started = started if started is not None else time.monotonic()
+        self.sha256 = hashlib.sha256()
+        self.path = (
+            _archive_path(publisher_name, kind, key) if PAYLOAD_ARCHIVE_DIR else None
+        )
+
+    def update(self, chunk: bytes = b"") -> None:
+        """
+        Add a chunk of the raw payload.
+        """
+        self.size += len(chunk)
+        self.sha256.update(chunk)
+
+        if self.path and chunk:
+            _enqueue(self.path, chunk, final=False)
+
+    def close(self) -> dict:
+        """
+        Finish the payload, log its summary and return it.
+        """
+        summary = {
+            "kind": self.kind,
+            "id": self.key,
+            "bytes": self.size,
+            "sha256": self.sha256.hexdigest(),
+            "duration": round(time.monotonic() - self.started, 3),
+        }
+
+        if self.path:
+            _enqueue(self.path, b"", final=True)
+            summary["archive"] = self.path
+
+        logging.info(f"Payload received: {json.dumps(summary)}")
+
+        return summary
+
+
+def audit_payload(
+    kind: str = "",
+    key: str = "",
+    body: bytes = b"",
+    publisher_name: str = "",
+    started: float = None,
+) -> dict:
+    """
+    Audit a complete response payload, see PayloadAudit.
+    """
+    audit = PayloadAudit(kind, key, publisher_name=publisher_name, started=started)
+    audit.update(body)
+    return audit.close()
+
+
+def flush_payload_archive() -> None:
+    """
+    Block until every queued payload has been written to the archive.
+    """
+    if _writer is not None:
+        # Queued chunks are only marked done by a live writer
+        _start_writer()
+        _queue.join()
+
+
+def _enqueue(path: str = "", chunk: bytes = b"", final: bool = False) -> None:
+    """
+    INTERNAL: queue a payload chunk for the background writer, starting it on first use.
+    """
+    _start_writer()
+    _queue.put((path, chunk, final))
+
+
+def _start_writer() -> None:
+    """
+    INTERNAL: start the background writer if it has not been started or has died.
+    """
+    global _writer
+
+    if _writer is None or not _writer.is_alive():
+        with _writer_lock:
+            if _writer is None or not _writer.is_alive():
+                if _writer is None:
+                    atexit.register(flush_payload_archive)
+                else:
+                    logging.error("Payload archive writer died, restarting it")
+
+                _writer = threading.Thread(
+                    target=_write_payloads, name="payload-archive", daemon=True
+                )
+                _writer.start()
+
+
+def _write_payloads() -> None:
+    """
+    INTERNAL: background writer compressing queued payload chunks into the archive.
+    """
+    files = {}
+    failed = set()
+
+    while True:
+        path, chunk, final = _queue.get()
+
+        try:
+            if path in failed:
+                if final:
+                    failed.discard(path)
+                continue
+
+            if path not in files:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                files[path] = gzip.open(path + ".part", "wb")
+
+            if chunk:
+                files[path].write(chunk)
+
+            if final:
+                files.pop(path).close()
+                os.replace(path + ".part", path)
+        except Exception as error:
+            # Any error only loses this payload, the writer must keep draining the queue
+            logging.warning(f"Unable to archive payload {path}: {error}")
+            file = files.pop(path, None)
+            try:
+                if file:
+                    file.close()
+            except Exception:
+                pass
+            if not final:
+                failed.add(path)
+        finally:
+            _queue.task_done()
+
+
+def _archive_path(publisher_name: str = "", kind: str = "", key: str = "") -> str:
+    """
+    INTERNAL: build a unique archive path for a payload.
+    """
+    now = datetime.utcnow()
+
+    return os.path.join(
+        PAYLOAD_ARCHIVE_DIR,
+        _safe_name(publisher_name or "unknown"),
+        kind,
+        now.strftime("%Y-%m-%d"),
+        f"{_safe_name(key)}-{now.strftime('%H%M%S%f')}.json.gz",
+    )
+
+
+def _safe_name(name: str = "") -> str:
+    """
+    INTERNAL: make a string safe for use as a file name.
+    """
+    return re.sub(r"[^A-Za-z0-9._-]", "_", str(name))[:128]
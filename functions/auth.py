@@ -2,12 +2,32 @@
 Functions for authorising requests to the server, if required.
 """
 
+import os
 import json
-import requests
+import time
+import threading
 
+from typing import Any, Callable
 from google.cloud import secretmanager
 
 from .exceptions import *
+from .session import get_session, HTTP_TIMEOUT
+
+# Seconds before expiry at which a cached access token is refreshed
+TOKEN_REFRESH_MARGIN = int(os.getenv("TOKEN_REFRESH_MARGIN", "60"))
+# Assumed lifetime in seconds of access tokens returned without an expires_in
+DEFAULT_TOKEN_LIFETIME = int(os.getenv("DEFAULT_TOKEN_LIFETIME", "300"))
+
+# Seconds a decoded secret is reused before it is read from Secret Manager again
+SECRET_CACHE_TTL = int(os.getenv("SECRET_CACHE_TTL", "300"))
+
+_tokens = {}
+_tokens_lock = threading.Lock()
+_token_locks = {}
+
+_secret_client = None
+_secrets = {}
+_secrets_lock = threading.Lock()
 
 
 def get_access_token(
@@ -16,18 +36,132 @@ def get_access_token(
     """
     Retrieve the access token from the target server using the supplied client credentials.
     """
+    return _request_access_token(token_url, client_id, client_secret)["access_token"]
+
+
+def get_cached_access_token(
+    token_url: str = "",
+    client_id: str = "",
+    client_secret: str = "",
+    stale_token: str = None,
+) -> str:
+    """
+    Get an access token from the cache, requesting a new one if there is none, it expires
+    within TOKEN_REFRESH_MARGIN seconds (or half its lifetime, if shorter), or it is the
+    rejected stale_token.
+
+    Concurrent callers share a single request to the token endpoint.
+    """
+    key = (token_url, client_id)
+
+    with _tokens_lock:
+        token_lock = _token_locks.setdefault(key, threading.Lock())
+
+    with token_lock:
+        cached = _tokens.get(key)
+
+        if (
+            cached
+            and cached["access_token"] != stale_token
+            and cached["refresh_at"] > time.monotonic()
+        ):
+            return cached["access_token"]
+
+        requested_at = time.monotonic()
+        token = _request_access_token(token_url, client_id, client_secret)
+
+        try:
+            lifetime = float(token.get("expires_in", DEFAULT_TOKEN_LIFETIME))
+        except (TypeError, ValueError):
+            lifetime = DEFAULT_TOKEN_LIFETIME
+
+        # Short-lived tokens are still reused for the first half of their lifetime
+        margin = min(TOKEN_REFRESH_MARGIN, lifetime / 2)
+
+        _tokens[key] = {
+            "access_token": token["access_token"],
+            "refresh_at": requested_at + lifetime - margin,
+        }
+
+        return token["access_token"]
+
+
+def invalidate_access_token(token_url: str = "", client_id: str = "") -> None:
+    """
+    Remove a cached access token, e.g., after its credentials have been rejected.
+    """
+    with _tokens_lock:
+        _tokens.pop((token_url, client_id), None)
+
+
+def get_oauth_headers(
+    token_url: str = "", client_id: str = "", client_secret: str = ""
+) -> Callable:
+    """
+    Build an auth headers provider for an OAuth publisher.
+
+    The provider returns headers with a cached bearer token; called with the headers that
+    received a 401 (stale), it refreshes the token once for all callers.
+    """
+
+    def headers(stale: dict = None) -> dict:
+        stale_token = None
+        if stale and stale.get("Authorization", "").startswith("Bearer "):
+            stale_token = stale["Authorization"][len("Bearer ") :]
+
+        access_token = get_cached_access_token(
+            token_url, client_id, client_secret, stale_token=stale_token
+        )
 
-    post = requests.post(
+        return {"Authorization": f"Bearer {access_token}"}
+
+    return headers
+
+
+def get_publisher_headers(publisher: dict = None) -> Any:
+    """
+    Build the auth headers for a publisher's federation.auth settings: a dict, or a headers
+    provider for OAuth publishers (see get_oauth_headers).
+    """
+    auth = publisher["federation"]["auth"]
+
+    if auth["type"] == "oauth":
+        secrets = get_client_secret(secret_name=auth["secretKey"])
+        return get_oauth_headers(
+            publisher["federation"]["endpoints"]["baseURL"] + "/oauth/token",
+            secrets["client_id"],
+            secrets["client_secret"],
+        )
+
+    if auth["type"] == "api_key":
+        secrets = get_client_secret(secret_name=auth["secretKey"])
+        return {"apikey": secrets["api_key"]}
+
+    if auth["type"] == "bearer_token":
+        secrets = get_client_secret(secret_name=auth["secretKey"])
+        return {"Authorization": "Bearer " + secrets["bearer_token"]}
+
+    return {}
+
+
+def _request_access_token(
+    token_url: str = "", client_id: str = "", client_secret: str = ""
+) -> dict:
+    """
+    INTERNAL: request a new access token using the client credentials grant.
+    """
+    post = get_session().post(
         token_url,
         data={
             "grant_type": "client_credentials",
             "client_id": client_id,
             "client_secret": client_secret,
         },
+        timeout=HTTP_TIMEOUT,
     )
 
     if post.status_code == 200:
-        return post.json()["access_token"]
+        return post.json()
 
     if post.status_code in [400, 401, 403]:
         raise AuthError(
@@ -43,13 +177,50 @@ def get_access_token(
 def get_client_secret(secret_name: str = "") -> dict:
     """
     Retrieve secret from the Google Secret Manager given a secret name.
+
+    Decoded secrets are cached for SECRET_CACHE_TTL seconds, see invalidate_client_secret.
     """
     try:
-        client = secretmanager.SecretManagerServiceClient()
+        with _secrets_lock:
+            cached = _secrets.get(secret_name)
+
+        if cached and cached["expires_at"] > time.monotonic():
+            return dict(cached["secret"])
+
+        response = _get_secret_client().access_secret_version(
+            request={"name": secret_name}
+        )
 
-        response = client.access_secret_version(request={"name": secret_name})
+        secret = json.loads(response.payload.data.decode("utf8").replace("'", '"'))
 
-        return json.loads(response.payload.data.decode("utf8").replace("'", '"'))
+        with _secrets_lock:
+            _secrets[secret_name] = {
+                "secret": secret,
+                "expires_at": time.monotonic() + SECRET_CACHE_TTL,
+            }
+
+        return dict(secret)
 
     except Exception as error:
         raise CriticalError(f"Error retrieving secrets from GCP: {error}") from error
+
+
+def invalidate_client_secret(secret_name: str = "") -> None:
+    """
+    Remove a cached secret, e.g., after the custodian has rejected its credentials.
+    """
+    with _secrets_lock:
+        _secrets.pop(secret_name, None)
+
+
+def _get_secret_client() -> secretmanager.SecretManagerServiceClient:
+    """
+    INTERNAL: get the Secret Manager client, creating it once per process.
+    """
+    global _secret_client
+
+    with _secrets_lock:
+        if _secret_client is None:
+            _secret_client = secretmanager.SecretManagerServiceClient()
+
+        return _secret_client
@@ -0,0 +1,197 @@
+"""
+Functions for caching custodian responses on local disk for conditional requests.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+
+from bson import json_util
+
+# Directory holding the last response body, ETag and Last-Modified per (publisher, PID)
+RESPONSE_CACHE_DIR = os.getenv(
+    "RESPONSE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "fma-response-cache")
+)
+# Maximum bytes held by the cache, the least recently used entries are evicted beyond it
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(1024 ** 3)))
+# Seconds since an entry was last used after which it is evicted
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", str(7 * 86400)))
+
+# Bytes cached since the last sweep, the cache is swept every tenth of its maximum size
+_written = 0
+_written_lock = threading.Lock()
+
+
+def get_cached_response(publisher_name: str = "", dataset_id: str = "") -> dict:
+    """
+    Get the cached response for a dataset, or None if it has not been cached.
+
+    Returns a dict with the "etag", "lastModified" and raw "body" of the last response.
+    """
+    path = _cache_path(publisher_name, dataset_id)
+
+    try:
+        with open(path, "rb") as file:
+            cached = json.loads(file.readline())
+            cached["body"] = file.read()
+
+        # The modification time records the last use of an entry (see sweep_response_cache)
+        os.utime(path)
+
+        return cached
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as error:
+        logging.warning(f"Ignoring unreadable cached response for {dataset_id}: {error}")
+        return None
+
+
+def get_cached_response_size(publisher_name: str = "", dataset_id: str = "") -> int:
+    """
+    Get the size in bytes of the cached response body for a dataset, or None if not cached.
+    """
+    try:
+        with open(_cache_path(publisher_name, dataset_id), "rb") as file:
+            header = file.readline()
+            return os.fstat(file.fileno()).st_size - len(header)
+    except OSError:
+        return None
+
+
+def set_cached_response(
+    publisher_name: str = "",
+    dataset_id: str = "",
+    body: bytes = b"",
+    etag: str = None,
+    last_modified: str = None,
+) -> None:
+    """
+    Cache the raw body and validators (ETag/Last-Modified) of a dataset response.
+    """
+    path = _cache_path(publisher_name, dataset_id)
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file and swap it in so readers never see a partial entry
+        with tempfile.NamedTemporaryFile(
+            "wb", dir=os.path.dirname(path), delete=False
+        ) as file:
+            file.write(
+                json.dumps({"etag": etag, "lastModified": last_modified}).encode("utf-8")
+                + b"\n"
+            )
+            file.write(body)
+
+        os.replace(file.name, path)
+    except OSError as error:
+        logging.warning(f"Unable to cache response for {dataset_id}: {error}")
+        return
+
+    _add_written(len(body))
+
+
+def sweep_response_cache(max_bytes: int = None, max_age: int = None) -> dict:
+    """
+    Evict the cache entries unused for max_age seconds (default RESPONSE_CACHE_TTL), then
+    the least recently used entries until the cache holds at most max_bytes (default
+    RESPONSE_CACHE_MAX_BYTES).
+
+    Returns the number of "files" and "bytes" left in the cache and the number "evicted".
+    """
+    max_bytes = RESPONSE_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    max_age = RESPONSE_CACHE_TTL if max_age is None else max_age
+    entries = []
+
+    for root, _, files in os.walk(RESPONSE_CACHE_DIR):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    entries.sort()
+    expired = time.time() - max_age
+    total = sum(size for _, size, _ in entries)
+    evicted = 0
+
+    for used, size, path in entries:
+        if used >= expired and total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError as error:
+            logging.warning(f"Unable to evict cached response {path}: {error}")
+            continue
+        total -= size
+        evicted += 1
+
+    return {"files": len(entries) - evicted, "bytes": total, "evicted": evicted}
+
+
+def get_conditional_headers(cached: dict = None) -> dict:
+    """
+    Build the If-None-Match/If-Modified-Since headers for a cached response.
+    """
+    headers = {}
+
+    if cached and cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached and cached.get("lastModified"):
+        headers["If-Modified-Since"] = cached["lastModified"]
+
+    return headers
+
+
+def get_cached_transform(key: str = "") -> dict:
+    """
+    Get a cached transformed dataset by its transform key, or None if it has not been cached.
+    """
+    cached = get_cached_response("transformed", key)
+
+    try:
+        return json_util.loads(cached["body"]) if cached else None
+    except ValueError as error:
+        logging.warning(f"Ignoring unreadable cached transform {key}: {error}")
+        return None
+
+
+def set_cached_transform(key: str = "", dataset: dict = None) -> None:
+    """
+    Cache a transformed dataset under its transform key, alongside (and evicted with) the
+    cached responses.
+    """
+    set_cached_response("transformed", key, json_util.dumps(dataset).encode("utf-8"))
+
+
+def _add_written(size: int = 0) -> None:
+    """
+    INTERNAL: count bytes written to the cache, sweeping it every tenth of its maximum size.
+    """
+    global _written
+
+    with _written_lock:
+        _written += size
+        sweep = _written >= RESPONSE_CACHE_MAX_BYTES // 10
+        if sweep:
+            _written = 0
+
+    if sweep:
+        logging.info(f"Response cache: {sweep_response_cache()}")
+
+
+def _cache_path(publisher_name: str = "", dataset_id: str = "") -> str:
+    """
+    INTERNAL: get the cache file path for a given publisher and dataset.
+    """
+    return os.path.join(
+        RESPONSE_CACHE_DIR,
+        hashlib.sha256(str(publisher_name).encode("utf-8")).hexdigest()[:16],
+        hashlib.sha256(str(dataset_id).encode("utf-8")).hexdigest(),
+    )
@@ -0,0 +1,319 @@
+"""
+Functions for checkpointing ingestion runs in the Gateway database, so a run that dies part
+way through is resumed by the next trigger rather than started again.
+
+Each run is a sync_runs document (publisher, watermark, sync mode and plan counts) and each
+dataset whose Gateway writes have completed is a sync_run_checkpoints document recording the
+stage it reached (its outcome, see pipeline.process_dataset) and its summary entry for the
+emails. A running run holds a lease, renewed by every checkpoint batch, so a run is only
+resumed once it has stopped checkpointing for CHECKPOINT_LEASE seconds.
+"""
+
+import os
+import pymongo
+
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from pymongo import ReplaceOne, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from .exceptions import CriticalError, RunInProgressError, RunLeaseLostError
+
+# Seconds an unfinished run may be resumed for, older runs are abandoned and started again
+CHECKPOINT_MAX_AGE = int(os.getenv("CHECKPOINT_MAX_AGE", "21600"))
+# Seconds without a checkpoint after which a running run is presumed dead, this must exceed
+# the longest time taken to fill and write a batch (see pipeline.WriteBatcher)
+CHECKPOINT_LEASE = int(os.getenv("CHECKPOINT_LEASE", "1800"))
+
+# Checkpointed stages whose dataset is added to a summary list (the others are counted)
+SUMMARY_STAGES = ["new", "updated", "invalid", "unsupported_version"]
+
+
+def get_resumable_run(
+    db: pymongo.database.Database = None, custodian_id: str = "", now: datetime = None
+) -> dict:
+    """
+    Claim the latest unfinished run of a publisher started within CHECKPOINT_MAX_AGE whose
+    lease has expired, if any. The claim is atomic, so only one worker resumes a run.
+    """
+    now = now or datetime.utcnow()
+
+    try:
+        return db.sync_runs.find_one_and_update(
+            get_resumable_query(custodian_id, now),
+            get_claim_update(now),
+            sort=[("startedAt", -1)],
+            return_document=ReturnDocument.AFTER,
+        )
+    except Exception as error:
+        raise CriticalError(
+            f"Error retrieving the last run of publisher _id {custodian_id}: {error}"
+        ) from error
+
+
+def start_run(
+    db: pymongo.database.Database = None,
+    custodian_id: str = "",
+    publisher_name: str = "",
+    modified_since: dict = None,
+    now: datetime = None,
+) -> ObjectId:
+    """
+    Start a new run of a publisher, taking its lease before anything is fetched. Other
+    unfinished runs of the publisher are abandoned, unless one still holds its lease in
+    which case RunInProgressError is raised. Returns the run _id.
+    """
+    now = now or datetime.utcnow()
+
+    try:
+        db.sync_runs.update_many(
+            get_stale_query(custodian_id, now),
+            {"$set": {"status": "abandoned", "updatedAt": now}},
+        )
+
+        live = db.sync_runs.find_one({"publisherId": custodian_id, "status": "running"})
+
+        if not live:
+            return db.sync_runs.insert_one(
+                create_run(custodian_id, publisher_name, modified_since, now)
+            ).inserted_id
+    except DuplicateKeyError:
+        # Another worker started a run first (see indexes.INDEXES)
+        live = {"_id": "started concurrently"}
+    except Exception as error:
+        raise CriticalError(
+            f"Error recording the run of publisher _id {custodian_id}: {error}"
+        ) from error
+
+    raise RunInProgressError(
+        f"Run {live['_id']} of publisher _id {custodian_id} is in progress"
+    )
+
+
+def record_plan(
+    db: pymongo.database.Database = None,
+    run_id: ObjectId = None,
+    plan: dict = None,
+    now: datetime = None,
+) -> None:
+    """
+    Record the plan (see plan.create_sync_plan) of a new or resumed run.
+    """
+    try:
+        db.sync_runs.update_one(
+            {"_id": run_id},
+            {
+                "$set": {
+                    "plan": get_plan_counts(plan),
+                    "updatedAt": now or datetime.utcnow(),
+                }
+            },
+        )
+    except Exception as error:
+        raise CriticalError(f"Error recording the plan of run {run_id}: {error}") from error
+
+
+def finish_run(
+    db: pymongo.database.Database = None,
+    run_id: ObjectId = None,
+    status: str = "completed",
+    summary: dict = None,
+) -> None:
+    """
+    Record the outcome ("completed" or "failed") of a run. The checkpoints of a completed run
+    are no longer needed and are removed; a failed run is resumed by the next trigger.
+    """
+    try:
+        db.sync_runs.update_one(
+            {"_id": run_id},
+            {"$set": get_run_result(status, summary)},
+        )
+
+        if status == "completed":
+            db.sync_run_checkpoints.delete_many({"runId": run_id})
+    except Exception as error:
+        raise CriticalError(f"Error recording the end of run {run_id}: {error}") from error
+
+
+def get_checkpoints(
+    db: pymongo.database.Database = None, run_id: ObjectId = None
+) -> dict:
+    """
+    Get the checkpoints of a run by PID.
+    """
+    try:
+        return {
+            i["pid"]: i
+            for i in db.sync_run_checkpoints.find({"runId": run_id}, {"_id": 0})
+        }
+    except Exception as error:
+        raise CriticalError(
+            f"Error retrieving the checkpoints of run {run_id}: {error}"
+        ) from error
+
+
+def save_checkpoints(
+    db: pymongo.database.Database = None, checkpoints: list = None
+) -> None:
+    """
+    Replace (or add) the checkpoint of each (runId, pid) and renew the lease of their run.
+
+    RunLeaseLostError is raised if the run no longer holds its lease, e.g., it was abandoned
+    because it stopped checkpointing for longer than CHECKPOINT_LEASE.
+    """
+    run_id = checkpoints[0]["runId"]
+
+    try:
+        db.sync_run_checkpoints.bulk_write(
+            get_checkpoint_operations(checkpoints), ordered=False
+        )
+        renewed = db.sync_runs.update_one(
+            {"_id": run_id, "status": "running"},
+            {"$set": {"updatedAt": datetime.utcnow()}},
+        ).matched_count
+    except Exception as error:
+        raise CriticalError(f"Error saving the run checkpoints: {error}") from error
+
+    if not renewed:
+        raise RunLeaseLostError(f"Run {run_id} is no longer running")
+
+
+def get_resumable_query(custodian_id: str = "", now: datetime = None) -> dict:
+    """
+    Get the query matching the resumable runs of a publisher: failed runs, and running runs
+    whose lease has expired, started within CHECKPOINT_MAX_AGE.
+    """
+    now = now or datetime.utcnow()
+
+    return {
+        **get_stale_query(custodian_id, now),
+        "startedAt": {"$gte": now - timedelta(seconds=CHECKPOINT_MAX_AGE)},
+    }
+
+
+def get_stale_query(custodian_id: str = "", now: datetime = None) -> dict:
+    """
+    Get the query matching the unfinished runs of a publisher that no longer hold a lease.
+    """
+    now = now or datetime.utcnow()
+
+    return {
+        "publisherId": custodian_id,
+        "$or": [
+            {"status": "failed"},
+            {
+                "status": "running",
+                "updatedAt": {"$lt": now - timedelta(seconds=CHECKPOINT_LEASE)},
+            },
+        ],
+    }
+
+
+def get_claim_update(now: datetime = None) -> dict:
+    """
+    Get the update claiming a resumable run (a new lease).
+    """
+    return {"$set": {"status": "running", "updatedAt": now}, "$inc": {"resumed": 1}}
+
+
+def create_run(
+    custodian_id: str = "",
+    publisher_name: str = "",
+    modified_since: dict = None,
+    now: datetime = None,
+) -> dict:
+    """
+    Create the sync_runs document of a new run, its plan is recorded once known.
+    """
+    return {
+        "publisherId": custodian_id,
+        "publisherName": publisher_name,
+        "status": "running",
+        # The watermark and mode are kept when the run is resumed
+        "startedAt": now,
+        "updatedAt": now,
+        "modifiedSince": modified_since,
+        "plan": None,
+        "resumed": 0,
+    }
+
+
+def create_checkpoint(
+    run_id: ObjectId = None,
+    pid: str = "",
+    version: str = None,
+    stage: str = "",
+    summary: dict = None,
+) -> dict:
+    """
+    Create the checkpoint of a dataset whose Gateway writes have completed.
+    """
+    return {
+        "runId": run_id,
+        "pid": pid,
+        "version": version,
+        "stage": stage,
+        "summary": summary,
+    }
+
+
+def get_plan_counts(plan: dict = None) -> dict:
+    """
+    Get the numbers of a plan's archived, new and updated datasets (the PIDs of a large
+    catalogue would not fit in a run document).
+    """
+    return {key: len(plan[key]) for key in ["archive", "new", "update"]}
+
+
+def get_run_result(status: str = "", summary: dict = None) -> dict:
+    """
+    Get the update recording the outcome of a run, with counts of its summary.
+    """
+    result = {"status": status, "updatedAt": datetime.utcnow()}
+
+    if summary is not None:
+        result["summary"] = {
+            key: len(value) if isinstance(value, list) else value
+            for key, value in summary.items()
+        }
+
+    return result
+
+
+def get_checkpoint_operations(checkpoints: list = None) -> list:
+    """
+    Get the bulk upserts of a list of checkpoints, keyed on (runId, pid).
+    """
+    return [
+        ReplaceOne({"runId": i["runId"], "pid": i["pid"]}, i, upsert=True)
+        for i in checkpoints
+    ]
+
+
+def skip_completed(jobs: list = None, checkpoints: dict = None, summary: dict = None) -> list:
+    """
+    Get the pipeline jobs (see pipeline.run_pipeline) not completed by a resumed run, adding
+    the datasets it completed to the run's summary. A dataset whose catalogue version changed
+    since it was checkpointed is processed again.
+    """
+    jobs = jobs or []
+    checkpoints = checkpoints or {}
+    versions = {i["persistentId"]: i.get("version") for _, i in jobs}
+    remaining = [
+        job
+        for job in jobs
+        if job[1]["persistentId"] not in checkpoints
+        or checkpoints[job[1]["persistentId"]]["version"] != job[1].get("version")
+    ]
+
+    # Completed datasets may no longer be in the plan, e.g., new datasets are now synced
+    for pid, checkpoint in checkpoints.items():
+        if pid in versions and versions[pid] != checkpoint["version"]:
+            continue
+
+        if checkpoint["stage"] in SUMMARY_STAGES:
+            summary[checkpoint["stage"]].append(checkpoint["summary"])
+        else:
+            summary[checkpoint["stage"]] += 1
+
+    return remaining
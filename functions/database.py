@@ -0,0 +1,239 @@
+"""
+Functions for managing the per-process MongoDB client and monitoring its connection pools.
+"""
+
+import os
+import time
+import logging
+import threading
+import pymongo
+
+from importlib.util import find_spec
+from pymongo import monitoring
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+# Package providing each wire compressor, the driver silently drops compressors not installed
+COMPRESSOR_PACKAGES = {"zstd": "zstandard", "snappy": "snappy", "zlib": "zlib"}
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener, monitoring.CommandListener):
+    """
+    Connection pool and command listener keeping per-server counts of connections in use,
+    checkout wait times and command durations.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.servers = {}
+        self.local = threading.local()
+
+    def stats(self) -> dict:
+        """
+        Get the metrics of each server, with wait and command times in seconds.
+        """
+        with self.lock:
+            return {
+                server: {
+                    **metrics,
+                    "checkout_wait_total": round(metrics["checkout_wait_total"], 3),
+                    "checkout_wait_max": round(metrics["checkout_wait_max"], 3),
+                    "command_time": round(metrics["command_time"], 3),
+                }
+                for server, metrics in self.servers.items()
+            }
+
+    def connection_check_out_started(self, event) -> None:
+        # A checkout completes (or fails) on the thread that started it
+        self.local.started = time.monotonic()
+
+    def connection_checked_out(self, event) -> None:
+        wait = time.monotonic() - getattr(self.local, "started", time.monotonic())
+
+        with self.lock:
+            metrics = self._server(event.address)
+            metrics["in_use"] += 1
+            metrics["checkouts"] += 1
+            metrics["checkout_wait_total"] += wait
+            metrics["checkout_wait_max"] = max(metrics["checkout_wait_max"], wait)
+
+    def connection_check_out_failed(self, event) -> None:
+        with self.lock:
+            self._server(event.address)["checkout_failures"] += 1
+
+    def connection_checked_in(self, event) -> None:
+        with self.lock:
+            metrics = self._server(event.address)
+            metrics["in_use"] = max(0, metrics["in_use"] - 1)
+
+    def connection_created(self, event) -> None:
+        with self.lock:
+            self._server(event.address)["connections_created"] += 1
+
+    def connection_closed(self, event) -> None:
+        with self.lock:
+            self._server(event.address)["connections_closed"] += 1
+
+    def pool_created(self, event) -> None:
+        pass
+
+    def pool_ready(self, event) -> None:
+        pass
+
+    def pool_cleared(self, event) -> None:
+        pass
+
+    def pool_closed(self, event) -> None:
+        pass
+
+    def connection_ready(self, event) -> None:
+        pass
+
+    def started(self, event) -> None:
+        pass
+
+    def succeeded(self, event) -> None:
+        with self.lock:
+            metrics = self._server(event.connection_id)
+            metrics["commands"] += 1
+            metrics["command_time"] += event.duration_micros / 1e6
+
+    def failed(self, event) -> None:
+        with self.lock:
+            metrics = self._server(event.connection_id)
+            metrics["commands"] += 1
+            metrics["command_failures"] += 1
+            metrics["command_time"] += event.duration_micros / 1e6
+
+    def _server(self, address: tuple = None) -> dict:
+        """
+        INTERNAL: get the metrics of a server, creating them on first use (lock held).
+        """
+        server = ":".join(str(i) for i in address) if address else "unknown"
+
+        if server not in self.servers:
+            self.servers[server] = {
+                "in_use": 0,
+                "checkouts": 0,
+                "checkout_wait_total": 0.0,
+                "checkout_wait_max": 0.0,
+                "checkout_failures": 0,
+                "connections_created": 0,
+                "connections_closed": 0,
+                "commands": 0,
+                "command_failures": 0,
+                "command_time": 0.0,
+            }
+
+        return self.servers[server]
+
+
+pool_metrics = PoolMetrics()
+
+
+def get_mongo_uri() -> str:
+    """
+    Get the MongoDB connection string (MONGO_URI and MONGO_DATABASE in the environment).
+    """
+    return os.getenv("MONGO_URI") + "/" + os.getenv("MONGO_DATABASE")
+
+
+def get_client_options() -> dict:
+    """
+    Get the MongoDB client options from the environment, including the pool metrics listener.
+    """
+    options = {
+        "maxPoolSize": int(os.getenv("MONGO_MAX_POOL_SIZE", "100")),
+        "minPoolSize": int(os.getenv("MONGO_MIN_POOL_SIZE", "0")),
+        "connectTimeoutMS": int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "20000")),
+        "serverSelectionTimeoutMS": int(
+            os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "30000")
+        ),
+        "event_listeners": [pool_metrics],
+    }
+
+    # Optional, left to the driver defaults (no limit) unless set
+    for option, variable in [
+        ("socketTimeoutMS", "MONGO_SOCKET_TIMEOUT_MS"),
+        ("waitQueueTimeoutMS", "MONGO_WAIT_QUEUE_TIMEOUT_MS"),
+    ]:
+        if os.getenv(variable):
+            options[option] = int(os.getenv(variable))
+
+    # Wire compression in order of preference, e.g., "zstd,snappy"
+    if compressors := get_compressors(os.getenv("MONGO_COMPRESSORS", "")):
+        options["compressors"] = ",".join(compressors)
+
+    return options
+
+
+def get_compressors(value: str = "") -> list:
+    """
+    Get the wire compressors of a comma separated list whose package is installed, warning
+    about the others.
+    """
+    compressors = []
+
+    for compressor in [i.strip() for i in value.split(",") if i.strip()]:
+        package = COMPRESSOR_PACKAGES.get(compressor)
+
+        if package and find_spec(package):
+            compressors.append(compressor)
+        else:
+            logging.warning(
+                f"Ignoring MongoDB compressor {compressor}: "
+                + (f"the {package} package is not installed" if package else "unsupported")
+            )
+
+    return compressors
+
+
+def get_client() -> pymongo.MongoClient:
+    """
+    Get this process's MongoDB client, creating it on first use.
+
+    A client must not be shared across fork(), so a forked worker (e.g., under gunicorn)
+    creates its own client the first time it needs one.
+    """
+    global _client, _client_pid
+
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            options = get_client_options()
+            _client = pymongo.MongoClient(get_mongo_uri(), **options)
+            _client_pid = os.getpid()
+
+            # Each connection uses the first of these the server also supports
+            logging.info(
+                f"MongoDB wire compressors offered: {options.get('compressors') or 'none'}"
+            )
+
+        return _client
+
+
+def get_db() -> pymongo.database.Database:
+    """
+    Get the Gateway database (MONGO_DATABASE) of this process's MongoDB client.
+    """
+    return get_client()[os.getenv("MONGO_DATABASE")]
+
+
+def close_client() -> None:
+    """
+    Close this process's MongoDB client and its pooled connections.
+    """
+    global _client
+
+    with _client_lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+
+
+def get_mongo_pool_stats() -> dict:
+    """
+    Get the connection pool and command metrics of each MongoDB server, see PoolMetrics.
+    """
+    return pool_metrics.stats()
@@ -0,0 +1,309 @@
+"""
+Asyncio ingestion engine: the same steps as main(), with async HTTP (aiohttp) and MongoDB (motor).
+
+Dataset fetches and MongoDB reads and writes of all ingestions share a single event loop per
+worker process. The catalogue listing, auth headers, schema warm-up, dataset processing and
+mail still run on executor threads. Select it per deployment with INGESTION_ENGINE=asyncio.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import functools
+import threading
+import concurrent.futures
+import aiohttp
+
+from typing import Any
+from datetime import datetime
+
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+
+from .exceptions import *
+from .aio import *
+from .auth import get_publisher_headers, invalidate_client_secret
+from .cache import sweep_response_cache
+from .database import get_mongo_uri, get_client_options, get_mongo_pool_stats
+from .extract import get_datasets
+from .helpers import *
+from .checkpoint import skip_completed
+from .pipeline import run_pipeline_async, WriteBatcher
+from .plan import create_sync_plan
+from .queries import SYNC_STATUS_FIELDS
+from .ratelimit import configure_rate_limiter
+from .send import send_summary_mail, send_auth_error_mail, send_datasets_error_mail
+from .session import DEFAULT_POOL_MAXSIZE, HTTP_TIMEOUT
+from .validate import warm_validators
+
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+_resources = {}
+
+
+def run_async_ingestion(custodian_id: str = "", wait: bool = True) -> Any:
+    """
+    Run the asyncio engine for a custodian on this process's event loop and wait for it.
+
+    With wait=False the ingestion is only started: its future is returned and its outcome is
+    logged when it finishes.
+    """
+    future = asyncio.run_coroutine_threadsafe(_run(custodian_id), _get_loop())
+
+    if wait:
+        return future.result()
+
+    future.add_done_callback(
+        functools.partial(_log_ingestion, custodian_id=custodian_id, started=time.time())
+    )
+
+    return future
+
+
+async def run_ingestion(
+    db: AsyncIOMotorDatabase = None,
+    http: aiohttp.ClientSession = None,
+    custodian_id: str = "",
+) -> None:
+    """
+    Sync metadata for a given publisher/custodian catalogue, see main.main.
+    """
+    loop = asyncio.get_running_loop()
+    publisher = None
+    run_id = None
+
+    async def _in_thread(function, *args, **kwargs):
+        return await loop.run_in_executor(None, functools.partial(function, *args, **kwargs))
+
+    try:
+        publisher = await get_publisher_async(db=db, custodian_id=custodian_id)
+
+        custodian_name = publisher["publisherDetails"]["name"]
+
+        if not publisher["federation"]["active"]:
+            raise Exception(f"Federation is deactivated for custodian {custodian_name}")
+
+        logging.info(f"Initiating asyncio FMA ingestion for {custodian_name}")
+
+        sync_started = datetime.utcnow()
+        run = await get_resumable_run_async(
+            db=db, custodian_id=custodian_id, now=sync_started
+        )
+
+        if run:
+            logging.info(f"Resuming run {run['_id']} for {custodian_name}")
+            run_id = run["_id"]
+            sync_started, modified_since = run["startedAt"], run["modifiedSince"]
+        else:
+            modified_since = get_incremental_params(publisher, now=sync_started)
+            run_id = await start_run_async(
+                db=db,
+                custodian_id=custodian_id,
+                publisher_name=custodian_name,
+                modified_since=modified_since,
+                now=sync_started,
+            )
+
+        if modified_since:
+            logging.info(f"Incremental sync for {custodian_name}: {modified_since}")
+
+        concurrency = get_fetch_concurrency(publisher)
+
+        custodian_datasets_url = (
+            publisher["federation"]["endpoints"]["baseURL"]
+            + publisher["federation"]["endpoints"]["datasets"]
+        )
+        custodian_dataset_url = (
+            publisher["federation"]["endpoints"]["baseURL"]
+            + publisher["federation"]["endpoints"]["dataset"]
+        )
+
+        configure_rate_limiter(
+            custodian_dataset_url,
+            publisher["federation"].get("rateLimit"),
+            max_concurrency=concurrency,
+        )
+
+        headers = await _in_thread(get_publisher_headers, publisher)
+
+        # The catalogue is streamed and decoded page by page on a worker thread
+        custodian_datasets = await _in_thread(
+            get_datasets,
+            custodian_datasets_url,
+            headers,
+            pagination=publisher["federation"].get("pagination"),
+            publisher_name=custodian_name,
+            params=modified_since,
+        )
+        gateway_datasets = await get_gateway_datasets_async(
+            db=db,
+            publisher=custodian_name,
+            pids=[i["persistentId"] for i in custodian_datasets] if modified_since else None,
+            fields=SYNC_STATUS_FIELDS,
+        )
+
+        plan = create_sync_plan(
+            publisher, custodian_datasets, gateway_datasets, modified_since=modified_since
+        )
+
+        archived_datasets = plan["archive"]
+        jobs = [(None, i) for i in plan["new"]] + [(j, i) for i, j in plan["update"]]
+
+        await record_plan_async(db=db, run_id=run_id, plan=plan)
+        writer = WriteBatcher(publisher, run_id=run_id)
+
+        if run:
+            checkpoints = await get_checkpoints_async(db=db, run_id=run_id)
+            jobs = skip_completed(jobs, checkpoints, writer.summary)
+
+        await _in_thread(warm_validators, [i.get("@schema", "") for _, i in jobs])
+
+        latest_datasets = await get_latest_gateway_datasets_async(
+            db=db, pids=[i["pid"] for i, _ in jobs if i]
+        )
+
+        summary = await run_pipeline_async(
+            db=db,
+            http=http,
+            publisher=publisher,
+            url=custodian_dataset_url,
+            headers=headers,
+            jobs=jobs,
+            latest_datasets=latest_datasets,
+            max_workers=concurrency,
+            publisher_name=custodian_name,
+            writer=writer,
+        )
+
+        logging.info(f"MongoDB connection pools: {get_mongo_pool_stats()}")
+        logging.info(f"Response cache: {await _in_thread(sweep_response_cache)}")
+
+        if len(archived_datasets) > 0:
+            archived = await archive_gateway_datasets_async(
+                db=db, archived_datasets=archived_datasets, previous_versions=[]
+            )
+            logging.info(
+                f"Archived {len(archived_datasets)} datasets for {custodian_name}: "
+                f"{archived['modified']} versions archived in {len(archived['chunks'])} chunks"
+            )
+
+        if not summary["fetch_failed"]:
+            await update_sync_watermark_async(
+                db=db,
+                custodian_id=custodian_id,
+                watermark=sync_started,
+                full_sync=not modified_since,
+            )
+
+        await finish_run_async(db=db, run_id=run_id, summary=summary)
+
+        if any(
+            len(datasets) > 0
+            for datasets in [
+                archived_datasets,
+                summary["new"],
+                summary["updated"],
+                summary["invalid"],
+                summary["unsupported_version"],
+            ]
+        ):
+            try:
+                await _in_thread(
+                    send_summary_mail,
+                    publisher=publisher,
+                    archived_datasets=archived_datasets,
+                    new_datasets=summary["new"],
+                    updated_datasets=summary["updated"],
+                    failed_validation=summary["invalid"],
+                    unsupported_version_datasets=summary["unsupported_version"],
+                )
+            except Exception as error:
+                logging.error(error)
+
+    except (CriticalError, RequestError, AuthError) as error:
+        if isinstance(error, AuthError):
+            invalidate_client_secret(publisher["federation"]["auth"]["secretKey"])
+            await _in_thread(send_auth_error_mail, publisher=publisher, url=error.__url__())
+
+        if isinstance(error, RequestError):
+            await _in_thread(
+                send_datasets_error_mail, publisher=publisher, url=error.__url__()
+            )
+
+        if run_id:
+            try:
+                await finish_run_async(db=db, run_id=run_id, status="failed")
+            except CriticalError as run_error:
+                logging.error(run_error)
+
+        await update_publisher_async(db, status=False, custodian_id=custodian_id)
+        raise
+
+    except (RunInProgressError, RunLeaseLostError):
+        raise
+
+    except Exception:
+        if run_id:
+            try:
+                await finish_run_async(db=db, run_id=run_id, status="failed")
+            except CriticalError as run_error:
+                logging.error(run_error)
+        raise
+
+
+async def _run(custodian_id: str = "") -> None:
+    """
+    INTERNAL: run an ingestion with the event loop's shared MongoDB client and HTTP session.
+    """
+    if "db" not in _resources:
+        client = AsyncIOMotorClient(get_mongo_uri(), **get_client_options())
+        _resources["db"] = client[os.getenv("MONGO_DATABASE")]
+
+    if "http" not in _resources:
+        _resources["http"] = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit_per_host=int(
+                    os.getenv("HTTP_POOL_MAXSIZE", str(DEFAULT_POOL_MAXSIZE))
+                )
+            ),
+            timeout=aiohttp.ClientTimeout(
+                total=None, sock_connect=HTTP_TIMEOUT, sock_read=HTTP_TIMEOUT
+            ),
+        )
+
+    await run_ingestion(_resources["db"], _resources["http"], custodian_id)
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    """
+    INTERNAL: get this process's event loop, starting it on a daemon thread on first use.
+    """
+    global _loop, _loop_pid
+
+    with _loop_lock:
+        # A forked worker must not reuse its parent's loop (or its clients)
+        if _loop is None or _loop_pid != os.getpid():
+            _resources.clear()
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            threading.Thread(
+                target=_loop.run_forever, name="ingestion-engine", daemon=True
+            ).start()
+
+        return _loop
+
+
+def _log_ingestion(
+    future: concurrent.futures.Future = None, custodian_id: str = "", started: float = 0.0
+) -> None:
+    """
+    INTERNAL: log the outcome of an ingestion started by run_async_ingestion.
+    """
+    if future.cancelled():
+        logging.error(f"FMA ingestion for {custodian_id} was cancelled")
+    elif error := future.exception():
+        logging.critical(f"FMA ingestion for {custodian_id} failed: {error}")
+    else:
+        logging.info(f"FMA ingestion for {custodian_id} completed")
+        logging.info(f"Run time: {round(time.time() - started, 2)} seconds")
@@ -46,3 +46,29 @@ class RequestError(RequestException):
 
     def __url__(self):
         return self.url
+
+
+class RunInProgressError(Exception):
+    """
+    Exception raised when another run of the publisher still holds its lease.
+    """
+
+    def __init__(self, message: str = ""):
+        self.message = message
+        super().__init__(self, message)
+
+    def __str__(self):
+        return self.message
+
+
+class RunLeaseLostError(Exception):
+    """
+    Exception raised when a run no longer holds its lease, e.g., it was abandoned.
+    """
+
+    def __init__(self, message: str = ""):
+        self.message = message
+        super().__init__(self, message)
+
+    def __str__(self):
+        return self.message
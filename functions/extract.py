@@ -1,47 +1,166 @@
 """
 Functions for retrieving datasets or a dataset from the target server.
 """
-import requests
+import time
+import codecs
 import logging
 import json
+import requests
 from json.decoder import JSONDecodeError
+from typing import Any
+from urllib.parse import urljoin
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 from .exceptions import *
+from .session import get_session, HTTP_TIMEOUT
+from .cache import *
+from .audit import *
+from .ratelimit import *
+
+# Default number of concurrent single dataset requests made to a custodian
+DEFAULT_FETCH_CONCURRENCY = 4
+# Catalogue fields required to compare custodian datasets with the Gateway
+CATALOGUE_FIELDS = ["persistentId", "version", "@schema", "name"]
+
+_decoder = json.JSONDecoder()
 
-def get_datasets(url: str = "", headers: dict = None) -> list:
+def get_datasets(
+    url: str = "",
+    headers: dict = None,
+    pagination: dict = None,
+    publisher_name: str = "",
+    params: dict = None,
+) -> list:
     """
     GET: extract the list of datasets from the target server.
+
+    Only the catalogue fields needed to compare datasets with the Gateway are kept, see
+    iter_datasets for the supported pagination styles.
     """
+    return list(iter_datasets(url, headers, pagination, publisher_name, params))
 
-    response = requests.get(url, headers=headers)
-    response.encoding = 'utf-8'
 
-    if response.status_code == 200:
-        # data = response.json()
-        try:
-            data = response.json()
-        except JSONDecodeError:
-            print('Response error decoding ::: get_datasets')
+def iter_datasets(
+    url: str = "",
+    headers: dict = None,
+    pagination: dict = None,
+    publisher_name: str = "",
+    params: dict = None,
+):
+    """
+    GET: incrementally extract the datasets from the target server, page by page.
 
-        logging.info(json.dumps(data, ensure_ascii=True).encode("ascii", "replace"))
+    Each page is decoded as it streams in, yielding one catalogue entry at a time reduced to
+    the CATALOGUE_FIELDS. The pagination dict (federation.pagination) selects the style:
+        {"type": "next_link", "nextKey": "links.next"} (falls back to a Link header)
+        {"type": "offset", "offsetParam": "offset", "limitParam": "limit", "limit": 100,
+         "totalKey": "query.total"}
+        {"type": "cursor", "cursorParam": "cursor", "cursorKey": "nextCursor"}
+    and may override "itemsKey" (default "items") and "maxPages" (default 10000). Offset
+    pages end at an empty page, or once the total at "totalKey" (if given) is listed, as a
+    custodian may cap its pages below the limit asked for. The raw pages are audited as they
+    are read, see PayloadAudit.
 
-        return data["items"]
+    Query params (e.g., a modified-since filter) are sent with the first page and carried
+    over to later offset/cursor pages; next links are expected to include them already.
+    """
+    pagination = pagination or {}
+    style = pagination.get("type")
+    items_key = pagination.get("itemsKey", "items")
 
-    if response.status_code in [401, 403]:
-        raise AuthError(
-            f"Authorisation error: unauthorised {response.status_code} error was received from {url}",
-            url=url,
-        )
+    page_url = url
+    base_params = dict(params or {})
+    params = dict(base_params)
+    limit = int(pagination.get("limit", 100))
+
+    if style == "offset":
+        params = {
+            **base_params,
+            pagination.get("offsetParam", "offset"): 0,
+            pagination.get("limitParam", "limit"): limit,
+        }
+
+    listed = 0
+
+    for page in range(int(pagination.get("maxPages", 10000))):
+        meta = {}
+        count = 0
+        started = time.monotonic()
+
+        with _get(page_url, headers, params=params, stream=True) as response:
+            if response.status_code in [401, 403]:
+                raise AuthError(
+                    f"Authorisation error: unauthorised {response.status_code} error was received from {url}",
+                    url=url,
+                )
+
+            if response.status_code != 200:
+                raise RequestError(
+                    f"Error extracting list of datasets: a status code of {response.status_code} was received from {url}",
+                    url=url,
+                )
+
+            audit = PayloadAudit(
+                "datasets", f"page-{page + 1}", publisher_name, started=started
+            )
+
+            try:
+                for item in _iter_json_items(
+                    _iter_audited_text(response, audit),
+                    items_key=items_key,
+                    meta=meta,
+                ):
+                    count += 1
+                    if not isinstance(item, dict):
+                        logging.warning(f"Skipping catalogue entry {item!r} from {url}")
+                        continue
+                    yield _project_catalogue_entry(item)
+            except (KeyError, ValueError, TypeError) as error:
+                raise RequestError(
+                    f"Error decoding list of datasets received from {url}: {error}",
+                    url=url,
+                ) from error
+            finally:
+                audit.close()
+
+        logging.info(f"Retrieved {count} datasets from {response.url}")
+        listed += count
+
+        if style == "next_link":
+            next_url = _get_path(meta, pagination.get("nextKey", "next")) or (
+                response.links.get("next", {}).get("url")
+            )
+            if not next_url:
+                return
+            page_url = urljoin(response.url, next_url)
+            params = {}
+        elif style == "offset":
+            total = _get_path(meta, pagination.get("totalKey", ""))
+            if not count or (isinstance(total, int) and listed >= total):
+                return
+            params[pagination.get("offsetParam", "offset")] += count
+        elif style == "cursor":
+            cursor = _get_path(meta, pagination.get("cursorKey", "nextCursor"))
+            if not cursor:
+                return
+            params = {**base_params, pagination.get("cursorParam", "cursor"): cursor}
+        else:
+            return
 
     raise RequestError(
-        f"Error extracting list of datasets: a status code of {response.status_code} was received from {url}",
-        url=url,
+        f"Error extracting list of datasets: page limit exceeded for {url}", url=url
     )
 
 
-def get_dataset(url: str = "", headers: dict = None, dataset_id: str = ""):
+def get_dataset(
+    url: str = "", headers: dict = None, dataset_id: str = "", publisher_name: str = ""
+):
     """
     GET: extract a single dataset from the target server.
+
+    If a publisher name is given, the response is cached on disk and later requests are made
+    conditional on its ETag/Last-Modified, so that a 304 is served from the cache.
     """
 
     updated_url = ''
@@ -54,18 +173,44 @@ def get_dataset(url: str = "", headers: dict = None, dataset_id: str = ""):
 
     updated_url = url.replace("{id}", str(dataset_id))
     
-    print("get dataset url", updated_url)
+    logging.debug(f"Getting dataset from {updated_url}")
 
-    response = requests.get(updated_url, headers=headers)
+    cached = get_cached_response(publisher_name, dataset_id) if publisher_name else None
+    started = time.monotonic()
+
+    response = _get(
+        updated_url, headers, extra_headers=get_conditional_headers(cached)
+    )
     response.encoding = 'utf-8'
 
+    if response.status_code == 304 and cached:
+        logging.info(f"Dataset {dataset_id} not modified, using cached response")
+
+        return json.loads(cached["body"])
+
     if response.status_code == 200:
+        audit_payload(
+            "dataset", dataset_id, response.content, publisher_name, started=started
+        )
+
         try:
             data = response.json()
-        except JSONDecodeError:
-            print('Response error decoding ::: get_dataset')
+        except ValueError as error:
+            logging.error(f"Error decoding dataset {dataset_id}: {error}")
+            raise RequestError(
+                f"Error decoding dataset {dataset_id}: {error}", url=url
+            ) from error
 
-        logging.info(json.dumps(data, ensure_ascii=True).encode("ascii", "replace"))
+        if publisher_name and (
+            response.headers.get("ETag") or response.headers.get("Last-Modified")
+        ):
+            set_cached_response(
+                publisher_name,
+                dataset_id,
+                response.content,
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified"),
+            )
 
         return data
 
@@ -76,3 +221,254 @@ def get_dataset(url: str = "", headers: dict = None, dataset_id: str = ""):
         )
 
     raise RequestError(f"A status code of {response.status_code} was received", url=url)
+
+
+def fetch_datasets(
+    url: str = "",
+    headers: dict = None,
+    dataset_ids: list = None,
+    max_workers: int = DEFAULT_FETCH_CONCURRENCY,
+    publisher_name: str = "",
+) -> list:
+    """
+    GET: extract several datasets from the target server concurrently.
+
+    Returns a list of (dataset, error) tuples in the same order as dataset_ids, where error is
+    the RequestError raised for a failed fetch. Any other error (e.g., AuthError) is raised.
+    """
+    return list(
+        iter_fetch_datasets(url, headers, dataset_ids, max_workers, publisher_name)
+    )
+
+
+def iter_fetch_datasets(
+    url: str = "",
+    headers: dict = None,
+    dataset_ids: list = None,
+    max_workers: int = DEFAULT_FETCH_CONCURRENCY,
+    publisher_name: str = "",
+):
+    """
+    GET: extract several datasets concurrently, yielding (dataset, error) tuples in the order
+    of dataset_ids, see fetch_datasets.
+
+    At most twice max_workers datasets are requested ahead of the one being consumed, so
+    memory does not grow with the number of datasets.
+    """
+
+    def _fetch(dataset_id: str = "") -> tuple:
+        try:
+            return get_dataset(url, headers, dataset_id, publisher_name), None
+        except RequestError as error:
+            return None, error
+
+    max_workers = max(1, max_workers)
+    futures = deque()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            for dataset_id in dataset_ids or []:
+                futures.append(executor.submit(_fetch, dataset_id))
+
+                if len(futures) >= 2 * max_workers:
+                    yield futures.popleft().result()
+
+            while futures:
+                yield futures.popleft().result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def _get(
+    url: str = "", headers: Any = None, extra_headers: dict = None, **kwargs
+) -> requests.Response:
+    """
+    INTERNAL: GET a url from the target server with the given auth headers.
+
+    headers is either a dict or a provider (see auth.get_oauth_headers) called for the headers
+    of each request; with a provider, a 401 is retried once with refreshed headers.
+    """
+    request_headers = headers() if callable(headers) else headers or {}
+
+    response = _send(url, {**request_headers, **(extra_headers or {})}, **kwargs)
+
+    if response.status_code == 401 and callable(headers):
+        response.close()
+        request_headers = headers(stale=request_headers)
+
+        response = _send(url, {**request_headers, **(extra_headers or {})}, **kwargs)
+
+    return response
+
+
+def _send(url: str = "", headers: dict = None, **kwargs) -> requests.Response:
+    """
+    INTERNAL: send a GET through the rate limiter for the url's host, retrying 429/503
+    responses after their Retry-After (up to the limiter's max_retries). Connection errors
+    and timeouts (after HTTP_TIMEOUT seconds) are raised as a RequestError.
+    """
+    limiter = get_rate_limiter(url)
+
+    for attempt in range(limiter.max_retries + 1):
+        limiter.acquire()
+        started = time.monotonic()
+
+        try:
+            response = get_session().get(
+                url, headers=headers, timeout=HTTP_TIMEOUT, **kwargs
+            )
+        except requests.RequestException as error:
+            limiter.release()
+            raise RequestError(f"Error requesting {url}: {error}", url=url) from error
+        except Exception:
+            limiter.release()
+            raise
+
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        limiter.release(response.status_code, time.monotonic() - started, retry_after)
+
+        if (
+            response.status_code not in [429, 503]
+            or attempt == limiter.max_retries
+            or (retry_after or 0) > MAX_RETRY_DELAY
+        ):
+            return response
+
+        logging.warning(
+            f"{response.status_code} received from {url}, retrying (attempt {attempt + 1})"
+        )
+        response.close()
+
+    return response
+
+
+def _iter_audited_text(response=None, audit: PayloadAudit = None):
+    """
+    INTERNAL: stream a response body as UTF-8 text, passing the raw bytes to the audit.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    for chunk in response.iter_content(chunk_size=65536):
+        audit.update(chunk)
+        yield decoder.decode(chunk)
+
+    yield decoder.decode(b"", final=True)
+
+
+def _project_catalogue_entry(item: dict = None) -> dict:
+    """
+    INTERNAL: reduce a catalogue entry to the fields required to compare it with the Gateway.
+    """
+    entry = {key: item[key] for key in CATALOGUE_FIELDS if key in item}
+
+    if isinstance(item.get("summary"), dict) and "title" in item["summary"]:
+        entry["summary"] = {"title": item["summary"]["title"]}
+
+    return entry
+
+
+def _get_path(data: dict = None, path: str = "") -> Any:
+    """
+    INTERNAL: get a value from a dict given a dot-separated path, or None if it is missing.
+    """
+    for key in path.split("."):
+        if not isinstance(data, dict) or key not in data:
+            return None
+        data = data[key]
+    return data
+
+
+def _iter_json_items(chunks=None, items_key: str = "items", meta: dict = None):
+    """
+    INTERNAL: incrementally decode a JSON object from an iterable of text chunks.
+
+    Elements of the top-level items array are yielded one at a time while only the current
+    element is held in memory; other top-level values are collected into meta. Raises
+    KeyError if the object has no items array and ValueError if the JSON is malformed.
+    """
+    chunks = iter(chunks)
+    buffer = ""
+    position = 0
+    found = False
+
+    def _fill() -> bool:
+        nonlocal buffer, position
+        for chunk in chunks:
+            if chunk:
+                buffer = buffer[position:] + chunk
+                position = 0
+                return True
+        return False
+
+    def _peek() -> str:
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\n\r":
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if not _fill():
+                raise ValueError("unexpected end of JSON document")
+
+    def _decode() -> Any:
+        nonlocal position
+        _peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(buffer, position)
+            except JSONDecodeError:
+                if _fill():
+                    continue
+                raise
+            # A number at the end of the buffer may continue in the next chunk
+            if (
+                isinstance(value, (int, float))
+                and (end == len(buffer) or buffer[end] in "0123456789.eE+-")
+                and _fill()
+            ):
+                continue
+            position = end
+            return value
+
+    if _peek() != "{":
+        raise ValueError("expected a JSON object")
+    position += 1
+
+    if _peek() == "}":
+        raise KeyError(items_key)
+
+    while True:
+        key = _decode()
+        if _peek() != ":":
+            raise ValueError(f"expected ':' after key {key}")
+        position += 1
+
+        if key == items_key and _peek() == "[":
+            found = True
+            position += 1
+            if _peek() == "]":
+                position += 1
+            else:
+                while True:
+                    yield _decode()
+                    char = _peek()
+                    position += 1
+                    if char == "]":
+                        break
+                    if char != ",":
+                        raise ValueError(f"expected ',' or ']' in {items_key}")
+        elif meta is not None:
+            meta[key] = _decode()
+        else:
+            _decode()
+
+        char = _peek()
+        position += 1
+        if char == "}":
+            break
+        if char != ",":
+            raise ValueError("expected ',' or '}'")
+
+    if not found:
+        raise KeyError(items_key)
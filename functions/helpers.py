@@ -2,97 +2,280 @@
 Helper functions for comparing lists and transforming data.
 """
 
+import os
 import json
+import hashlib
 import logging
 import string
 import numpy as np
 
-from typing import Tuple
+from typing import Any, Tuple
 from datetime import datetime
 from collections.abc import Mapping
 
 from .exceptions import CriticalError
+from .cache import get_cached_transform, set_cached_transform
+from .extract import DEFAULT_FETCH_CONCURRENCY
 
 logging.basicConfig(level=logging.INFO)
 
+# Seconds between full catalogue reconciliations of publishers synced incrementally
+FULL_SYNC_INTERVAL = int(os.getenv("FULL_SYNC_INTERVAL", "86400"))
+# Bump whenever the output of transform_dataset changes, invalidating cached transforms
+TRANSFORMER_VERSION = "1"
 
-def datasets_to_archive(
-    custodian_datasets: list = None, gateway_datasets: list = None
-) -> np.array:
+
+def to_catalogue_columns(datasets: list = None, pid_key: str = "persistentId") -> dict:
     """
-    Determine which datasets to archive within the Gateway.
+    Load catalogue or sync entries into compact columnar arrays.
+
+    PIDs and versions are fixed-width UTF-8 byte arrays; statuses and schemas are categorical
+    (integer codes into the "statuses"/"schemas" category arrays).
     """
-    datasets_to_archive_ids = np.array(
-        list(
-            set(np.array(list(map(lambda x: x["pid"], gateway_datasets))))
-            - set(np.array(list(map(lambda x: x["persistentId"], custodian_datasets))))
-        )
+    datasets = datasets if datasets is not None else []
+
+    statuses, status_codes = np.unique(
+        np.array([str(i.get("status", "")) for i in datasets], dtype=str),
+        return_inverse=True,
+    )
+    schemas, schema_codes = np.unique(
+        np.array([str(i.get("@schema", "")) for i in datasets], dtype=str),
+        return_inverse=True,
     )
 
-    if len(datasets_to_archive_ids) > 0:
-        return np.array(
-            list(
-                filter(
-                    lambda x: x["pid"] in datasets_to_archive_ids,
-                    gateway_datasets,
-                )
-            )
-        )
+    return {
+        "pid": np.array(
+            [str(i[pid_key]).encode("utf-8") for i in datasets], dtype=np.bytes_
+        ),
+        "version": np.array(
+            [str(i.get("version", "")).encode("utf-8") for i in datasets],
+            dtype=np.bytes_,
+        ),
+        "status": status_codes.astype(np.int32),
+        "statuses": statuses,
+        "schema": schema_codes.astype(np.int32),
+        "schemas": schemas,
+    }
 
-    return []
 
+def diff_catalogue_columns(custodian: dict = None, gateway: dict = None) -> dict:
+    """
+    Compare custodian and Gateway catalogue columns (see to_catalogue_columns) with vectorised
+    set operations and a sorted-merge join on PID.
 
-def extract_new_datasets(
-    custodian_datasets: list = None, gateway_datasets: list = None
-) -> np.array:
+    Returns index arrays: "new" (into custodian), "archived" (into gateway), the aligned
+    "overlap_custodian"/"overlap_gateway" pairs in Gateway order, and the "changed" mask over
+    those pairs marking datasets that need fetching (status not ok/validation_failed, or a
+    different version). Only the first entry of a repeated PID is used.
     """
-    Determine which datasets are new to the Gateway.
+    custodian_pids, custodian_first = np.unique(custodian["pid"], return_index=True)
+    gateway_pids, gateway_first = np.unique(gateway["pid"], return_index=True)
+
+    in_gateway = np.isin(custodian_pids, gateway_pids, assume_unique=True)
+    in_custodian = np.isin(gateway_pids, custodian_pids, assume_unique=True)
+
+    # Both unique arrays are sorted, so overlapping PIDs line up position by position
+    overlap_custodian = custodian_first[in_gateway]
+    overlap_gateway = gateway_first[in_custodian]
+
+    order = np.argsort(overlap_gateway, kind="stable")
+    overlap_custodian = overlap_custodian[order]
+    overlap_gateway = overlap_gateway[order]
+
+    settled = np.isin(
+        gateway["statuses"][gateway["status"][overlap_gateway]]
+        if len(gateway["statuses"])
+        else np.array([], dtype=str),
+        ["ok", "validation_failed"],
+    )
+    same_version = (
+        custodian["version"][overlap_custodian] == gateway["version"][overlap_gateway]
+    )
+
+    return {
+        "new": np.sort(custodian_first[~in_gateway]),
+        "archived": np.sort(gateway_first[~in_custodian]),
+        "overlap_custodian": overlap_custodian,
+        "overlap_gateway": overlap_gateway,
+        "changed": ~(settled & same_version),
+    }
+
+
+def diff_catalogues(
+    custodian_datasets: list = None,
+    gateway_datasets: list = None,
+    changed_only: bool = False,
+) -> Tuple[list, list, list]:
     """
-    new_datasets_ids = np.array(
-        list(
-            set(np.array(list(map(lambda x: x["persistentId"], custodian_datasets))))
-            - set(np.array(list(map(lambda x: x["pid"], gateway_datasets))))
-        )
+    Compare the custodian catalogue with the Gateway sync entries.
+
+    Returns (new, archived, overlapping): custodian datasets new to the Gateway, Gateway
+    datasets no longer in the catalogue, and (custodian dataset, Gateway dataset) pairs
+    sharing a PID in Gateway order - only those needing an update if changed_only. Only the
+    first entry of a repeated PID is kept.
+    """
+    diff = diff_catalogue_columns(
+        to_catalogue_columns(custodian_datasets, pid_key="persistentId"),
+        to_catalogue_columns(gateway_datasets, pid_key="pid"),
     )
 
-    if len(new_datasets_ids) > 0:
-        return np.array(
-            list(
-                filter(
-                    lambda x: x["persistentId"] in new_datasets_ids,
-                    custodian_datasets,
-                )
-            )
-        )
+    overlap_custodian = diff["overlap_custodian"]
+    overlap_gateway = diff["overlap_gateway"]
+
+    if changed_only:
+        overlap_custodian = overlap_custodian[diff["changed"]]
+        overlap_gateway = overlap_gateway[diff["changed"]]
+
+    new = [custodian_datasets[i] for i in diff["new"]]
+    archived = [gateway_datasets[i] for i in diff["archived"]]
+    overlapping = [
+        (custodian_datasets[i], gateway_datasets[j])
+        for i, j in zip(overlap_custodian, overlap_gateway)
+    ]
 
-    return []
+    return new, archived, overlapping
+
+
+def datasets_to_archive(
+    custodian_datasets: list = None, gateway_datasets: list = None
+) -> list:
+    """
+    Determine which datasets to archive within the Gateway.
+    """
+    return diff_catalogues(custodian_datasets, gateway_datasets)[1]
+
+
+def extract_new_datasets(
+    custodian_datasets: list = None, gateway_datasets: list = None
+) -> list:
+    """
+    Determine which datasets are new to the Gateway.
+    """
+    return diff_catalogues(custodian_datasets, gateway_datasets)[0]
 
 
 def extract_overlapping_datasets(
     custodian_datasets: list = None, gateway_datasets: list = None
-) -> Tuple[np.array, np.array]:
+) -> Tuple[list, list]:
     """
     Extract a new array of common datasets that overlap between two lists.
     """
-    overlapping_datasets_ids = np.array(
-        list(
-            set(
-                np.array(list(map(lambda x: x["persistentId"], custodian_datasets)))
-            ).intersection(
-                set(np.array(list(map(lambda x: x["pid"], gateway_datasets))))
-            )
+    overlapping = diff_catalogues(custodian_datasets, gateway_datasets)[2]
+
+    return [i for i, _ in overlapping], [i for _, i in overlapping]
+
+
+def get_fetch_concurrency(publisher: dict = None) -> int:
+    """
+    Get the maximum number of concurrent dataset requests allowed for a given publisher.
+    """
+    try:
+        concurrency = int(
+            publisher["federation"].get("concurrency", DEFAULT_FETCH_CONCURRENCY)
         )
-    )
+    except (TypeError, ValueError):
+        return DEFAULT_FETCH_CONCURRENCY
+
+    return max(1, concurrency)
+
+
+def get_incremental_params(publisher: dict = None, now: datetime = None) -> dict:
+    """
+    Get the modified-since query params for an incremental sync, or None if a full sync is due.
+
+    Incremental syncs need federation.endpoints.modifiedSince (the custodian's query parameter)
+    and the watermark of a previous successful sync. A full sync still runs at least every
+    federation.fullSyncInterval (default FULL_SYNC_INTERVAL) seconds to archive deletions.
+    """
+    federation = publisher["federation"]
+    param = federation["endpoints"].get("modifiedSince")
+    watermark = federation.get("syncWatermark")
+    last_full_sync = federation.get("lastFullSync")
+    now = now or datetime.utcnow()
+
+    if not param or not watermark or not last_full_sync:
+        return None
+
+    if (now - last_full_sync).total_seconds() >= federation.get(
+        "fullSyncInterval", FULL_SYNC_INTERVAL
+    ):
+        return None
+
+    return {param: watermark.strftime("%Y-%m-%dT%H:%M:%SZ")}
+
 
-    custodian_versions = _extract_datasets_by_id(
-        custodian_datasets, overlapping_datasets_ids
+def get_content_hash(dataset: dict = None) -> str:
+    """
+    Get a canonical SHA-256 hash of a datasetv2 object, independent of key order and whitespace.
+    """
+    canonical = json.dumps(
+        dataset, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str
     )
 
-    gateway_versions = _extract_datasets_by_id(
-        gateway_datasets, overlapping_datasets_ids
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def is_content_unchanged(
+    sync_entry: dict = None, custodian_version: dict = None, content_hash: str = ""
+) -> bool:
+    """
+    Determine whether a fetched dataset matches the content last synced to the Gateway.
+
+    Sync entries from before content hashes were recorded fall back to comparing versions.
+    """
+    if not sync_entry or sync_entry.get("status") != "ok":
+        return False
+
+    if sync_entry.get("contentHash"):
+        return sync_entry["contentHash"] == content_hash
+
+    return sync_entry.get("version") == custodian_version.get("version")
+
+
+def transform_dataset_cached(
+    publisher: dict = None,
+    dataset: dict = None,
+    pid: str = "",
+    previous_version: dict = None,
+    content_hash: str = None,
+) -> dict:
+    """
+    Transform a dataset (see transform_dataset), reusing the result of a previous run for the
+    same content, publisher configuration and transformer version. Cached transforms are
+    evicted with the response cache (see cache.sweep_response_cache).
+    """
+    # Every publisher field read by transform_dataset must be part of the key
+    key = hashlib.sha256(
+        json.dumps(
+            [
+                content_hash or get_content_hash(dataset),
+                str(publisher["_id"]),
+                bool(publisher["uses5Safes"]),
+                publisher.get("name", ""),
+                TRANSFORMER_VERSION,
+                pid,
+                bool(previous_version and previous_version["activeflag"] == "active"),
+            ]
+        ).encode("utf-8")
+    ).hexdigest()
+
+    if cached := get_cached_transform(key):
+        # Timestamps record this ingestion, not the one the transform was cached by
+        now = datetime.now()
+        for field in ["created", "updated", "submitted", "published"]:
+            if field in cached["timestamps"]:
+                cached["timestamps"][field] = now
+        cached["createdAt"] = now
+        cached["updatedAt"] = now
+
+        return cached
+
+    transformed = transform_dataset(
+        publisher=publisher, dataset=dataset, pid=pid, previous_version=previous_version
     )
+    set_cached_transform(key, transformed)
 
-    return custodian_versions, gateway_versions
+    return transformed
 
 
 def transform_dataset(
@@ -106,7 +289,7 @@ def transform_dataset(
     """
     try:
         dataset = _merge_dictionaries(dataset)
-        dataset = json.loads(json.dumps(dataset, ensure_ascii=True).encode("ascii", "replace"))
+        dataset = _sanitise(dataset)
 
         # Add publisher identifier to link dataset to Gateway team
         dataset["summary"]["publisher"]["identifier"] = str(publisher["_id"])
@@ -251,13 +434,19 @@ def transform_dataset(
 
 
 def create_sync_array(
-    datasets: np.array = None, sync_status: str = "ok", publisher: dict = None
+    datasets: np.array = None,
+    sync_status: str = "ok",
+    publisher: dict = None,
+    content_hashes: dict = None,
 ) -> list:
     """
     Given a list of datasets, create a list of sync objects with a given status for addition to the Gateway sync collection.
+
+    The content hash of each PID in content_hashes is recorded for change detection.
     """
     pid_key = "pid"
     version_key = "datasetVersion"
+    content_hashes = content_hashes or {}
 
     if "pid" not in datasets[0].keys():
         pid_key = "persistentId"
@@ -274,6 +463,11 @@ def create_sync_array(
                 "version": x[version_key],
                 "status": sync_status,
                 "lastSync": datetime.now(),
+                **(
+                    {"contentHash": content_hashes[x[pid_key]]}
+                    if x[pid_key] in content_hashes
+                    else {}
+                ),
             },
             datasets,
         )
@@ -285,7 +479,7 @@ def _generate_question_answers(dataset: dict = None) -> dict:
     INTERNAL: generate the Gateway questionAnswers field given a datasetv2 object.
     """
     question_answers = {}
-    dataset = json.loads(json.dumps(dataset, ensure_ascii=True).encode("ascii", "replace"))
+    dataset = _sanitise(dataset)
 
     # Summary
     if _keys_exist(dataset, "summary", "title"):
@@ -494,6 +688,46 @@ def _generate_question_answers(dataset: dict = None) -> dict:
     return question_answers
 
 
+def _sanitise(value: Any = None) -> Any:
+    """
+    INTERNAL: replace the characters of a dataset's strings (values and keys) that cannot be
+    stored (e.g., lone surrogates) with "?", in place.
+
+    The dataset is walked once; ASCII strings are checked without being copied, and a new
+    string is only created where one actually contains such characters.
+    """
+    if isinstance(value, str):
+        if value.isascii():
+            return value
+        try:
+            value.encode("utf-8")
+            return value
+        except UnicodeEncodeError:
+            return value.encode("utf-8", "replace").decode("utf-8")
+
+    if isinstance(value, dict):
+        renamed = False
+
+        for key, item in value.items():
+            sanitised = _sanitise(item)
+            if sanitised is not item:
+                value[key] = sanitised
+            renamed = renamed or _sanitise(key) is not key
+
+        if renamed:
+            items = [(_sanitise(key), item) for key, item in value.items()]
+            value.clear()
+            value.update(items)
+
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            sanitised = _sanitise(item)
+            if sanitised is not item:
+                value[index] = sanitised
+
+    return value
+
+
 def _keys_exist(element: dict = None, *keys) -> bool:
     """
     INTERNAL: helper function to determine if a key exists in a dict.
@@ -507,30 +741,6 @@ def _keys_exist(element: dict = None, *keys) -> bool:
     return True
 
 
-def _extract_datasets_by_id(datasets: list = None, ids: np.array = None) -> np.array:
-    """
-    INTERNAL: given a list of IDs, extract the relevant datasets from the datasets list as a separate list.
-    """
-    if "pid" in datasets[0].keys():
-        return np.array(
-            list(
-                filter(
-                    lambda x: x["pid"] in ids,
-                    datasets,
-                )
-            )
-        )
-    else:
-        return np.array(
-            list(
-                filter(
-                    lambda x: x["persistentId"] in ids,
-                    datasets,
-                )
-            )
-        )
-
-
 def _flatten(dictionary: dict = None, parent_key: str = "", sep: str = "/") -> dict:
     """
     INTERNAL: flatten a dict to a single dimension.
@@ -561,102 +771,128 @@ def _unflatten(dictionary: dict = None, sep: str = "/") -> dict:
     return result
 
 
-def _merge_dictionaries(dictionary: dict = None) -> dict:
+def _compile_template(template: dict = None) -> list:
     """
-    INTERNAL: merge two dictionaries, creating an empty field where missing from data.
-
-    This function is neccessary because the Gateway EXPECTS fields which are NOT required
-    by the validation schema.
-    """
-    # This is the minimum viable datasetv2 that is required for the Gateway to function
-    minimum_viable_datasetv2 = {
-        "identifier": "",
-        "version": "",
-        "issued": "",
-        "modified": "",
-        "revisions": [],
-        "summary": {
-            "title": "",
-            "abstract": "",
-            "publisher": {
-                "identifier": "",
-                "name": "",
-                "logo": "",
-                "description": "",
-                "contactPoint": [],
-                "memberOf": "",
-                "accessRights": [],
-                "deliveryLeadTime": "",
-                "accessService": "",
-                "accessRequestCost": "",
-                "dataUseLimitation": [],
-                "dataUseRequirements": [],
-            },
-            "contactPoint": "",
-            "keywords": [],
-            "alternateIdentifiers": [],
-            "doiName": "",
-        },
-        "documentation": {
+    INTERNAL: compile a template dict into a list of (key, default, children) entries, where
+    children is the compiled template of a nested dict (None for a default value).
+    """
+    return [
+        (key, None, _compile_template(value))
+        if value and isinstance(value, Mapping)
+        else (key, value, None)
+        for key, value in template.items()
+    ]
+
+
+# This is the minimum viable datasetv2 that is required for the Gateway to function
+MINIMUM_VIABLE_DATASETV2 = {
+    "identifier": "",
+    "version": "",
+    "issued": "",
+    "modified": "",
+    "revisions": [],
+    "summary": {
+        "title": "",
+        "abstract": "",
+        "publisher": {
+            "identifier": "",
+            "name": "",
+            "logo": "",
             "description": "",
-            "associatedMedia": [],
-            "isPartOf": [],
+            "contactPoint": [],
+            "memberOf": "",
+            "accessRights": [],
+            "deliveryLeadTime": "",
+            "accessService": "",
+            "accessRequestCost": "",
+            "dataUseLimitation": [],
+            "dataUseRequirements": [],
         },
-        "coverage": {
-            "spatial": [],
-            "typicalAgeRange": "",
-            "physicalSampleAvailability": [],
-            "followup": "",
-            "pathway": "",
+        "contactPoint": "",
+        "keywords": [],
+        "alternateIdentifiers": [],
+        "doiName": "",
+    },
+    "documentation": {
+        "description": "",
+        "associatedMedia": [],
+        "isPartOf": [],
+    },
+    "coverage": {
+        "spatial": [],
+        "typicalAgeRange": "",
+        "physicalSampleAvailability": [],
+        "followup": "",
+        "pathway": "",
+    },
+    "provenance": {
+        "origin": {"purpose": [], "source": [], "collectionSituation": []},
+        "temporal": {
+            "accrualPeriodicity": "",
+            "distributionReleaseDate": "",
+            "startDate": "",
+            "endDate": "",
+            "timeLag": "",
         },
-        "provenance": {
-            "origin": {"purpose": [], "source": [], "collectionSituation": []},
-            "temporal": {
-                "accrualPeriodicity": "",
-                "distributionReleaseDate": "",
-                "startDate": "",
-                "endDate": "",
-                "timeLag": "",
-            },
+    },
+    "accessibility": {
+        "usage": {
+            "dataUseLimitation": [],
+            "dataUseRequirements": [],
+            "resourceCreator": [],
+            "investigations": [],
+            "isReferencedBy": [],
         },
-        "accessibility": {
-            "usage": {
-                "dataUseLimitation": [],
-                "dataUseRequirements": [],
-                "resourceCreator": [],
-                "investigations": [],
-                "isReferencedBy": [],
-            },
-            "access": {
-                "accessRights": [],
-                "accessService": "",
-                "accessRequestCost": [],
-                "deliveryLeadTime": "",
-                "jurisdiction": [],
-                "dataProcessor": "",
-                "dataController": "",
-            },
-            "formatAndStandards": {
-                "vocabularyEncodingScheme": [],
-                "conformsTo": [],
-                "language": [],
-                "format": [],
-            },
+        "access": {
+            "accessRights": [],
+            "accessService": "",
+            "accessRequestCost": [],
+            "deliveryLeadTime": "",
+            "jurisdiction": [],
+            "dataProcessor": "",
+            "dataController": "",
         },
-        "enrichmentAndLinkage": {
-            "qualifiedRelation": [],
-            "derivation": [],
-            "tools": [],
+        "formatAndStandards": {
+            "vocabularyEncodingScheme": [],
+            "conformsTo": [],
+            "language": [],
+            "format": [],
         },
-        "observations": [],
-    }
+    },
+    "enrichmentAndLinkage": {
+        "qualifiedRelation": [],
+        "derivation": [],
+        "tools": [],
+    },
+    "observations": [],
+}
 
-    merged_dictionary = dictionary.copy()
-    for key, value in _flatten(minimum_viable_datasetv2).items():
-        if key not in _flatten(dictionary) or _flatten(dictionary)[key] == "":
-            merged_dictionary[key] = value
+_MINIMUM_VIABLE_TEMPLATE = _compile_template(MINIMUM_VIABLE_DATASETV2)
 
-    return _unflatten(merged_dictionary)
+
+def _merge_dictionaries(dictionary: dict = None, template: list = None) -> dict:
+    """
+    INTERNAL: merge a dataset with the minimum viable datasetv2, creating an empty field
+    where missing from data.
+
+    This function is neccessary because the Gateway EXPECTS fields which are NOT required
+    by the validation schema. The dataset is filled in place, walking only the paths of
+    the (compiled) template.
+    """
+    for key, default, children in template or _MINIMUM_VIABLE_TEMPLATE:
+        value = dictionary.get(key)
+
+        if children is not None:
+            if not isinstance(value, Mapping):
+                if value:
+                    continue
+                value = dictionary[key] = {}
+            _merge_dictionaries(value, children)
+        # A nested dict where a value is expected is replaced too
+        elif value == "" or key not in dictionary or (value and isinstance(value, Mapping)):
+            dictionary[key] = list(default) if isinstance(default, list) else default
+
+    return dictionary
 
 
 def _format_structural_metadata(metadata: list = None) -> list:
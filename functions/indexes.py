@@ -0,0 +1,152 @@
+"""
+Functions for provisioning and checking the Gateway indexes the ingestion queries rely on.
+"""
+
+import logging
+import pymongo
+
+from pymongo import IndexModel, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+from .exceptions import CriticalError
+from .queries import get_archive_query
+
+# Indexes per collection, each serving the ingestion queries noted alongside
+INDEXES = {
+    "sync_status": [
+        # get_gateway_datasets: {publisherName} (and {publisherName, pid: {$in}}), and the
+        # sync_datasets upserts on {publisherName, pid}, which must not be duplicated
+        IndexModel(
+            [("publisherName", ASCENDING), ("pid", ASCENDING)],
+            name="fma_publisherName_pid",
+            unique=True,
+        ),
+        # sync_datasets/archive_gateway_datasets: delete_many({pid: {$in}, ...})
+        IndexModel([("pid", ASCENDING)], name="fma_pid"),
+    ],
+    "tools": [
+        # get_latest_gateway_dataset(s): {type, pid} sorted by createdAt descending
+        IndexModel(
+            [("type", ASCENDING), ("pid", ASCENDING), ("createdAt", DESCENDING)],
+            name="fma_type_pid_createdAt",
+        ),
+        # archive_gateway_datasets: update_many({pid: {$in}, activeflag: {$ne}})
+        IndexModel([("pid", ASCENDING)], name="fma_pid"),
+    ],
+    "sync_runs": [
+        # start_run: at most one running run per publisher
+        IndexModel(
+            [("publisherId", ASCENDING)],
+            name="fma_publisherId_running",
+            unique=True,
+            partialFilterExpression={"status": "running"},
+        ),
+        # get_resumable_run: {publisherId, status} sorted by startedAt descending
+        IndexModel(
+            [
+                ("publisherId", ASCENDING),
+                ("status", ASCENDING),
+                ("startedAt", DESCENDING),
+            ],
+            name="fma_publisherId_status_startedAt",
+        ),
+    ],
+    "sync_run_checkpoints": [
+        # get_checkpoints/save_checkpoints: {runId} and upserts on {runId, pid}
+        IndexModel(
+            [("runId", ASCENDING), ("pid", ASCENDING)],
+            name="fma_runId_pid",
+            unique=True,
+        ),
+    ],
+}
+
+
+def ensure_indexes(db: pymongo.database.Database = None) -> dict:
+    """
+    Create the INDEXES that do not exist yet; existing indexes are left untouched.
+
+    Each index is created on its own, so one conflicting with an existing index (e.g., an
+    equivalent index under another name) does not prevent the others. Returns the outcome
+    of each index per collection: "ok" or the error that prevented it.
+    """
+    created = {}
+
+    for collection, indexes in INDEXES.items():
+        created[collection] = {}
+
+        for index in indexes:
+            name = index.document["name"]
+
+            try:
+                db[collection].create_indexes([index])
+                created[collection][name] = "ok"
+            except OperationFailure as error:
+                logging.warning(f"Unable to create index {name} on {collection}: {error}")
+                created[collection][name] = str(error)
+            except Exception as error:
+                raise CriticalError(
+                    f"Error creating indexes on the {collection} collection: {error}"
+                ) from error
+
+    logging.info(f"Gateway indexes: {created}")
+
+    return created
+
+
+def check_query_plans(
+    db: pymongo.database.Database = None, publisher_name: str = "", pid: str = ""
+) -> dict:
+    """
+    Explain each ingestion query and raise a CriticalError if any would scan a whole collection.
+
+    Returns the stages of each query's winning plan.
+    """
+    plans = {
+        "get_gateway_datasets": db.sync_status.find(
+            {"publisherName": publisher_name}
+        ).explain(),
+        "sync_datasets": db.sync_status.find(
+            {"publisherName": publisher_name, "pid": pid}
+        ).explain(),
+        "get_latest_gateway_dataset": db.tools.find({"type": "dataset", "pid": pid})
+        .sort("createdAt", -1)
+        .explain(),
+        "get_latest_gateway_datasets": db.command(
+            "aggregate",
+            "tools",
+            pipeline=[
+                {"$match": {"type": "dataset", "pid": {"$in": [pid]}}},
+                {"$sort": {"pid": 1, "createdAt": -1}},
+            ],
+            explain=True,
+        ),
+        "archive_gateway_datasets": db.tools.find(get_archive_query([pid])).explain(),
+    }
+
+    stages = {query: _get_plan_stages(plan) for query, plan in plans.items()}
+    scans = [query for query, query_stages in stages.items() if "COLLSCAN" in query_stages]
+
+    if scans:
+        raise CriticalError(f"Queries falling back to a collection scan: {scans}")
+
+    return stages
+
+
+def _get_plan_stages(plan: dict = None) -> list:
+    """
+    INTERNAL: list every stage named in the winning plans of an explain() document.
+    """
+    stages = []
+
+    if isinstance(plan, dict):
+        if isinstance(plan.get("stage"), str):
+            stages.append(plan["stage"])
+        for key, value in plan.items():
+            if key not in ["rejectedPlans", "allPlansExecution"]:
+                stages.extend(_get_plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(_get_plan_stages(value))
+
+    return stages
@@ -0,0 +1,433 @@
+"""
+Staged ingestion pipeline: fetch -> validate/transform -> write, with bounded queues between
+stages and Gateway writes flushed in size-capped batches.
+"""
+
+import os
+import queue
+import asyncio
+import functools
+import logging
+import threading
+import bson
+import pymongo
+
+from typing import Any, Tuple
+
+from .aio import fetch_dataset_async, write_batch_async
+from .checkpoint import create_checkpoint, save_checkpoints
+from .extract import iter_fetch_datasets, DEFAULT_FETCH_CONCURRENCY
+from .helpers import (
+    create_sync_array,
+    get_content_hash,
+    is_content_unchanged,
+    transform_dataset_cached,
+)
+from .queries import archive_gateway_datasets, add_new_datasets, sync_datasets
+from .validate import validate_json, verify_schema_version
+
+# Maximum number of datasets waiting between two pipeline stages
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "16"))
+# Maximum number of documents per batch written to the Gateway
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "100"))
+# Maximum size in bytes (BSON) of the datasets inserted per batch
+WRITE_BATCH_BYTES = int(os.getenv("WRITE_BATCH_BYTES", str(8 * 1024 * 1024)))
+
+_done = object()
+
+
+def process_dataset(
+    publisher: dict = None,
+    sync_entry: dict = None,
+    custodian_version: dict = None,
+    dataset: dict = None,
+    error: Exception = None,
+    latest_dataset: dict = None,
+) -> Tuple[str, Any, str]:
+    """
+    Validate and transform a fetched dataset as needed, deciding its outcome.
+
+    sync_entry is the Gateway sync entry of an updated dataset (None for a new dataset).
+    Returns (outcome, result, content hash), where the outcome is one of "fetch_failed",
+    "unsupported_version", "unchanged", "invalid" (result is the dataset with its validation
+    errors), "new" or "updated" (result is the transformed dataset).
+    """
+    pid = custodian_version["persistentId"]
+
+    if error:
+        logging.error(f"Error retrieving dataset {pid}: {error}")
+        return "fetch_failed", None, None
+
+    content_hash = get_content_hash(dataset)
+
+    if sync_entry and is_content_unchanged(sync_entry, custodian_version, content_hash):
+        return "unchanged", None, content_hash
+
+    validation_schema = custodian_version.get("@schema", "")
+
+    if not verify_schema_version(validation_schema):
+        logging.warning(f"Schema not supported for dataset {pid}")
+        return "unsupported_version", None, content_hash
+
+    if not_valid := validate_json(validation_schema, dataset):
+        not_valid["persistentId"] = pid
+        return "invalid", not_valid, content_hash
+
+    transformed = transform_dataset_cached(
+        publisher=publisher,
+        dataset=dataset,
+        pid=pid,
+        previous_version=latest_dataset,
+        content_hash=content_hash,
+    )
+
+    return ("updated" if latest_dataset else "new"), transformed, content_hash
+
+
+class WriteBatcher:
+    """
+    Collect the Gateway writes of processed datasets into batches of at most max_documents
+    documents and max_bytes of inserted datasets, and a slim summary of the run for emails.
+
+    Each batch is a dict of "previous" (sync entries whose Gateway versions are archived),
+    "insert" (transformed datasets) and "sync" (sync entries), written in that order, then
+    "checkpoint" (the run checkpoints of its datasets, if a run_id is given).
+    """
+
+    def __init__(
+        self,
+        publisher: dict = None,
+        max_documents: int = WRITE_BATCH_SIZE,
+        max_bytes: int = WRITE_BATCH_BYTES,
+        run_id: Any = None,
+    ):
+        self.publisher = publisher
+        self.run_id = run_id
+        self.max_documents = max(1, int(max_documents))
+        self.max_bytes = int(max_bytes)
+        self.summary = {
+            "new": [],
+            "updated": [],
+            "invalid": [],
+            "unsupported_version": [],
+            "fetch_failed": 0,
+            "unchanged": 0,
+        }
+        self._reset()
+
+    def add(
+        self,
+        outcome: str = "",
+        result: Any = None,
+        sync_entry: dict = None,
+        custodian_version: dict = None,
+        content_hash: str = None,
+    ) -> dict:
+        """
+        Add a processed dataset (see process_dataset), returning a batch if one is full.
+        """
+        pid = custodian_version["persistentId"]
+        # Failed datasets keep their sync entry (if any), e.g., to record its current version
+        entry = sync_entry or custodian_version
+        summary = None
+
+        if outcome == "fetch_failed":
+            self.summary["fetch_failed"] += 1
+            self._sync(entry, "fetch_failed")
+        elif outcome == "unsupported_version":
+            summary = custodian_version
+            self.summary["unsupported_version"].append(summary)
+            self._sync(entry, "unsupported_version")
+        elif outcome == "unchanged":
+            self.summary["unchanged"] += 1
+            self._sync(custodian_version, "ok", {pid: content_hash})
+        elif outcome == "invalid":
+            summary = {
+                "persistentId": pid,
+                "identifier": result.get("identifier", ""),
+                "version": result.get("version", custodian_version.get("version")),
+                "summary": {"title": (result.get("summary") or {}).get("title", "")},
+                "validation_errors": result["validation_errors"],
+            }
+            self.summary["invalid"].append(summary)
+            self._sync(summary, "validation_failed")
+        else:
+            summary = {
+                "pid": result["pid"],
+                "name": result["name"],
+                "datasetVersion": result["datasetVersion"],
+                "datasetid": result["datasetid"],
+                "activeflag": result["activeflag"],
+            }
+            self.summary[outcome].append(summary)
+            if outcome == "updated":
+                self.batch["previous"].append(sync_entry)
+            self.batch["insert"].append(result)
+            self.size += len(bson.encode(result))
+            self._sync(result, "ok", {pid: content_hash})
+
+        # Failed fetches are not checkpointed, so a resumed run fetches them again
+        if self.run_id and outcome != "fetch_failed":
+            self.batch["checkpoint"].append(
+                create_checkpoint(
+                    self.run_id, pid, custodian_version.get("version"), outcome, summary
+                )
+            )
+
+        documents = sum(len(self.batch[i]) for i in ["previous", "insert", "sync"])
+
+        if documents >= self.max_documents or self.size >= self.max_bytes:
+            return self.drain()
+
+        return None
+
+    def drain(self) -> dict:
+        """
+        Get the pending batch (possibly empty) and start a new one.
+        """
+        batch = self.batch
+        self._reset()
+        return batch
+
+    def _sync(self, dataset: dict = None, status: str = "", content_hashes: dict = None):
+        """
+        INTERNAL: add the sync entry of a dataset to the batch.
+        """
+        self.batch["sync"].extend(
+            create_sync_array(
+                datasets=[dataset],
+                sync_status=status,
+                publisher=self.publisher,
+                content_hashes=content_hashes,
+            )
+        )
+
+    def _reset(self) -> None:
+        """
+        INTERNAL: start an empty batch.
+        """
+        self.batch = {"previous": [], "insert": [], "sync": [], "checkpoint": []}
+        self.size = 0
+
+
+def write_batch(db: pymongo.database.Database = None, batch: dict = None) -> None:
+    """
+    Write a batch (see WriteBatcher) to the Gateway, archiving previous versions before the
+    new versions are inserted. Checkpoints are saved last, once their datasets are written.
+    """
+    if batch["previous"]:
+        archive_gateway_datasets(
+            db=db, archived_datasets=[], previous_versions=batch["previous"]
+        )
+    if batch["insert"]:
+        add_new_datasets(db=db, new_datasets=batch["insert"])
+    if batch["sync"]:
+        sync_datasets(db=db, sync_list=batch["sync"])
+    if batch.get("checkpoint"):
+        save_checkpoints(db=db, checkpoints=batch["checkpoint"])
+
+
+def run_pipeline(
+    db: pymongo.database.Database = None,
+    publisher: dict = None,
+    url: str = "",
+    headers: Any = None,
+    jobs: list = None,
+    latest_datasets: dict = None,
+    max_workers: int = DEFAULT_FETCH_CONCURRENCY,
+    publisher_name: str = "",
+    writer: WriteBatcher = None,
+) -> dict:
+    """
+    Fetch, validate, transform and write datasets as a staged pipeline.
+
+    jobs are (sync entry, custodian catalogue entry) pairs, the sync entry being None for new
+    datasets. Fetching and processing run on their own threads, connected to the writer (this
+    thread) by queues of at most PIPELINE_QUEUE_SIZE datasets, so memory stays bounded. Any
+    error stops every stage and is raised. Returns the writer's summary.
+    """
+    jobs = jobs or []
+    latest_datasets = latest_datasets or {}
+    writer = writer or WriteBatcher(publisher)
+
+    fetched = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    processed = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    stop = threading.Event()
+
+    def _fetch() -> None:
+        results = iter_fetch_datasets(
+            url,
+            headers,
+            [i["persistentId"] for _, i in jobs],
+            max_workers=max_workers,
+            publisher_name=publisher_name,
+        )
+
+        try:
+            for job, (dataset, error) in zip(jobs, results):
+                if not _put(fetched, (job, dataset, error), stop):
+                    return
+            _put(fetched, _done, stop)
+        except BaseException as error:
+            _put(fetched, error, stop)
+        finally:
+            # Cancels the requests not yet sent if the pipeline stopped early
+            results.close()
+
+    def _process() -> None:
+        try:
+            while (item := _get(fetched, stop)) is not _done:
+                if isinstance(item, BaseException):
+                    raise item
+
+                (sync_entry, custodian_version), dataset, error = item
+                outcome, result, content_hash = process_dataset(
+                    publisher,
+                    sync_entry,
+                    custodian_version,
+                    dataset,
+                    error,
+                    latest_dataset=latest_datasets.get(sync_entry["pid"])
+                    if sync_entry
+                    else None,
+                )
+
+                if not _put(
+                    processed,
+                    (outcome, result, sync_entry, custodian_version, content_hash),
+                    stop,
+                ):
+                    return
+            _put(processed, _done, stop)
+        except BaseException as error:
+            _put(processed, error, stop)
+
+    threads = [
+        threading.Thread(target=_fetch, name="pipeline-fetch", daemon=True),
+        threading.Thread(target=_process, name="pipeline-process", daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+
+    try:
+        while (item := processed.get()) is not _done:
+            if isinstance(item, BaseException):
+                raise item
+
+            if batch := writer.add(*item):
+                write_batch(db, batch)
+
+        write_batch(db, writer.drain())
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    return writer.summary
+
+
+async def run_pipeline_async(
+    db: Any = None,
+    http: Any = None,
+    publisher: dict = None,
+    url: str = "",
+    headers: Any = None,
+    jobs: list = None,
+    latest_datasets: dict = None,
+    max_workers: int = DEFAULT_FETCH_CONCURRENCY,
+    publisher_name: str = "",
+    writer: WriteBatcher = None,
+) -> dict:
+    """
+    Fetch, validate, transform and write datasets as a staged pipeline on the event loop, see
+    run_pipeline.
+
+    max_workers fetch tasks feed a queue of at most PIPELINE_QUEUE_SIZE datasets, which are
+    processed on a worker thread and written in batches with motor.
+    """
+    loop = asyncio.get_running_loop()
+    pending = iter(jobs or [])
+    latest_datasets = latest_datasets or {}
+    writer = writer or WriteBatcher(publisher)
+    fetched = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+
+    async def _fetch() -> None:
+        # Fetch tasks share the iterator of pending jobs
+        for sync_entry, custodian_version in pending:
+            dataset, error = await fetch_dataset_async(
+                http, url, headers, custodian_version["persistentId"], publisher_name
+            )
+            await fetched.put(((sync_entry, custodian_version), dataset, error))
+
+    fetchers = [asyncio.ensure_future(_fetch()) for _ in range(max(1, max_workers))]
+
+    async def _fetch_all() -> None:
+        try:
+            await asyncio.gather(*fetchers)
+            await fetched.put(_done)
+        except asyncio.CancelledError:
+            raise
+        except BaseException as error:
+            await fetched.put(error)
+
+    producer = asyncio.ensure_future(_fetch_all())
+
+    try:
+        while (item := await fetched.get()) is not _done:
+            if isinstance(item, BaseException):
+                raise item
+
+            (sync_entry, custodian_version), dataset, error = item
+            outcome, result, content_hash = await loop.run_in_executor(
+                None,
+                functools.partial(
+                    process_dataset,
+                    publisher,
+                    sync_entry,
+                    custodian_version,
+                    dataset,
+                    error,
+                    latest_dataset=latest_datasets.get(sync_entry["pid"])
+                    if sync_entry
+                    else None,
+                ),
+            )
+
+            if batch := writer.add(
+                outcome, result, sync_entry, custodian_version, content_hash
+            ):
+                await write_batch_async(db, batch)
+
+        await write_batch_async(db, writer.drain())
+    finally:
+        for task in [producer, *fetchers]:
+            task.cancel()
+
+    return writer.summary
+
+
+def _put(items: queue.Queue = None, item: Any = None, stop: threading.Event = None) -> bool:
+    """
+    INTERNAL: put an item on a bounded queue, giving up (False) if the pipeline is stopped.
+    """
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+
+    return False
+
+
+def _get(items: queue.Queue = None, stop: threading.Event = None) -> Any:
+    """
+    INTERNAL: get an item from a queue, or the end of the stage if the pipeline is stopped.
+    """
+    while not stop.is_set():
+        try:
+            return items.get(timeout=0.1)
+        except queue.Empty:
+            continue
+
+    return _done
@@ -0,0 +1,130 @@
+"""
+Functions for planning a sync: what an ingestion would archive, add and update, without side effects.
+"""
+
+import time
+import pymongo
+
+from datetime import datetime
+
+from .auth import get_publisher_headers
+from .cache import get_cached_response_size
+from .extract import get_datasets
+from .helpers import diff_catalogues, get_incremental_params
+from .queries import get_publisher, get_gateway_datasets, SYNC_STATUS_FIELDS
+from .validate import warm_validators
+
+
+def create_sync_plan(
+    publisher: dict = None,
+    custodian_datasets: list = None,
+    gateway_datasets: list = None,
+    modified_since: dict = None,
+) -> dict:
+    """
+    Decide what a sync of a publisher will do given its catalogue and Gateway sync entries.
+
+    Returns a dict with the "archive" sync entries, "new" catalogue entries and "update"
+    (catalogue entry, sync entry) pairs to fetch, see diff_catalogues.
+    """
+    # An incremental listing only holds changed datasets, so all of them are fetched, as
+    # are unchanged versions when content changes are detected
+    new, archived, overlapping = diff_catalogues(
+        custodian_datasets,
+        gateway_datasets,
+        changed_only=not (
+            modified_since or publisher["federation"].get("detectContentChanges", False)
+        ),
+    )
+
+    return {
+        "publisher": publisher["publisherDetails"]["name"],
+        "mode": "incremental" if modified_since else "full",
+        "modifiedSince": modified_since,
+        "archive": archived,
+        "new": new,
+        "update": overlapping,
+    }
+
+
+def serialise_sync_plan(plan: dict = None) -> dict:
+    """
+    Convert a sync plan to JSON-serialisable PIDs and an estimate of the fetches it needs.
+
+    Fetch sizes come from the response cache: "cachedFetches" of the "expectedFetches" have
+    a cached size, totalling "cachedBytes". "expectedBytes" is None unless every fetch has one.
+    """
+    fetch_pids = [i["persistentId"] for i in plan["new"]] + [
+        i["persistentId"] for i, _ in plan["update"]
+    ]
+
+    sizes = [get_cached_response_size(plan["publisher"], i) for i in fetch_pids]
+    known = [i for i in sizes if i is not None]
+
+    return {
+        "publisher": plan["publisher"],
+        "mode": plan["mode"],
+        "modifiedSince": plan["modifiedSince"],
+        "archive": [i["pid"] for i in plan["archive"]],
+        "new": [i["persistentId"] for i in plan["new"]],
+        "update": [i["persistentId"] for i, _ in plan["update"]],
+        "expectedFetches": len(fetch_pids),
+        "cachedFetches": len(known),
+        "cachedBytes": sum(known),
+        "expectedBytes": sum(known) if len(known) == len(sizes) else None,
+    }
+
+
+def plan_sync(
+    db: pymongo.database.Database = None, custodian_id: str = "", warm: bool = False
+) -> dict:
+    """
+    Dry run: read a publisher's catalogue and Gateway sync entries and return the serialised
+    sync plan, without writing to the database or sending mail.
+
+    Timings of each phase are included; warm pre-compiles the schemas the run will need.
+    """
+    timings = {}
+
+    started = time.monotonic()
+    publisher = get_publisher(db=db, custodian_id=custodian_id)
+    custodian_name = publisher["publisherDetails"]["name"]
+    modified_since = get_incremental_params(publisher, now=datetime.utcnow())
+
+    custodian_datasets = get_datasets(
+        publisher["federation"]["endpoints"]["baseURL"]
+        + publisher["federation"]["endpoints"]["datasets"],
+        get_publisher_headers(publisher),
+        pagination=publisher["federation"].get("pagination"),
+        publisher_name=custodian_name,
+        params=modified_since,
+    )
+    timings["catalogue"] = round(time.monotonic() - started, 3)
+
+    started = time.monotonic()
+    gateway_datasets = list(
+        get_gateway_datasets(
+            db=db,
+            publisher=custodian_name,
+            pids=[i["persistentId"] for i in custodian_datasets]
+            if modified_since
+            else None,
+            fields=SYNC_STATUS_FIELDS,
+        )
+    )
+    timings["gateway"] = round(time.monotonic() - started, 3)
+
+    started = time.monotonic()
+    plan = create_sync_plan(
+        publisher, custodian_datasets, gateway_datasets, modified_since=modified_since
+    )
+    timings["plan"] = round(time.monotonic() - started, 3)
+
+    if warm:
+        started = time.monotonic()
+        warm_validators(
+            [i.get("@schema", "") for i in [*plan["new"], *(i for i, _ in plan["update"])]]
+        )
+        timings["warm"] = round(time.monotonic() - started, 3)
+
+    return {**serialise_sync_plan(plan), "timings": timings}
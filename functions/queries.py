@@ -2,26 +2,67 @@
 Functions for querying the Gateway MongoDB database.
 """
 
+import os
+import logging
 import pymongo
 import numpy as np
 
+from typing import Any
+from datetime import datetime
 from bson.objectid import ObjectId
+from pymongo import ReplaceOne, ReadPreference
+from pymongo.errors import BulkWriteError
 
 from .exceptions import CriticalError
 
+# Maximum number of sync entries written per bulk write
+SYNC_BATCH_SIZE = int(os.getenv("SYNC_BATCH_SIZE", "1000"))
+# Maximum number of PIDs per archiving update (and sync status delete)
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "500"))
+# Read preference of the ingestion's Gateway reads, e.g., "secondaryPreferred"
+GATEWAY_READ_PREFERENCE = os.getenv("GATEWAY_READ_PREFERENCE", "primary")
+# Documents per cursor batch of the ingestion's Gateway reads, 0 leaves it to the server
+GATEWAY_READ_BATCH_SIZE = int(os.getenv("GATEWAY_READ_BATCH_SIZE", "0"))
+# Fields of a sync entry used by the ingestion
+SYNC_STATUS_FIELDS = ["pid", "name", "version", "status", "contentHash"]
+# Fields of the latest version of a dataset used by transform_dataset
+LATEST_VERSION_FIELDS = ["pid", "activeflag", "datasetfields.metadataquality"]
+
+_read_preferences = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+
 
 def get_gateway_datasets(
-    db: pymongo.database.Database = None, publisher: dict = None
+    db: pymongo.database.Database = None,
+    publisher: dict = None,
+    pids: list = None,
+    fields: list = None,
+    read_preference: str = None,
+    batch_size: int = None,
 ) -> list:
     """
-    Get a list of datasets from the Gateway relevant to a given custodian (i.e., publisher).
+    Get a list of datasets from the Gateway relevant to a given custodian (i.e., publisher),
+    optionally only those with the given PIDs.
+
+    Only the given fields (e.g., SYNC_STATUS_FIELDS) are read if any, see get_projection;
+    read_preference and batch_size default to GATEWAY_READ_PREFERENCE/GATEWAY_READ_BATCH_SIZE.
     """
     try:
-        datasets = db.sync_status.find(
-            {"publisherName": publisher},
+        query = {"publisherName": publisher}
+
+        if pids is not None:
+            query["pid"] = {"$in": list(pids)}
+
+        datasets = with_read_preference(db.sync_status, read_preference).find(
+            query, get_projection(fields)
         )
 
-        return datasets
+        return with_batch_size(datasets, batch_size)
     except Exception as error:
         raise CriticalError(
             f"Error retrieving gateway datasets for publisher {publisher}: {error}"
@@ -29,13 +70,23 @@ def get_gateway_datasets(
 
 
 def get_latest_gateway_dataset(
-    db: pymongo.database.Database = None, pid: str = ""
+    db: pymongo.database.Database = None,
+    pid: str = "",
+    fields: list = None,
+    read_preference: str = None,
 ) -> dict:
     """
     Get the latest version of a given dataset from the tools collection in the Gateway
+
+    Only the given fields (e.g., LATEST_VERSION_FIELDS) are read if any.
     """
     try:
-        datasets = db.tools.find({"type": "dataset", "pid": pid}).sort("createdAt", -1)
+        datasets = (
+            with_read_preference(db.tools, read_preference)
+            .find({"type": "dataset", "pid": pid}, get_projection(fields))
+            .sort("createdAt", -1)
+            .limit(1)
+        )
 
         return datasets[0]
     except IndexError:
@@ -46,37 +97,116 @@ def get_latest_gateway_dataset(
         ) from error
 
 
+def get_latest_gateway_datasets(
+    db: pymongo.database.Database = None,
+    pids: list = None,
+    read_preference: str = None,
+    batch_size: int = None,
+    chunk_size: int = ARCHIVE_BATCH_SIZE,
+) -> dict:
+    """
+    Get the latest version of each given dataset from the tools collection, aggregating the
+    PIDs in chunks of chunk_size.
+
+    Returns a dict of PID to the fields of the latest version used by transform_dataset
+    ("activeflag" and "datasetfields.metadataquality"); PIDs not in the Gateway are absent.
+    """
+    batch_size = batch_size if batch_size is not None else GATEWAY_READ_BATCH_SIZE
+    latest = {}
+
+    try:
+        for chunk in get_archive_chunks(pids, chunk_size):
+            # The $sort may exceed the in-memory limit for PIDs with many versions
+            for i in with_read_preference(db.tools, read_preference).aggregate(
+                get_latest_versions_pipeline(chunk),
+                allowDiskUse=True,
+                **({"batchSize": batch_size} if batch_size else {}),
+            ):
+                latest[i["_id"]] = get_latest_version(i)
+
+        return latest
+    except Exception as error:
+        raise CriticalError(
+            f"Error retrieving latest versions of datasets from the Gateway: {error}"
+        ) from error
+
+
+def get_projection(fields: list = None) -> dict:
+    """
+    Build a projection reading only the given fields (without _id), or None for whole documents.
+    """
+    if fields is None:
+        return None
+
+    return {"_id": 0, **{i: 1 for i in fields}}
+
+
+def with_read_preference(collection: Any = None, read_preference: str = None) -> Any:
+    """
+    Get a collection (pymongo or motor) with a read preference by name, e.g., "secondaryPreferred".
+    """
+    read_preference = read_preference or GATEWAY_READ_PREFERENCE
+
+    if read_preference == "primary":
+        return collection
+
+    try:
+        return collection.with_options(read_preference=_read_preferences[read_preference])
+    except KeyError as error:
+        raise CriticalError(f"Unknown read preference {read_preference}") from error
+
+
+def with_batch_size(cursor: Any = None, batch_size: int = None) -> Any:
+    """
+    Set the batch size of a cursor, defaulting to GATEWAY_READ_BATCH_SIZE (0 leaves it to the server).
+    """
+    batch_size = batch_size if batch_size is not None else GATEWAY_READ_BATCH_SIZE
+
+    return cursor.batch_size(batch_size) if batch_size else cursor
+
+
 def archive_gateway_datasets(
     db: pymongo.database.Database = None,
     archived_datasets: np.array = None,
     previous_versions: list = None,
-) -> None:
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+) -> dict:
     """
     Archive datasets on the Gateway given a list of datasets (which are then mapped to IDs).
+
+    PIDs are archived in chunks of batch_size, only updating the versions not archived yet,
+    and the sync entries of archived_datasets are removed. Returns the total and per-chunk
+    matched/modified/deleted counts.
     """
-    try:
-        db.tools.update_many(
-            {
-                "pid": {
-                    "$in": list(
-                        map(
-                            lambda x: x["pid"], [*archived_datasets, *previous_versions]
-                        )
-                    )
-                }
-            },
-            {"$set": {"activeflag": "archive"}},
-        )
+    archived_pids = [i["pid"] for i in archived_datasets]
+    pids = [*archived_pids, *[i["pid"] for i in previous_versions]]
+    deleted = set(archived_pids)
+    counts = {"matched": 0, "modified": 0, "deleted": 0, "chunks": []}
 
-        if len(archived_datasets) > 0:
-            db.sync_status.delete_many(
-                {"pid": {"$in": list(map(lambda x: x["pid"], archived_datasets))}}
+    try:
+        for chunk in get_archive_chunks(pids, batch_size):
+            result = db.tools.update_many(
+                get_archive_query(chunk), {"$set": {"activeflag": "archive"}}
             )
+            chunk_counts = {
+                "matched": result.matched_count,
+                "modified": result.modified_count,
+                "deleted": 0,
+            }
+
+            if chunk_deleted := [i for i in chunk if i in deleted]:
+                chunk_counts["deleted"] = db.sync_status.delete_many(
+                    {"pid": {"$in": chunk_deleted}}
+                ).deleted_count
+
+            add_archive_counts(counts, chunk_counts)
     except Exception as error:
         raise CriticalError(
             f"Error archiving datasets on the Gateway: {error}"
         ) from error
 
+    return counts
+
 
 def add_new_datasets(db: pymongo.database.Database = None, new_datasets=None) -> None:
     """
@@ -124,16 +254,191 @@ def update_publisher(
         ) from error
 
 
-def sync_datasets(db: pymongo.database.Database = None, sync_list: list = None) -> None:
+def update_sync_watermark(
+    db: pymongo.database.Database = None,
+    custodian_id: str = "",
+    watermark: datetime = None,
+    full_sync: bool = False,
+) -> None:
     """
-    Remove any existing sync status for a given PID and add new sync entry.
+    Record the start time of a publisher's last successful sync (and full sync, if it was one).
     """
     try:
-        db.sync_status.delete_many(
-            {"pid": {"$in": list(map(lambda x: x["pid"], sync_list))}}
-        )
-        db.sync_status.insert_many(sync_list)
+        update = {"federation.syncWatermark": watermark}
+
+        if full_sync:
+            update["federation.lastFullSync"] = watermark
+
+        db.publishers.update_one({"_id": ObjectId(custodian_id)}, {"$set": update})
     except Exception as error:
         raise CriticalError(
-            f"Error updating the sync_status collection on the Gateway: {error}"
+            f"Error setting the sync watermark of publisher _id {custodian_id}: {error}"
         ) from error
+
+
+def sync_datasets(
+    db: pymongo.database.Database = None,
+    sync_list: list = None,
+    batch_size: int = SYNC_BATCH_SIZE,
+) -> dict:
+    """
+    Replace (or add) the sync status of each (publisherName, pid) in unordered bulk writes.
+
+    Every batch is written even if operations in another fail; failed operations are logged
+    and reported in a single CriticalError. Entries of the same PIDs under another
+    publisherName (e.g., the custodian was renamed) are deleted. Returns the
+    matched/modified/upserted/deleted counts.
+    """
+    counts = {"matched": 0, "modified": 0, "upserted": 0, "deleted": 0}
+    errors = []
+
+    for batch in get_sync_batches(sync_list, batch_size):
+        try:
+            result = db.sync_status.bulk_write(get_sync_operations(batch), ordered=False)
+            _add_bulk_counts(counts, result.bulk_api_result)
+        except BulkWriteError as error:
+            _add_bulk_counts(counts, error.details)
+            errors.extend(get_write_errors(batch, error.details))
+        except Exception as error:
+            raise CriticalError(
+                f"Error updating the sync_status collection on the Gateway: {error}"
+            ) from error
+
+        try:
+            for query in get_stale_sync_queries(batch):
+                counts["deleted"] += db.sync_status.delete_many(query).deleted_count
+        except Exception as error:
+            raise CriticalError(
+                f"Error updating the sync_status collection on the Gateway: {error}"
+            ) from error
+
+    if errors:
+        raise CriticalError(
+            f"Error updating the sync_status collection on the Gateway: {len(errors)} failed writes, e.g., {errors[:5]}"
+        )
+
+    return counts
+
+
+def get_archive_chunks(pids: list = None, batch_size: int = ARCHIVE_BATCH_SIZE) -> list:
+    """
+    Split PIDs into chunks of at most batch_size, dropping repeated PIDs.
+    """
+    pids = list(dict.fromkeys(pids or []))
+    batch_size = max(1, int(batch_size))
+
+    return [pids[i : i + batch_size] for i in range(0, len(pids), batch_size)]
+
+
+def get_archive_query(pids: list = None) -> dict:
+    """
+    Get the query matching the Gateway versions of the given PIDs that are not archived yet.
+    """
+    return {"pid": {"$in": list(pids)}, "activeflag": {"$ne": "archive"}}
+
+
+def get_latest_versions_pipeline(pids: list = None) -> list:
+    """
+    Get the aggregation grouping the latest version of each given PID in the tools collection.
+    """
+    return [
+        {"$match": {"type": "dataset", "pid": {"$in": list(pids)}}},
+        {
+            "$project": {
+                "pid": 1,
+                "createdAt": 1,
+                "activeflag": 1,
+                "datasetfields.metadataquality": 1,
+            }
+        },
+        {"$sort": {"pid": 1, "createdAt": -1}},
+        {
+            "$group": {
+                "_id": "$pid",
+                "activeflag": {"$first": "$activeflag"},
+                "metadataquality": {"$first": "$datasetfields.metadataquality"},
+            }
+        },
+    ]
+
+
+def get_latest_version(group: dict = None) -> dict:
+    """
+    Get the latest version fields of a PID from its group (see get_latest_versions_pipeline).
+    """
+    return {
+        "pid": group["_id"],
+        "activeflag": group.get("activeflag"),
+        "datasetfields": {"metadataquality": group.get("metadataquality")},
+    }
+
+
+def add_archive_counts(counts: dict = None, chunk: dict = None) -> None:
+    """
+    Add the counts of an archived chunk to a running total (see archive_gateway_datasets).
+    """
+    counts["chunks"].append(chunk)
+    for key in ["matched", "modified", "deleted"]:
+        counts[key] += chunk[key]
+
+    logging.debug(f"Archived chunk {len(counts['chunks'])}: {chunk}")
+
+
+def get_sync_batches(sync_list: list = None, batch_size: int = SYNC_BATCH_SIZE) -> list:
+    """
+    Split sync entries into batches, keeping only the last entry of a repeated (publisherName, pid).
+    """
+    entries = list({(i.get("publisherName"), i["pid"]): i for i in sync_list or []}.values())
+    batch_size = max(1, int(batch_size))
+
+    return [entries[i : i + batch_size] for i in range(0, len(entries), batch_size)]
+
+
+def get_sync_operations(batch: list = None) -> list:
+    """
+    Build an upserting ReplaceOne operation, keyed on (publisherName, pid), per sync entry.
+    """
+    return [
+        ReplaceOne(
+            {"publisherName": i.get("publisherName"), "pid": i["pid"]}, i, upsert=True
+        )
+        for i in batch
+    ]
+
+
+def get_stale_sync_queries(batch: list = None) -> list:
+    """
+    Get the queries matching the sync entries of a batch's PIDs under another publisherName.
+    """
+    pids = {}
+    for i in batch:
+        pids.setdefault(i.get("publisherName"), []).append(i["pid"])
+
+    return [
+        {"pid": {"$in": publisher_pids}, "publisherName": {"$ne": publisher_name}}
+        for publisher_name, publisher_pids in pids.items()
+    ]
+
+
+def get_write_errors(batch: list = None, details: dict = None) -> list:
+    """
+    Describe (and log) each failed operation of a bulk write of a batch of sync entries.
+    """
+    errors = []
+
+    for error in details.get("writeErrors", []):
+        pid = batch[error["index"]]["pid"]
+        logging.error(f"Error writing sync status of {pid}: {error.get('errmsg')}")
+        errors.append({"pid": pid, "code": error.get("code"), "error": error.get("errmsg")})
+
+    return errors
+
+
+def _add_bulk_counts(counts: dict = None, result: dict = None) -> None:
+    """
+    INTERNAL: add the counts of a bulk write result to a running total.
+    """
+    counts["matched"] += result.get("nMatched", 0)
+    counts["modified"] += result.get("nModified", 0)
+    counts["upserted"] += result.get("nUpserted", 0)
+
@@ -0,0 +1,276 @@
+"""
+Functions for limiting the rate and concurrency of requests made to each custodian host.
+"""
+
+import time
+import asyncio
+import threading
+
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+from email.utils import parsedate_to_datetime
+
+# Default number of times a 429/503 response is retried before it is returned
+DEFAULT_MAX_RETRIES = 2
+# Multiplicative decrease applied to the concurrency limit when a host pushes back
+BACKOFF_FACTOR = 0.5
+# Seconds to wait before retrying a 429/503 response without a Retry-After header
+DEFAULT_RETRY_DELAY = 1.0
+# Longest Retry-After honoured, longer requests for a pause are not retried
+MAX_RETRY_DELAY = 60.0
+# Seconds between checks for a free request slot by acquire_async
+ASYNC_POLL_INTERVAL = 0.05
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class HostRateLimiter:
+    """
+    Token bucket rate limit with an AIMD (additive increase, multiplicative decrease)
+    concurrency limit for requests to a single host.
+
+    Each request must acquire() before it is sent and release() with its outcome. A 429 or
+    503 halves the concurrency limit and pauses the host for any Retry-After, as does a
+    latency above latency_target; other responses raise the limit by one request per
+    window of in-flight requests, up to max_concurrency. The limit is halved at most once
+    per window: requests sent before the last decrease do not decrease it again.
+    """
+
+    def __init__(
+        self,
+        requests_per_second: float = None,
+        burst: int = None,
+        max_concurrency: int = 64,
+        min_concurrency: int = 1,
+        latency_target: float = None,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+    ):
+        self.rate = None
+        self.tokens = None
+        self.limit = None
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.throttled = 0
+        self.decreased_at = 0.0
+        self.updated = time.monotonic()
+        self.condition = threading.Condition()
+        self.configure(
+            requests_per_second,
+            burst,
+            max_concurrency,
+            min_concurrency,
+            latency_target,
+            max_retries,
+        )
+
+    def configure(
+        self,
+        requests_per_second: float = None,
+        burst: int = None,
+        max_concurrency: int = 64,
+        min_concurrency: int = 1,
+        latency_target: float = None,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+    ) -> None:
+        """
+        Apply new settings in place. The learned concurrency limit (kept within the new
+        bounds), any pause and the requests in flight carry over.
+        """
+        with self.condition:
+            self._refill(time.monotonic())
+            self.rate = float(requests_per_second) if requests_per_second else None
+            self.burst = float(burst or max(1.0, self.rate or 1.0))
+            self.tokens = self.burst if self.tokens is None else min(self.tokens, self.burst)
+            self.max_concurrency = max(1, int(max_concurrency))
+            self.min_concurrency = max(1, min(int(min_concurrency), self.max_concurrency))
+            limit = self.max_concurrency if self.limit is None else self.limit
+            self.limit = float(min(self.max_concurrency, max(self.min_concurrency, limit)))
+            self.latency_target = float(latency_target) if latency_target else None
+            self.max_retries = int(max_retries)
+            self.condition.notify_all()
+
+    def acquire(self) -> None:
+        """
+        Block until a request may be sent to the host.
+        """
+        with self.condition:
+            while (timeout := self._try_acquire()) != 0:
+                self.condition.wait(timeout=timeout)
+
+    async def acquire_async(self) -> None:
+        """
+        Wait (without blocking the event loop) until a request may be sent to the host.
+        """
+        while True:
+            with self.condition:
+                timeout = self._try_acquire()
+
+            if timeout == 0:
+                return
+
+            # Releases do not wake the event loop, so waits for a free slot are polled
+            await asyncio.sleep(min(timeout or ASYNC_POLL_INTERVAL, ASYNC_POLL_INTERVAL))
+
+    def release(
+        self, status_code: int = None, latency: float = None, retry_after: float = None
+    ) -> None:
+        """
+        Record the outcome of a request and adapt the concurrency limit accordingly. The
+        latency (in seconds) also dates the request, see _decrease.
+        """
+        with self.condition:
+            self.in_flight -= 1
+
+            if status_code in [429, 503]:
+                self.throttled += 1
+                self._decrease(latency)
+                self.paused_until = max(
+                    self.paused_until,
+                    time.monotonic()
+                    + min(
+                        MAX_RETRY_DELAY,
+                        retry_after if retry_after is not None else DEFAULT_RETRY_DELAY,
+                    ),
+                )
+            elif (
+                self.latency_target and latency is not None and latency > self.latency_target
+            ):
+                self._decrease(latency)
+            elif status_code is not None and status_code < 500:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+            self.condition.notify_all()
+
+    def stats(self) -> dict:
+        """
+        Get the current state of the limiter.
+        """
+        with self.condition:
+            return {
+                "concurrency_limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "requests_per_second": self.rate,
+                "throttled": self.throttled,
+            }
+
+    def _decrease(self, latency: float = None) -> None:
+        """
+        INTERNAL: apply the multiplicative decrease, unless the request was sent before the
+        last decrease (its window has already been cut). Lock held.
+        """
+        now = time.monotonic()
+
+        if latency is not None and now - latency < self.decreased_at:
+            return
+
+        self.limit = max(self.min_concurrency, self.limit * BACKOFF_FACTOR)
+        self.decreased_at = now
+
+    def _try_acquire(self) -> float:
+        """
+        INTERNAL: take a request slot (returning 0) if one is free, otherwise return the
+        seconds to wait before trying again (None until a request is released). Lock held.
+        """
+        now = time.monotonic()
+        self._refill(now)
+
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.in_flight >= int(self.limit):
+            return None
+        if self.rate and self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+
+        self.in_flight += 1
+        if self.rate:
+            self.tokens -= 1
+        return 0
+
+    def _refill(self, now: float = 0.0) -> None:
+        """
+        INTERNAL: add the tokens accrued since the last refill.
+        """
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+def configure_rate_limiter(
+    url: str = "", config: dict = None, max_concurrency: int = 64
+) -> HostRateLimiter:
+    """
+    Configure the rate limiter for the host of a url from a publisher's federation.rateLimit,
+    e.g., {"requestsPerSecond": 10, "burst": 20, "minConcurrency": 1,
+    "latencyTarget": 2.0, "maxRetries": 2}.
+
+    An existing limiter is updated in place, so concurrent runs for the host keep sharing
+    it along with its learned limit and any Retry-After pause.
+    """
+    config = config or {}
+    settings = {
+        "requests_per_second": config.get("requestsPerSecond"),
+        "burst": config.get("burst"),
+        "max_concurrency": max_concurrency,
+        "min_concurrency": config.get("minConcurrency", 1),
+        "latency_target": config.get("latencyTarget"),
+        "max_retries": config.get("maxRetries", DEFAULT_MAX_RETRIES),
+    }
+    host = urlsplit(url).netloc
+
+    with _limiters_lock:
+        if host not in _limiters:
+            _limiters[host] = HostRateLimiter(**settings)
+            return _limiters[host]
+
+        limiter = _limiters[host]
+
+    limiter.configure(**settings)
+
+    return limiter
+
+
+def get_rate_limiter(url: str = "") -> HostRateLimiter:
+    """
+    Get the rate limiter for the host of a url, creating an unthrottled one if none is configured.
+    """
+    host = urlsplit(url).netloc
+
+    with _limiters_lock:
+        if host not in _limiters:
+            _limiters[host] = HostRateLimiter()
+
+        return _limiters[host]
+
+
+def get_rate_limiter_stats() -> dict:
+    """
+    Get the state of the rate limiter for each host.
+    """
+    with _limiters_lock:
+        limiters = dict(_limiters)
+
+    return {host: limiter.stats() for host, limiter in limiters.items()}
+
+
+def parse_retry_after(value: str = None) -> float:
+    """
+    Parse a Retry-After header (seconds or HTTP date) into seconds, or None if absent/invalid.
+    """
+    if not value:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
@@ -0,0 +1,119 @@
+"""
+Functions for managing the shared HTTP session used to make requests to external servers.
+"""
+
+import os
+import threading
+import requests
+
+from requests.adapters import HTTPAdapter
+
+# Default number of keep-alive connections held open per host
+DEFAULT_POOL_MAXSIZE = 10
+# Seconds to wait for a connection, or between bytes of a response, before a request fails
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "60"))
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session(pool_maxsize: int = None) -> requests.Session:
+    """
+    Get the process-wide HTTP session, creating it on first use.
+
+    Connections are kept alive and pooled per host, holding up to pool_maxsize connections
+    for each host (HTTP_POOL_MAXSIZE in the environment by default). Requesting a larger pool
+    than the current session holds resizes the pools.
+    """
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            _mount_adapters(
+                _session,
+                pool_maxsize
+                or int(os.getenv("HTTP_POOL_MAXSIZE", str(DEFAULT_POOL_MAXSIZE))),
+            )
+        elif pool_maxsize and _get_pool_maxsize(_session) < pool_maxsize:
+            _mount_adapters(_session, pool_maxsize)
+
+        return _session
+
+
+def set_session(session: requests.Session = None) -> None:
+    """
+    Replace the process-wide HTTP session, e.g., to inject a preconfigured session in tests.
+    """
+    global _session
+
+    with _session_lock:
+        _session = session
+
+
+def close_session() -> None:
+    """
+    Close the process-wide HTTP session and its pooled connections.
+    """
+    global _session
+
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+
+
+def get_pool_stats() -> dict:
+    """
+    Get connection pool statistics for each host the process-wide session has connected to.
+    """
+    stats = {}
+
+    with _session_lock:
+        if _session is None:
+            return stats
+
+        adapters = list(_session.adapters.values())
+
+    for adapter in adapters:
+        pool_manager = getattr(adapter, "poolmanager", None)
+        if pool_manager is None:
+            continue
+
+        for key in list(pool_manager.pools.keys()):
+            pool = pool_manager.pools.get(key)
+            if pool is None:
+                continue
+
+            idle = 0
+            if pool.pool is not None:
+                idle = sum(1 for i in list(pool.pool.queue) if i is not None)
+
+            stats[f"{key.key_scheme}://{key.key_host}:{key.key_port}"] = {
+                "connections_opened": pool.num_connections,
+                "requests": pool.num_requests,
+                "idle_connections": idle,
+                "maxsize": pool.pool.maxsize if pool.pool is not None else 0,
+            }
+
+    return stats
+
+
+def _mount_adapters(session: requests.Session = None, pool_maxsize: int = 0) -> None:
+    """
+    INTERNAL: mount pooled HTTP(S) adapters holding pool_maxsize connections per host,
+    closing the adapters they replace (connections in use are closed once released).
+    """
+    for prefix in ["http://", "https://"]:
+        replaced = session.adapters.get(prefix)
+        session.mount(prefix, HTTPAdapter(pool_maxsize=pool_maxsize))
+
+        if replaced is not None:
+            replaced.close()
+
+
+def _get_pool_maxsize(session: requests.Session = None) -> int:
+    """
+    INTERNAL: get the number of connections per host held by the session's HTTPS adapter.
+    """
+    return getattr(session.get_adapter("https://"), "_pool_maxsize", 0)
@@ -2,13 +2,31 @@
 Functions for validating the datasets and validating the dataset version.
 """
 
+import os
 import re
-import requests
+import time
+import logging
+import threading
 
+from collections import OrderedDict
 from requests import RequestException
 from jsonschema import Draft7Validator
 
 from functions.exceptions import CriticalError
+from functions.session import get_session, HTTP_TIMEOUT
+from functions.cache import get_conditional_headers
+
+# Seconds a compiled schema is trusted before it is revalidated against the server
+SCHEMA_CACHE_TTL = int(os.getenv("SCHEMA_CACHE_TTL", "3600"))
+# Maximum number of compiled schemas held in memory
+SCHEMA_CACHE_MAXSIZE = int(os.getenv("SCHEMA_CACHE_MAXSIZE", "16"))
+# Number of locks schema fetches are striped over (by hash of the schema URL)
+SCHEMA_LOCK_STRIPES = 64
+
+_validators = OrderedDict()
+_validators_lock = threading.Lock()
+# Fixed for the life of the process, so waiters always share the lock of their schema
+_schema_locks = [threading.Lock() for _ in range(SCHEMA_LOCK_STRIPES)]
 
 
 def validate_json(schema_url: str = "", dataset: dict = None) -> None or dict:
@@ -16,14 +34,7 @@ def validate_json(schema_url: str = "", dataset: dict = None) -> None or dict:
     Get the relevant schema and validate a datasetv2 object against the schema.
     """
     try:
-        schema = requests.get(schema_url)
-
-        if schema.status_code != 200:
-            raise RequestException(
-                f"A status code of {schema.status_code} was received"
-            )
-
-        validator = Draft7Validator(schema=schema.json())
+        validator = get_validator(schema_url)
         errors = list(validator.iter_errors(dataset))
 
         if len(errors) > 0:
@@ -52,4 +63,68 @@ def verify_technical_metadata_schema_version(schema_url: str = "") -> bool:
     Verify that the supplied schema is either 2.1.0 or latest. Requirement for technical metadata.
     """
     allowed_versions = ["2.1.0", "latest"]
-    return bool(re.search("|".join(allowed_versions), schema_url))
\ No newline at end of file
+    return bool(re.search("|".join(allowed_versions), schema_url))
+
+
+def get_validator(schema_url: str = "") -> Draft7Validator:
+    """
+    Get a compiled validator for a schema, fetching and compiling the schema only if it is not
+    cached. Cached schemas older than SCHEMA_CACHE_TTL are revalidated using their ETag or
+    Last-Modified headers.
+    """
+    # One request per schema, even if several threads validate against it at once
+    with _schema_locks[hash(schema_url) % SCHEMA_LOCK_STRIPES]:
+        with _validators_lock:
+            cached = _validators.get(schema_url)
+            if cached:
+                _validators.move_to_end(schema_url)
+
+        if cached and time.monotonic() - cached["fetchedAt"] < SCHEMA_CACHE_TTL:
+            return cached["validator"]
+
+        schema = get_session().get(
+            schema_url, headers=get_conditional_headers(cached), timeout=HTTP_TIMEOUT
+        )
+
+        if cached and schema.status_code == 304:
+            cached["fetchedAt"] = time.monotonic()
+            return cached["validator"]
+
+        if schema.status_code != 200:
+            raise RequestException(f"A status code of {schema.status_code} was received")
+
+        validator = Draft7Validator(schema=schema.json())
+
+        with _validators_lock:
+            _validators[schema_url] = {
+                "validator": validator,
+                "etag": schema.headers.get("ETag"),
+                "lastModified": schema.headers.get("Last-Modified"),
+                "fetchedAt": time.monotonic(),
+            }
+            _validators.move_to_end(schema_url)
+
+            while len(_validators) > SCHEMA_CACHE_MAXSIZE:
+                _validators.popitem(last=False)
+
+        return validator
+
+
+def warm_validators(schema_urls: list = None) -> None:
+    """
+    Fetch and compile each distinct supported schema once, ahead of validating a catalogue.
+    """
+    for schema_url in sorted(set(filter(verify_schema_version, schema_urls or []))):
+        try:
+            get_validator(schema_url)
+        except RequestException as error:
+            # Validation will raise for this schema if a dataset reaches it
+            logging.warning(f"Unable to pre-fetch schema {schema_url}: {error}")
+
+
+def clear_validators() -> None:
+    """
+    Clear the compiled schema cache.
+    """
+    with _validators_lock:
+        _validators.clear()
@@ -4,9 +4,9 @@ import http
 import base64
 import logging
 
+from datetime import datetime
 from dotenv import load_dotenv
-from pymongo import MongoClient
-from flask import Flask, request, Response
+from flask import Flask, request, Response, jsonify
 
 from functions import *
 
@@ -14,8 +14,6 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 
 app = Flask(__name__)
-client = MongoClient(os.getenv("MONGO_URI") + "/" + os.getenv("MONGO_DATABASE"))
-db = client[os.getenv("MONGO_DATABASE")]
 
 
 @app.route("/", methods=["POST"])
@@ -24,7 +22,10 @@ def trigger() -> Response:
     HTTP wrapper for Cloud Scheduler.
 
     Description:
-        HTTP request runs ingestion procedure and responds 200 (SUCCESS) or 500 (ERROR).
+        HTTP request runs ingestion procedure and responds 200 (SUCCESS), 409 (a run of the
+        custodian is already in progress) or 500 (ERROR).
+        With INGESTION_ENGINE=asyncio and INGESTION_RESPOND_EARLY=true the ingestion is only
+        started and the request responds 202 (ACCEPTED) at once, its outcome is logged.
     """
     start_time = time.time()
 
@@ -32,7 +33,16 @@ def trigger() -> Response:
     custodian_id = base64.b64decode(request_data["data"]).decode("utf-8")
 
     try:
-        main(custodian_id=custodian_id)
+        if os.getenv("INGESTION_ENGINE", "sync") != "asyncio":
+            main(custodian_id=custodian_id)
+        elif os.getenv("INGESTION_RESPOND_EARLY", "false").lower() == "true":
+            run_async_ingestion(custodian_id=custodian_id, wait=False)
+            return ("", http.HTTPStatus.ACCEPTED)
+        else:
+            run_async_ingestion(custodian_id=custodian_id)
+    except RunInProgressError as error:
+        logging.warning(error)
+        return ("", http.HTTPStatus.CONFLICT)
     except Exception as error:
         logging.critical(error)
         return ("", http.HTTPStatus.INTERNAL_SERVER_ERROR)
@@ -43,6 +53,25 @@ def trigger() -> Response:
     return ("", http.HTTPStatus.OK)
 
 
+@app.route("/plan", methods=["POST"])
+def dry_run() -> Response:
+    """
+    HTTP wrapper for a dry run.
+
+    Description:
+        HTTP request responds 200 with the JSON sync plan of the custodian, without
+        modifying the Gateway or sending mail, or 500 (ERROR).
+    """
+    request_data = request.get_json()
+    custodian_id = base64.b64decode(request_data["data"]).decode("utf-8")
+
+    try:
+        return jsonify(plan_sync(db=get_db(), custodian_id=custodian_id))
+    except Exception as error:
+        logging.critical(error)
+        return ("", http.HTTPStatus.INTERNAL_SERVER_ERROR)
+
+
 def main(custodian_id: str) -> None:
     """
     Sync metadata for a given publisher/custodian catalogue.
@@ -55,6 +84,10 @@ def main(custodian_id: str) -> None:
         datasets with Gateway sync collection for updates, new and archived datasets and
         modify the Gateway database accordingly.
     """
+    # This worker process's client, created after any fork
+    db = get_db()
+    run_id = None
+
     try:
         ##########################################
         # GET publisher details
@@ -69,13 +102,39 @@ def main(custodian_id: str) -> None:
 
         logging.info(f"Initiating FMA ingestion for {custodian_name}")
 
+        ##########################################
+        # CLAIM the run before fetching anything
+        ##########################################
+
+        # Incremental syncs only list datasets modified since the last successful sync
+        sync_started = datetime.utcnow()
+        run = get_resumable_run(db=db, custodian_id=custodian_id, now=sync_started)
+
+        if run:
+            # A resumed run keeps the watermark and sync mode it started with
+            logging.info(f"Resuming run {run['_id']} for {custodian_name}")
+            run_id = run["_id"]
+            sync_started, modified_since = run["startedAt"], run["modifiedSince"]
+        else:
+            modified_since = get_incremental_params(publisher, now=sync_started)
+            run_id = start_run(
+                db=db,
+                custodian_id=custodian_id,
+                publisher_name=custodian_name,
+                modified_since=modified_since,
+                now=sync_started,
+            )
+
+        if modified_since:
+            logging.info(f"Incremental sync for {custodian_name}: {modified_since}")
+
         ##########################################
         # GET datasets from custodian and gateway
         ##########################################
 
-        headers = {}
+        concurrency = get_fetch_concurrency(publisher)
+        get_session(pool_maxsize=concurrency)
 
-        secret_name = publisher["federation"]["auth"]["secretKey"]
         custodian_datasets_url = (
             publisher["federation"]["endpoints"]["baseURL"]
             + publisher["federation"]["endpoints"]["datasets"]
@@ -84,238 +143,110 @@ def main(custodian_id: str) -> None:
             publisher["federation"]["endpoints"]["baseURL"]
             + publisher["federation"]["endpoints"]["dataset"]
         )
-        if publisher["federation"]["auth"]["type"] == "oauth":
-            custodian_token_url = (
-                publisher["federation"]["endpoints"]["baseURL"] + "/oauth/token"
-            )
-            secrets = get_client_secret(secret_name=secret_name)
-            access_token = get_access_token(
-                custodian_token_url,
-                secrets["client_id"],
-                secrets["client_secret"],
-            )
-            headers = {"Authorization": f"Bearer {access_token}"}
-            custodian_datasets = get_datasets(custodian_datasets_url, headers)
-
-        elif publisher["federation"]["auth"]["type"] == "api_key":
-            secrets = get_client_secret(secret_name=secret_name)
-            headers = {
-                "apikey": secrets["api_key"],
-            }
-            custodian_datasets = get_datasets(custodian_datasets_url, headers)
-
-        elif publisher["federation"]["auth"]["type"] == "bearer_token":
-            secrets = get_client_secret(secret_name=secret_name)
-            bearer_token = "Bearer " + secrets["bearer_token"]
-            
-            headers = {"Authorization": bearer_token }
-            custodian_datasets = get_datasets(custodian_datasets_url, headers)
-
-        else:
-            custodian_datasets = get_datasets(custodian_datasets_url)
 
-        gateway_datasets = list(
-            get_gateway_datasets(db=db, publisher=publisher["publisherDetails"]["name"])
+        configure_rate_limiter(
+            custodian_dataset_url,
+            publisher["federation"].get("rateLimit"),
+            max_concurrency=concurrency,
         )
 
-        ##########################################
-        # ARCHIVE logic
-        ##########################################
-        # PID no longer exists in custodian list
+        headers = get_publisher_headers(publisher)
+
+        custodian_datasets = get_datasets(
+            custodian_datasets_url,
+            headers,
+            pagination=publisher["federation"].get("pagination"),
+            publisher_name=custodian_name,
+            params=modified_since,
+        )
 
-        archived_datasets = datasets_to_archive(custodian_datasets, gateway_datasets)
+        gateway_datasets = list(
+            get_gateway_datasets(
+                db=db,
+                publisher=publisher["publisherDetails"]["name"],
+                pids=[i["persistentId"] for i in custodian_datasets]
+                if modified_since
+                else None,
+                fields=SYNC_STATUS_FIELDS,
+            )
+        )
 
         ##########################################
-        # ADDITION logic
+        # ARCHIVE and ADDITION logic
         ##########################################
-        # PID is completely new to Gateway
-
-        new_datasets = extract_new_datasets(custodian_datasets, gateway_datasets)
+        # PID no longer exists in custodian list, or is completely new to Gateway
 
-        sync_list = []
-        invalid_datasets = []
-        new_valid_datasets = []
-        updated_valid_datasets = []
-        previous_version_datasets = []
-        unsupported_version_datasets = []
-
-        for i in new_datasets:
-            try:
-                dataset = get_dataset(
-                    custodian_dataset_url, headers, i["persistentId"]
-                )
+        plan = create_sync_plan(
+            publisher, custodian_datasets, gateway_datasets, modified_since=modified_since
+        )
 
-            except RequestError as error:
-                # Fetching single dataset failed - update sync status
-                logging.error(
-                    f'Error retrieving new dataset {i["persistentId"]}: {error}'
-                )
+        new_datasets = plan["new"]
+        archived_datasets = plan["archive"]
+        # (Gateway sync entry, custodian catalogue entry), the sync entry is None if new
+        jobs = [(None, i) for i in new_datasets] + [
+            (j, i) for i, j in plan["update"]
+        ]
 
-                sync_list.extend(
-                    create_sync_array(
-                        datasets=[i],
-                        sync_status="fetch_failed",
-                        publisher=publisher,
-                    )
-                )
-                continue
+        record_plan(db=db, run_id=run_id, plan=plan)
+        writer = WriteBatcher(publisher, run_id=run_id)
 
-            validation_schema = i["@schema"] if "@schema" in i else ""
+        # Datasets checkpointed by the resumed run are not fetched again
+        if run:
+            jobs = skip_completed(jobs, get_checkpoints(db=db, run_id=run_id), writer.summary)
 
-            if not verify_schema_version(validation_schema):
-                logging.warning(f'Schema not supported for dataset {i["persistentId"]}')
+        warm_validators([i.get("@schema", "") for _, i in jobs])
 
-                sync_list.extend(
-                    create_sync_array(
-                        datasets=[i],
-                        sync_status="unsupported_version",
-                        publisher=publisher,
-                    )
-                )
-                unsupported_version_datasets.append(i)
-                continue
-
-            if not_valid := validate_json(validation_schema, dataset):
-                not_valid["persistentId"] = i["persistentId"]
-                invalid_datasets.append(not_valid)
-            else:
-                new_valid_datasets.append(
-                    transform_dataset(
-                        publisher=publisher, dataset=dataset, pid=i["persistentId"]
-                    )
-                )
+        # Latest Gateway versions of every updated dataset in a single round trip
+        latest_datasets = get_latest_gateway_datasets(
+            db=db, pids=[i["pid"] for i, _ in jobs if i]
+        )
 
         ##########################################
-        # UPDATE logic
+        # FETCH, VALIDATE, TRANSFORM and WRITE
         ##########################################
-        # PID already exists in sync collection
-
-        if len(gateway_datasets) > 0 and len(custodian_datasets) > 0:
-            (
-                custodian_versions,
-                gateway_versions,
-            ) = extract_overlapping_datasets(custodian_datasets, gateway_datasets)
-
-            for i in gateway_versions:
-                custodian_version = list(
-                    filter(
-                        lambda x, pid=i["pid"]: x["persistentId"] == pid,
-                        custodian_versions,
-                    )
-                )[0]
-
-                if (
-                    i["status"] in ["ok", "validation_failed"]
-                    and i["version"] == custodian_version["version"]
-                ):
-                    # No version change - move to next dataset
-                    continue
-
-                try:
-                    new_datasetv2 = get_dataset(
-                        custodian_dataset_url,
-                        headers,
-                        custodian_version["persistentId"],
-                    )
-                except RequestError as error:
-                    # Fetching single dataset failed - update sync status
-                    logging.error(
-                        f'Error retrieving updated dataset {custodian_version["persistentId"]}: {error}'
-                    )
-
-                    sync_list.extend(
-                        create_sync_array(
-                            datasets=[i],
-                            sync_status="fetch_failed",
-                            publisher=publisher,
-                        )
-                    )
-                    continue
-
-                validation_schema = (
-                    custodian_version["@schema"]
-                    if "@schema" in custodian_version
-                    else ""
-                )
+        # Streamed through bounded queues, the Gateway is written in size-capped batches
+
+        summary = run_pipeline(
+            db=db,
+            publisher=publisher,
+            url=custodian_dataset_url,
+            headers=headers,
+            jobs=jobs,
+            latest_datasets=latest_datasets,
+            max_workers=concurrency,
+            publisher_name=custodian_name,
+            writer=writer,
+        )
 
-                if not verify_schema_version(validation_schema):
-                    logging.warning(
-                        f'Schema not supported for dataset {custodian_version["persistentId"]}'
-                    )
-
-                    sync_list.extend(
-                        create_sync_array(
-                            datasets=[i],
-                            sync_status="unsupported_version",
-                            publisher=publisher,
-                        )
-                    )
-
-                    unsupported_version_datasets.append(custodian_version)
-                    continue
-
-                if not_valid := validate_json(validation_schema, new_datasetv2):
-                    not_valid["persistentId"] = custodian_version["persistentId"]
-                    invalid_datasets.append(not_valid)
-                else:
-                    latest_dataset = get_latest_gateway_dataset(db=db, pid=i["pid"])
-
-                    if not latest_dataset:
-                        # New dataset not in tools, exists in sync, but previously fetch_failed or validation_failed
-                        new_valid_datasets.append(
-                            transform_dataset(
-                                publisher=publisher,
-                                dataset=new_datasetv2,
-                                pid=custodian_version["persistentId"],
-                            )
-                        )
-                        continue
-
-                    updated_valid_datasets.append(
-                        transform_dataset(
-                            publisher=publisher,
-                            dataset=new_datasetv2,
-                            pid=custodian_version["persistentId"],
-                            previous_version=latest_dataset,
-                        )
-                    )
-
-                    previous_version_datasets.append(i)
+        logging.info(f"HTTP connection pools: {get_pool_stats()}")
+        logging.info(f"Rate limiters: {get_rate_limiter_stats()}")
+        logging.info(f"MongoDB connection pools: {get_mongo_pool_stats()}")
+        flush_payload_archive()
+        logging.info(f"Response cache: {sweep_response_cache()}")
 
         ##########################################
         # Database operations
         ##########################################
 
-        if len([*archived_datasets, *previous_version_datasets]) > 0:
-            archive_gateway_datasets(
-                db=db,
-                archived_datasets=archived_datasets,
-                previous_versions=previous_version_datasets,
-            )
-
-        if len([*new_valid_datasets, *updated_valid_datasets]) > 0:
-            add_new_datasets(
-                db=db, new_datasets=[*new_valid_datasets, *updated_valid_datasets]
+        if len(archived_datasets) > 0:
+            archived = archive_gateway_datasets(
+                db=db, archived_datasets=archived_datasets, previous_versions=[]
             )
-            sync_list.extend(
-                create_sync_array(
-                    datasets=[*new_valid_datasets, *updated_valid_datasets],
-                    sync_status="ok",
-                    publisher=publisher,
-                )
+            logging.info(
+                f"Archived {len(archived_datasets)} datasets for {custodian_name}: "
+                f"{archived['modified']} versions archived in {len(archived['chunks'])} chunks"
             )
 
-        if len(invalid_datasets) > 0:
-            sync_list.extend(
-                create_sync_array(
-                    datasets=invalid_datasets,
-                    sync_status="validation_failed",
-                    publisher=publisher,
-                )
+        # Failed fetches are retried from the same watermark on the next run
+        if not summary["fetch_failed"]:
+            update_sync_watermark(
+                db=db,
+                custodian_id=custodian_id,
+                watermark=sync_started,
+                full_sync=not modified_since,
             )
 
-        if len(sync_list) > 0:
-            sync_datasets(db=db, sync_list=sync_list)
+        finish_run(db=db, run_id=run_id, summary=summary)
 
         ##########################################
         # Emails
@@ -324,31 +255,51 @@ def main(custodian_id: str) -> None:
             len(datasets) > 0
             for datasets in [
                 archived_datasets,
-                new_valid_datasets,
-                updated_valid_datasets,
-                invalid_datasets,
-                unsupported_version_datasets,
+                summary["new"],
+                summary["updated"],
+                summary["invalid"],
+                summary["unsupported_version"],
             ]
         ):
             try:
                 send_summary_mail(
                     publisher=publisher,
                     archived_datasets=archived_datasets,
-                    new_datasets=new_valid_datasets,
-                    updated_datasets=updated_valid_datasets,
-                    failed_validation=invalid_datasets,
-                    unsupported_version_datasets=unsupported_version_datasets,
+                    new_datasets=summary["new"],
+                    updated_datasets=summary["updated"],
+                    failed_validation=summary["invalid"],
+                    unsupported_version_datasets=summary["unsupported_version"],
                 )
             except Exception as error:
-                print(error)
+                logging.error(error)
 
     except (CriticalError, RequestError, AuthError) as error:
         # Custom error raised, log error, send email if required, set federation.active to false
         if error.__class__.__name__ == "AuthError":
+            invalidate_client_secret(publisher["federation"]["auth"]["secretKey"])
             send_auth_error_mail(publisher=publisher, url=error.__url__())
 
         if error.__class__.__name__ == "RequestError":
             send_datasets_error_mail(publisher=publisher, url=error.__url__())
 
+        if run_id:
+            try:
+                finish_run(db=db, run_id=run_id, status="failed")
+            except CriticalError as run_error:
+                logging.error(run_error)
+
         update_publisher(db, status=False, custodian_id=custodian_id)
         raise
+
+    except (RunInProgressError, RunLeaseLostError):
+        # Another run holds (or took over) the lease, so this run is not marked failed
+        raise
+
+    except Exception:
+        # Unexpected error, the run is left resumable rather than locked until its lease expires
+        if run_id:
+            try:
+                finish_run(db=db, run_id=run_id, status="failed")
+            except CriticalError as run_error:
+                logging.error(run_error)
+        raise
@@ -0,0 +1,91 @@
+import json
+import asyncio
+import threading
+import aiohttp
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from functions.aio import *
+from functions.ratelimit import configure_rate_limiter
+
+
+class CustodianHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    throttled = set()
+
+    def do_GET(self):
+        dataset_id = self.path.rsplit("/", 1)[-1]
+        status = 200
+        headers = {}
+
+        if dataset_id == "def":
+            status = 500
+        if dataset_id == "ghi" and dataset_id not in CustodianHandler.throttled:
+            CustodianHandler.throttled.add(dataset_id)
+            status, headers = 429, {"Retry-After": "0"}
+
+        body = json.dumps({"identifier": dataset_id}).encode() if status == 200 else b""
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_fetch_datasets_async():
+    """
+    Function should fetch datasets concurrently in order, retrying 429s and recording failures.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CustodianHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    async def _fetch():
+        async with aiohttp.ClientSession() as http:
+            return await fetch_datasets_async(
+                http,
+                f"http://127.0.0.1:{server.server_port}/datasets/{{id}}",
+                {},
+                ["abc", "def", "ghi"],
+                max_workers=2,
+            )
+
+    try:
+        datasets = asyncio.run(_fetch())
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert datasets[0] == ({"identifier": "abc"}, None)
+    assert datasets[1][0] is None
+    assert isinstance(datasets[1][1], RequestError)
+    assert datasets[2] == ({"identifier": "ghi"}, None)
+
+
+def test_get_dataset_async__rate_limiter():
+    """
+    Function should send requests through the host's rate limiter, honouring its maxRetries.
+    """
+    CustodianHandler.throttled.discard("ghi")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CustodianHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/datasets/{{id}}"
+    limiter = configure_rate_limiter(url, {"maxRetries": 0}, max_concurrency=2)
+
+    async def _fetch():
+        async with aiohttp.ClientSession() as http:
+            return await fetch_dataset_async(http, url, {}, "ghi")
+
+    try:
+        dataset, error = asyncio.run(_fetch())
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert dataset is None
+    assert isinstance(error, RequestError)
+    assert limiter.stats()["throttled"] == 1
+    assert limiter.stats()["in_flight"] == 0
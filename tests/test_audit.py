@@ -0,0 +1,87 @@
+import gzip
+import hashlib
+import threading
+import responses
+
+from functions.audit import *
+from functions.extract import get_dataset, get_datasets
+
+
+def test_audit_payload__summary_only(monkeypatch):
+    """
+    Function should summarise a payload without archiving it when no archive is configured.
+    """
+    monkeypatch.setattr("functions.audit.PAYLOAD_ARCHIVE_DIR", "")
+    body = b'{"identifier": "abc"}'
+
+    summary = audit_payload("dataset", "abc", body, "FAKEY")
+
+    assert summary["bytes"] == len(body)
+    assert summary["sha256"] == hashlib.sha256(body).hexdigest()
+    assert "archive" not in summary
+
+
+@responses.activate
+def test_get_dataset__archives_payload(tmp_path, monkeypatch):
+    """
+    Function should write the raw dataset payload, compressed, to the archive.
+    """
+    monkeypatch.setattr("functions.audit.PAYLOAD_ARCHIVE_DIR", str(tmp_path))
+    body = b'{"identifier": "abc", "title": "\\u00e9"}'
+
+    responses.add(
+        responses.GET, "http://custodian/datasets/abc", body=body, status=200
+    )
+
+    get_dataset("http://custodian/datasets/{id}", {}, "abc")
+    flush_payload_archive()
+
+    archived = list(tmp_path.glob("unknown/dataset/*/abc-*.json.gz"))
+
+    assert len(archived) == 1
+    assert gzip.decompress(archived[0].read_bytes()) == body
+
+
+@responses.activate
+def test_get_datasets__archives_pages(tmp_path, monkeypatch):
+    """
+    Function should archive each streamed catalogue page.
+    """
+    monkeypatch.setattr("functions.audit.PAYLOAD_ARCHIVE_DIR", str(tmp_path))
+    body = b'{"items": [{"persistentId": "abc"}]}'
+
+    responses.add(responses.GET, "http://custodian/datasets", body=body, status=200)
+
+    get_datasets("http://custodian/datasets", {}, publisher_name="FAKEY")
+    flush_payload_archive()
+
+    archived = list(tmp_path.glob("FAKEY/datasets/*/page-1-*.json.gz"))
+
+    assert len(archived) == 1
+    assert gzip.decompress(archived[0].read_bytes()) == body
+
+
+def test_flush_payload_archive__writer_errors(tmp_path, monkeypatch):
+    """
+    Function should not hang when archiving a payload fails or the writer has died.
+    """
+    monkeypatch.setattr("functions.audit.PAYLOAD_ARCHIVE_DIR", str(tmp_path))
+    open_archive = gzip.open
+
+    def failing_open(path, mode="rb"):
+        if "bad" in str(path):
+            raise ValueError("unexpected")
+        return open_archive(path, mode)
+
+    monkeypatch.setattr("functions.audit.gzip.open", failing_open)
+
+    audit_payload("dataset", "bad", b"{}", "FAKEY")
+    flush_payload_archive()
+
+    # A dead writer is restarted
+    monkeypatch.setattr("functions.audit._writer", threading.Thread(target=lambda: None))
+    audit_payload("dataset", "good", b"{}", "FAKEY")
+    flush_payload_archive()
+
+    assert not list(tmp_path.glob("FAKEY/dataset/*/bad-*"))
+    assert len(list(tmp_path.glob("FAKEY/dataset/*/good-*.json.gz"))) == 1
@@ -1,5 +1,6 @@
 import responses
 
+from types import SimpleNamespace
 from responses import matchers
 
 from functions.auth import *
@@ -81,3 +82,212 @@ def test_get_access_token__403():
             str(error)
             == f"Authorisation error: 403 error was received from {token_url}"
         )
+
+
+@responses.activate
+def test_get_cached_access_token__reused():
+    """
+    Function should reuse a cached token until it is close to expiry.
+    """
+    token_url = "http://auth.com/cached"
+
+    responses.add(
+        responses.POST,
+        token_url,
+        json={"access_token": "firstToken", "expires_in": 3600},
+        status=200,
+    )
+
+    assert get_cached_access_token(token_url, "client", "secret") == "firstToken"
+    assert get_cached_access_token(token_url, "client", "secret") == "firstToken"
+    assert len(responses.calls) == 1
+
+    invalidate_access_token(token_url, "client")
+
+
+@responses.activate
+def test_get_cached_access_token__refreshes_before_expiry(monkeypatch):
+    """
+    Function should request a new token when the cached one expires within the refresh margin.
+    """
+    token_url = "http://auth.com/expiring"
+    clock = [1000.0]
+    monkeypatch.setattr(
+        "functions.auth.time", SimpleNamespace(monotonic=lambda: clock[0])
+    )
+
+    responses.add(
+        responses.POST,
+        token_url,
+        json={"access_token": "firstToken", "expires_in": 3600},
+        status=200,
+    )
+    responses.add(
+        responses.POST,
+        token_url,
+        json={"access_token": "secondToken", "expires_in": 3600},
+        status=200,
+    )
+
+    assert get_cached_access_token(token_url, "client", "secret") == "firstToken"
+    clock[0] += 3600 - TOKEN_REFRESH_MARGIN / 2
+    assert get_cached_access_token(token_url, "client", "secret") == "secondToken"
+
+    invalidate_access_token(token_url, "client")
+
+
+@responses.activate
+def test_get_cached_access_token__short_lived(monkeypatch):
+    """
+    Function should reuse a token shorter-lived than the margin for half its lifetime.
+    """
+    token_url = "http://auth.com/short"
+    clock = [1000.0]
+    monkeypatch.setattr(
+        "functions.auth.time", SimpleNamespace(monotonic=lambda: clock[0])
+    )
+
+    responses.add(
+        responses.POST,
+        token_url,
+        json={"access_token": "firstToken", "expires_in": 30},
+        status=200,
+    )
+    responses.add(
+        responses.POST,
+        token_url,
+        json={"access_token": "secondToken", "expires_in": 30},
+        status=200,
+    )
+
+    assert get_cached_access_token(token_url, "client", "secret") == "firstToken"
+    clock[0] += 10
+    assert get_cached_access_token(token_url, "client", "secret") == "firstToken"
+    assert len(responses.calls) == 1
+    clock[0] += 10
+    assert get_cached_access_token(token_url, "client", "secret") == "secondToken"
+
+    invalidate_access_token(token_url, "client")
+
+
+@responses.activate
+def test_get_oauth_headers__single_flight_refresh():
+    """
+    Provider should refresh a rejected token once, however many callers report it as stale.
+    """
+    token_url = "http://auth.com/stale"
+
+    responses.add(
+        responses.POST,
+        token_url,
+        json={"access_token": "firstToken", "expires_in": 3600},
+        status=200,
+    )
+    responses.add(
+        responses.POST,
+        token_url,
+        json={"access_token": "secondToken", "expires_in": 3600},
+        status=200,
+    )
+
+    headers = get_oauth_headers(token_url, "client", "secret")
+    stale = headers()
+
+    assert headers(stale=stale) == {"Authorization": "Bearer secondToken"}
+    assert headers(stale=stale) == {"Authorization": "Bearer secondToken"}
+    assert len(responses.calls) == 2
+
+    invalidate_access_token(token_url, "client")
+
+
+@responses.activate
+def test_get_dataset__retries_401_with_refreshed_token():
+    """
+    Function should retry a 401 once using a refreshed OAuth token.
+    """
+    from functions.extract import get_dataset
+
+    token_url = "http://auth.com/retry"
+
+    responses.add(
+        responses.POST,
+        token_url,
+        json={"access_token": "firstToken", "expires_in": 3600},
+        status=200,
+    )
+    responses.add(
+        responses.POST,
+        token_url,
+        json={"access_token": "secondToken", "expires_in": 3600},
+        status=200,
+    )
+    responses.add(
+        responses.GET,
+        "http://custodian/datasets/abc",
+        status=401,
+        match=[matchers.header_matcher({"Authorization": "Bearer firstToken"})],
+    )
+    responses.add(
+        responses.GET,
+        "http://custodian/datasets/abc",
+        json={"identifier": "abc"},
+        status=200,
+        match=[matchers.header_matcher({"Authorization": "Bearer secondToken"})],
+    )
+
+    dataset = get_dataset(
+        "http://custodian/datasets/{id}",
+        get_oauth_headers(token_url, "client", "secret"),
+        "abc",
+    )
+
+    assert dataset == {"identifier": "abc"}
+
+    invalidate_access_token(token_url, "client")
+
+
+class FakeSecretManagerClient:
+    instances = 0
+    reads = 0
+
+    def __init__(self):
+        FakeSecretManagerClient.instances += 1
+
+    def access_secret_version(self, request=None):
+        FakeSecretManagerClient.reads += 1
+
+        class Payload:
+            data = b"{'client_id': 'abc', 'client_secret': 'xyz'}"
+
+        class Response:
+            payload = Payload()
+
+        return Response()
+
+
+def test_get_client_secret__cached(monkeypatch):
+    """
+    Function should reuse one client and serve repeated reads from the cache until invalidated.
+    """
+    monkeypatch.setattr("functions.auth._secret_client", None)
+    monkeypatch.setattr(
+        "functions.auth.secretmanager.SecretManagerServiceClient",
+        FakeSecretManagerClient,
+    )
+    invalidate_client_secret("projects/fake/secrets/key")
+
+    first = get_client_secret("projects/fake/secrets/key")
+    first["client_id"] = "mutated"
+    second = get_client_secret("projects/fake/secrets/key")
+
+    assert second == {"client_id": "abc", "client_secret": "xyz"}
+    assert FakeSecretManagerClient.instances == 1
+    assert FakeSecretManagerClient.reads == 1
+
+    invalidate_client_secret("projects/fake/secrets/key")
+    get_client_secret("projects/fake/secrets/key")
+
+    assert FakeSecretManagerClient.instances == 1
+    assert FakeSecretManagerClient.reads == 2
+
+    invalidate_client_secret("projects/fake/secrets/key")
@@ -0,0 +1,45 @@
+import os
+import time
+
+from functions.cache import *
+from functions.cache import _cache_path
+
+
+def test_sweep_response_cache(tmp_path, monkeypatch):
+    """
+    Function should evict expired entries, then the least recently used beyond the size limit.
+    """
+    monkeypatch.setattr("functions.cache.RESPONSE_CACHE_DIR", str(tmp_path))
+
+    for dataset_id in ["old", "a", "b", "c"]:
+        set_cached_response("publisher", dataset_id, b"x" * 100)
+
+    now = time.time()
+    for used, dataset_id in [(now - 100, "old"), (now - 3, "a"), (now - 2, "b"), (now - 1, "c")]:
+        os.utime(_cache_path("publisher", dataset_id), (used, used))
+
+    # Reading an entry marks it as recently used
+    assert get_cached_response("publisher", "a")["body"] == b"x" * 100
+
+    swept = sweep_response_cache(max_bytes=300, max_age=50)
+
+    assert swept["evicted"] == 2
+    assert swept["files"] == 2
+    assert get_cached_response("publisher", "old") is None
+    assert get_cached_response("publisher", "b") is None
+    assert get_cached_response("publisher", "a") is not None
+    assert get_cached_response("publisher", "c") is not None
+
+
+def test_set_cached_response__sweeps(tmp_path, monkeypatch):
+    """
+    Function should sweep the cache once a tenth of its maximum size has been written.
+    """
+    monkeypatch.setattr("functions.cache.RESPONSE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr("functions.cache.RESPONSE_CACHE_MAX_BYTES", 1000)
+    monkeypatch.setattr("functions.cache._written", 0)
+
+    for dataset_id in range(20):
+        set_cached_response("publisher", dataset_id, b"x" * 100)
+
+    assert sweep_response_cache()["bytes"] <= 1000
@@ -0,0 +1,162 @@
+import mongomock
+
+from datetime import datetime, timedelta
+
+from functions.checkpoint import *
+from functions.pipeline import WriteBatcher, write_batch
+
+custodian_id = "6421d1025a55d137b0fa0b89"
+publisher = {
+    "_id": custodian_id,
+    "publisherDetails": {"name": "CHECKPOINT"},
+    "uses5Safes": False,
+}
+plan = {
+    "publisher": "CHECKPOINT",
+    "modifiedSince": {"modifiedSince": "2023-01-01T00:00:00Z"},
+    "archive": [{"pid": "old"}],
+    "new": [{"persistentId": "abc", "version": "1"}],
+    "update": [({"persistentId": "def", "version": "2"}, {"pid": "def", "version": "1"})],
+}
+
+
+def test_start_run__resume():
+    """
+    Functions should record a run, resume it once its lease has expired and forget it once
+    completed.
+    """
+    db = mongomock.MongoClient()["checkpoint"]
+    now = datetime(2023, 1, 2)
+
+    assert get_resumable_run(db, custodian_id, now=now) is None
+
+    run_id = start_run(db, custodian_id, "CHECKPOINT", plan["modifiedSince"], now=now)
+    record_plan(db, run_id, plan, now=now)
+
+    # Still holds its lease
+    assert get_resumable_run(db, custodian_id, now=now + timedelta(minutes=1)) is None
+
+    expired = now + timedelta(seconds=CHECKPOINT_LEASE + 1)
+    run = get_resumable_run(db, custodian_id, now=expired)
+
+    assert run["_id"] == run_id
+    assert run["resumed"] == 1
+    assert run["modifiedSince"] == plan["modifiedSince"]
+    assert run["plan"] == {"archive": 1, "new": 1, "update": 1}
+
+    # Claimed, so another worker cannot take it
+    assert get_resumable_run(db, custodian_id, now=expired) is None
+
+    save_checkpoints(db, [create_checkpoint(run_id, "abc", "1", "new", {"pid": "abc"})])
+
+    # Too old to resume
+    finish_run(db, run_id, status="failed")
+    assert (
+        get_resumable_run(
+            db, custodian_id, now=now + timedelta(seconds=CHECKPOINT_MAX_AGE + 1)
+        )
+        is None
+    )
+
+    finish_run(db, run_id, summary={"new": [{"pid": "abc"}], "unchanged": 2})
+
+    assert get_resumable_run(db, custodian_id, now=expired) is None
+    assert db.sync_runs.find_one({"_id": run_id})["summary"] == {"new": 1, "unchanged": 2}
+    assert get_checkpoints(db, run_id) == {}
+
+
+def test_start_run__abandons_unfinished():
+    """
+    Function should abandon the unfinished runs of a publisher when a new run starts.
+    """
+    db = mongomock.MongoClient()["checkpoint"]
+
+    first = start_run(db, custodian_id, "CHECKPOINT")
+    finish_run(db, first, status="failed")
+    start_run(db, custodian_id, "CHECKPOINT")
+
+    assert db.sync_runs.find_one({"_id": first})["status"] == "abandoned"
+
+
+def test_start_run__in_progress():
+    """
+    Function should not start a run while another holds its lease, and a run that lost its
+    lease should stop at its next checkpoint.
+    """
+    db = mongomock.MongoClient()["checkpoint"]
+    now = datetime.utcnow()
+
+    first = start_run(db, custodian_id, "CHECKPOINT", now=now)
+
+    try:
+        start_run(db, custodian_id, "CHECKPOINT", now=now)
+        assert False
+    except RunInProgressError as error:
+        assert "in progress" in str(error)
+
+    second = start_run(
+        db, custodian_id, "CHECKPOINT", now=now + timedelta(seconds=CHECKPOINT_LEASE + 1)
+    )
+
+    assert second != first
+    assert db.sync_runs.find_one({"_id": first})["status"] == "abandoned"
+
+    try:
+        save_checkpoints(db, [create_checkpoint(first, "abc", "1", "new")])
+        assert False
+    except RunLeaseLostError as error:
+        assert "no longer running" in str(error)
+
+
+def test_skip_completed():
+    """
+    Function should skip the datasets checkpointed at their current version and restore
+    their summary entries.
+    """
+    summary = {
+        "new": [],
+        "updated": [],
+        "invalid": [],
+        "unsupported_version": [],
+        "fetch_failed": 0,
+        "unchanged": 0,
+    }
+    jobs = [
+        (None, {"persistentId": "abc", "version": "1"}),
+        ({"pid": "def"}, {"persistentId": "def", "version": "3"}),
+        ({"pid": "ghi"}, {"persistentId": "ghi", "version": "1"}),
+        ({"pid": "jkl"}, {"persistentId": "jkl", "version": "1"}),
+    ]
+    checkpoints = {
+        "abc": create_checkpoint(None, "abc", "1", "new", {"pid": "abc"}),
+        "def": create_checkpoint(None, "def", "2", "updated", {"pid": "def"}),
+        "ghi": create_checkpoint(None, "ghi", "1", "unchanged"),
+        # Completed, then dropped out of the plan (e.g., now synced)
+        "mno": create_checkpoint(None, "mno", "1", "new", {"pid": "mno"}),
+    }
+
+    remaining = skip_completed(jobs, checkpoints, summary)
+
+    assert [i["persistentId"] for _, i in remaining] == ["def", "jkl"]
+    assert summary["new"] == [{"pid": "abc"}, {"pid": "mno"}]
+    assert summary["updated"] == []
+    assert summary["unchanged"] == 1
+
+
+def test_write_batch__checkpoints():
+    """
+    Function should checkpoint every written dataset except failed fetches.
+    """
+    db = mongomock.MongoClient()["checkpoint"]
+    run_id = start_run(db, custodian_id, "CHECKPOINT")
+    writer = WriteBatcher(publisher, run_id=run_id)
+
+    unchanged = {"persistentId": "abc", "name": "a", "version": "1"}
+    failed = {"persistentId": "def", "name": "d", "version": "1"}
+
+    writer.add("unchanged", None, {"pid": "abc"}, unchanged, "hash")
+    writer.add("fetch_failed", None, None, failed)
+    write_batch(db, writer.drain())
+
+    assert list(get_checkpoints(db, run_id)) == ["abc"]
+    assert get_checkpoints(db, run_id)["abc"]["stage"] == "unchanged"
@@ -0,0 +1,89 @@
+import os
+
+from types import SimpleNamespace
+
+from functions.database import *
+
+
+def test_get_client_options__from_environment(monkeypatch):
+    """
+    Function should read the pool size, timeouts and compressors from the environment.
+    """
+    monkeypatch.setenv("MONGO_MAX_POOL_SIZE", "20")
+    monkeypatch.setenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "5000")
+    monkeypatch.setenv("MONGO_COMPRESSORS", "zstd,snappy")
+    monkeypatch.setattr("functions.database.find_spec", lambda package: True)
+    monkeypatch.delenv("MONGO_SOCKET_TIMEOUT_MS", raising=False)
+
+    options = get_client_options()
+
+    assert options["maxPoolSize"] == 20
+    assert options["waitQueueTimeoutMS"] == 5000
+    assert options["compressors"] == "zstd,snappy"
+    assert "socketTimeoutMS" not in options
+    assert options["event_listeners"] == [pool_metrics]
+
+
+def test_get_compressors__unavailable(monkeypatch):
+    """
+    Function should drop unsupported compressors and those whose package is not installed.
+    """
+    monkeypatch.setattr(
+        "functions.database.find_spec", lambda package: package != "snappy"
+    )
+
+    assert get_compressors("zstd, snappy,lz4,zlib") == ["zstd", "zlib"]
+    assert get_compressors("") == []
+
+
+def test_get_client__per_process(monkeypatch):
+    """
+    Function should create the client lazily, once per process.
+    """
+    monkeypatch.setenv("MONGO_URI", "mongodb://localhost:27017")
+    monkeypatch.setenv("MONGO_DATABASE", "test")
+    monkeypatch.setenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "100")
+
+    close_client()
+    try:
+        client = get_client()
+
+        assert get_client() is client
+        assert get_db().name == "test"
+
+        # A forked worker gets its own client
+        pid = os.getpid()
+        monkeypatch.setattr(os, "getpid", lambda: pid + 1)
+
+        assert get_client() is not client
+    finally:
+        monkeypatch.undo()
+        close_client()
+
+
+def test_pool_metrics__checkouts_and_commands():
+    """
+    Listener should count connections in use, checkout waits and command times per server.
+    """
+    metrics = PoolMetrics()
+    address = ("localhost", 27017)
+    event = SimpleNamespace(address=address)
+
+    metrics.connection_created(event)
+    metrics.connection_check_out_started(event)
+    metrics.connection_checked_out(event)
+    metrics.connection_check_out_started(event)
+    metrics.connection_checked_out(event)
+    metrics.connection_checked_in(event)
+    metrics.succeeded(SimpleNamespace(connection_id=address, duration_micros=1500000))
+    metrics.failed(SimpleNamespace(connection_id=address, duration_micros=500000))
+
+    stats = metrics.stats()["localhost:27017"]
+
+    assert stats["in_use"] == 1
+    assert stats["checkouts"] == 2
+    assert stats["checkout_wait_total"] >= 0
+    assert stats["connections_created"] == 1
+    assert stats["commands"] == 2
+    assert stats["command_failures"] == 1
+    assert stats["command_time"] == 2.0
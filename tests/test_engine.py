@@ -0,0 +1,205 @@
+import json
+import asyncio
+import threading
+import aiohttp
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from datetime import datetime
+from mongomock import ObjectId
+from mongomock_motor import AsyncMongoMockClient
+
+from functions.engine import *
+
+custodian_id = "6421d1025a55d137b0fa0b89"
+schema = "https://example.org/schema/2.1.0/dataset.schema.json"
+
+
+class CustodianHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path == "/datasets":
+            body = {
+                "items": [
+                    {"persistentId": "abc", "version": "1", "@schema": schema, "name": "a"},
+                    {"persistentId": "def", "version": "1", "@schema": "1.0", "name": "d"},
+                ]
+            }
+        else:
+            dataset_id = self.path.rsplit("/", 1)[-1]
+            body = {"title": dataset_id, "version": "1"}
+
+        body = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _transform(publisher=None, dataset=None, pid="", previous_version=None, content_hash=None):
+    return {
+        "pid": pid,
+        "name": dataset["title"],
+        "datasetVersion": dataset["version"],
+        "datasetid": dataset["title"],
+        "activeflag": "inReview",
+    }
+
+
+def test_run_ingestion(tmp_path, monkeypatch):
+    """
+    Function should sync a custodian catalogue into the Gateway and record a completed run.
+    """
+    monkeypatch.setattr("functions.cache.RESPONSE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr("functions.engine.warm_validators", lambda *args: None)
+    monkeypatch.setattr("functions.pipeline.validate_json", lambda *args: None)
+    monkeypatch.setattr("functions.pipeline.transform_dataset_cached", _transform)
+    monkeypatch.setattr("functions.engine.send_summary_mail", lambda **kwargs: None)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CustodianHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    db = AsyncMongoMockClient()["engine"]
+
+    async def _ingest():
+        await db.publishers.insert_one(
+            {
+                "_id": ObjectId(custodian_id),
+                "publisherDetails": {"name": "ENGINE"},
+                "federation": {
+                    "active": True,
+                    "auth": {"type": "none"},
+                    "endpoints": {
+                        "baseURL": f"http://127.0.0.1:{server.server_port}",
+                        "datasets": "/datasets",
+                        "dataset": "/datasets/{id}",
+                    },
+                },
+            }
+        )
+
+        async with aiohttp.ClientSession() as http:
+            await run_ingestion(db, http, custodian_id)
+
+        return (
+            await db.tools.find({}, {"_id": 0}).to_list(None),
+            await db.sync_status.find({}, {"_id": 0}).to_list(None),
+            await db.sync_runs.find_one({"publisherId": custodian_id}),
+            await db.publishers.find_one({"_id": ObjectId(custodian_id)}),
+        )
+
+    try:
+        tools, sync_status, run, publisher = asyncio.run(_ingest())
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert [i["pid"] for i in tools] == ["abc"]
+    assert sorted((i["pid"], i["status"]) for i in sync_status) == [
+        ("abc", "ok"),
+        ("def", "unsupported_version"),
+    ]
+    assert run["status"] == "completed"
+    assert publisher["federation"]["active"]
+    assert publisher["federation"]["lastFullSync"]
+
+
+def test_run_ingestion__in_progress():
+    """
+    Function should reject a run while another holds its lease, before fetching anything and
+    without deactivating the publisher.
+    """
+    db = AsyncMongoMockClient()["engine"]
+
+    async def _ingest():
+        await db.publishers.insert_one(
+            {
+                "_id": ObjectId(custodian_id),
+                "publisherDetails": {"name": "ENGINE"},
+                "federation": {
+                    "active": True,
+                    "auth": {"type": "none"},
+                    "endpoints": {
+                        "baseURL": "http://127.0.0.1:1",
+                        "datasets": "/datasets",
+                        "dataset": "/datasets/{id}",
+                    },
+                },
+            }
+        )
+        await db.sync_runs.insert_one(
+            {
+                "publisherId": custodian_id,
+                "status": "running",
+                "startedAt": datetime.utcnow(),
+                "updatedAt": datetime.utcnow(),
+            }
+        )
+
+        try:
+            await run_ingestion(db, None, custodian_id)
+            assert False
+        except RunInProgressError as error:
+            assert "in progress" in str(error)
+
+        return await db.publishers.find_one({"_id": ObjectId(custodian_id)})
+
+    publisher = asyncio.run(_ingest())
+
+    assert publisher["federation"]["active"]
+
+
+def test_run_ingestion__unexpected_error(tmp_path, monkeypatch):
+    """
+    Function should mark the run failed on an unexpected error, so the next trigger resumes it
+    rather than waiting for its lease to expire.
+    """
+    monkeypatch.setattr("functions.cache.RESPONSE_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr("functions.engine.warm_validators", lambda *args: None)
+
+    async def _fail(**kwargs):
+        raise TypeError("unexpected")
+
+    monkeypatch.setattr("functions.engine.run_pipeline_async", _fail)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CustodianHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    db = AsyncMongoMockClient()["engine"]
+
+    async def _ingest():
+        await db.publishers.insert_one(
+            {
+                "_id": ObjectId(custodian_id),
+                "publisherDetails": {"name": "ENGINE"},
+                "federation": {
+                    "active": True,
+                    "auth": {"type": "none"},
+                    "endpoints": {
+                        "baseURL": f"http://127.0.0.1:{server.server_port}",
+                        "datasets": "/datasets",
+                        "dataset": "/datasets/{id}",
+                    },
+                },
+            }
+        )
+
+        try:
+            await run_ingestion(db, None, custodian_id)
+            assert False
+        except TypeError:
+            pass
+
+        return await get_resumable_run_async(db=db, custodian_id=custodian_id)
+
+    try:
+        run = asyncio.run(_ingest())
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert run["status"] == "running"
+    assert run["resumed"] == 1
@@ -1,8 +1,11 @@
+import json
+import requests
 import responses
 
 from responses import matchers
 
 from functions.extract import *
+from functions.extract import _iter_json_items
 
 
 @responses.activate
@@ -152,3 +155,374 @@ def test_get_dataset__403():
             str(error)
             == f"Authorisation error: unauthorised 403 error was received from {dataset_url}"
         )
+
+
+@responses.activate
+def test_fetch_datasets__preserves_order():
+    """
+    Function should return fetched datasets in the order of the requested IDs, recording failed fetches.
+    """
+    dataset_url = "http://custodian/datasets/{id}"
+    headers = {"Authorization": "testAuthJWT"}
+
+    responses.add(
+        responses.GET, "http://custodian/datasets/abc", json={"id": "abc"}, status=200
+    )
+    responses.add(responses.GET, "http://custodian/datasets/def", status=500)
+    responses.add(
+        responses.GET, "http://custodian/datasets/ghi", json={"id": "ghi"}, status=200
+    )
+
+    datasets = fetch_datasets(dataset_url, headers, ["abc", "def", "ghi"], max_workers=3)
+
+    assert [dataset for dataset, _ in datasets] == [{"id": "abc"}, None, {"id": "ghi"}]
+    assert datasets[0][1] is None
+    assert isinstance(datasets[1][1], RequestError)
+
+
+@responses.activate
+def test_fetch_datasets__connection_error():
+    """
+    Function should record a connection error as a failed fetch of that dataset only.
+    """
+    dataset_url = "http://custodian/datasets/{id}"
+
+    responses.add(
+        responses.GET,
+        "http://custodian/datasets/abc",
+        body=requests.ConnectionError("connection reset"),
+    )
+    responses.add(
+        responses.GET, "http://custodian/datasets/def", json={"id": "def"}, status=200
+    )
+
+    datasets = fetch_datasets(dataset_url, {}, ["abc", "def"], max_workers=2)
+
+    assert datasets[0][0] is None
+    assert isinstance(datasets[0][1], RequestError)
+    assert datasets[1] == ({"id": "def"}, None)
+
+
+@responses.activate
+def test_fetch_datasets__auth_error():
+    """
+    Function should raise AuthError rather than recording it as a failed fetch.
+    """
+    dataset_url = "http://custodian/datasets/{id}"
+
+    responses.add(responses.GET, "http://custodian/datasets/abc", status=401)
+
+    try:
+        fetch_datasets(dataset_url, {}, ["abc"])
+        assert False
+    except AuthError as error:
+        assert error.__url__() == dataset_url
+
+
+@responses.activate
+def test_get_dataset__not_modified(tmp_path, monkeypatch):
+    """
+    Function should send the cached ETag and serve a 304 response from the local cache.
+    """
+    monkeypatch.setattr("functions.cache.RESPONSE_CACHE_DIR", str(tmp_path))
+    dataset_url = "http://custodian/datasets/{id}"
+
+    responses.add(
+        responses.GET,
+        "http://custodian/datasets/abc",
+        json={"identifier": "abc"},
+        status=200,
+        headers={"ETag": '"v1"'},
+    )
+    responses.add(
+        responses.GET,
+        "http://custodian/datasets/abc",
+        status=304,
+        match=[matchers.header_matcher({"If-None-Match": '"v1"'})],
+    )
+
+    first = get_dataset(dataset_url, {}, "abc", publisher_name="FAKEY")
+    second = get_dataset(dataset_url, {}, "abc", publisher_name="FAKEY")
+
+    assert first == second == {"identifier": "abc"}
+    assert responses.calls[1].response.status_code == 304
+
+
+@responses.activate
+def test_get_dataset__invalid_json(tmp_path, monkeypatch):
+    """
+    Function should raise RequestError for a body that is not JSON, without caching it.
+    """
+    monkeypatch.setattr("functions.cache.RESPONSE_CACHE_DIR", str(tmp_path))
+    dataset_url = "http://custodian/datasets/{id}"
+
+    responses.add(
+        responses.GET,
+        "http://custodian/datasets/abc",
+        body="<html>",
+        status=200,
+        headers={"ETag": '"v1"'},
+    )
+    responses.add(
+        responses.GET,
+        "http://custodian/datasets/abc",
+        status=304,
+        match=[matchers.header_matcher({"If-None-Match": '"v1"'})],
+    )
+    responses.add(
+        responses.GET,
+        "http://custodian/datasets/abc",
+        json={"identifier": "abc"},
+        status=200,
+        headers={"ETag": '"v2"'},
+    )
+
+    try:
+        get_dataset(dataset_url, {}, "abc", publisher_name="FAKEY")
+        assert False
+    except RequestError as error:
+        assert error.__url__() == dataset_url
+
+    dataset = get_dataset(dataset_url, {}, "abc", publisher_name="FAKEY")
+
+    assert dataset == {"identifier": "abc"}
+    assert "If-None-Match" not in responses.calls[1].request.headers
+
+
+@responses.activate
+def test_get_datasets__projects_fields():
+    """
+    Function should only keep the catalogue fields needed to compare datasets.
+    """
+    datasets_url = "http://custodian/datasets"
+
+    responses.add(
+        responses.GET,
+        datasets_url,
+        json={
+            "query": {"total": 1},
+            "items": [
+                {
+                    "persistentId": "abc",
+                    "version": "1.0.0",
+                    "@schema": "http://schemata/2.1.0",
+                    "summary": {"title": "ABC", "abstract": "Large abstract"},
+                    "structuralMetadata": [{"name": "table"}],
+                }
+            ],
+        },
+        status=200,
+    )
+
+    datasets = get_datasets(datasets_url, {})
+
+    assert datasets == [
+        {
+            "persistentId": "abc",
+            "version": "1.0.0",
+            "@schema": "http://schemata/2.1.0",
+            "summary": {"title": "ABC"},
+        }
+    ]
+
+
+@responses.activate
+def test_get_datasets__missing_items():
+    """
+    Function should raise RequestError if the response has no list of items.
+    """
+    datasets_url = "http://custodian/datasets"
+
+    responses.add(responses.GET, datasets_url, json={"data": []}, status=200)
+
+    try:
+        get_datasets(datasets_url, {})
+        assert False
+    except RequestError as error:
+        assert error.__url__() == datasets_url
+
+
+@responses.activate
+def test_get_datasets__next_link_pagination():
+    """
+    Function should follow next links until the last page.
+    """
+    datasets_url = "http://custodian/datasets"
+
+    responses.add(
+        responses.GET,
+        datasets_url,
+        json={"items": [{"persistentId": "abc"}], "links": {"next": "/datasets?page=2"}},
+        match=[matchers.query_param_matcher({})],
+    )
+    responses.add(
+        responses.GET,
+        datasets_url,
+        json={"items": [{"persistentId": "def"}], "links": {"next": None}},
+        match=[matchers.query_param_matcher({"page": "2"})],
+    )
+
+    datasets = get_datasets(
+        datasets_url, {}, pagination={"type": "next_link", "nextKey": "links.next"}
+    )
+
+    assert datasets == [{"persistentId": "abc"}, {"persistentId": "def"}]
+
+
+@responses.activate
+def test_get_datasets__offset_pagination():
+    """
+    Function should page by offset until a page is empty.
+    """
+    datasets_url = "http://custodian/datasets"
+
+    responses.add(
+        responses.GET,
+        datasets_url,
+        json={"items": [{"persistentId": "abc"}, {"persistentId": "def"}]},
+        match=[matchers.query_param_matcher({"offset": "0", "limit": "2"})],
+    )
+    responses.add(
+        responses.GET,
+        datasets_url,
+        json={"items": [{"persistentId": "ghi"}]},
+        match=[matchers.query_param_matcher({"offset": "2", "limit": "2"})],
+    )
+    responses.add(
+        responses.GET,
+        datasets_url,
+        json={"items": []},
+        match=[matchers.query_param_matcher({"offset": "3", "limit": "2"})],
+    )
+
+    datasets = get_datasets(datasets_url, {}, pagination={"type": "offset", "limit": 2})
+
+    assert [i["persistentId"] for i in datasets] == ["abc", "def", "ghi"]
+
+
+@responses.activate
+def test_get_datasets__offset_pagination_capped_pages():
+    """
+    Function should keep paging when the custodian caps pages below the limit, until the
+    reported total is listed.
+    """
+    datasets_url = "http://custodian/datasets"
+
+    for offset, pids in [(0, ["abc", "def"]), (2, ["ghi", "jkl"]), (4, ["mno"])]:
+        responses.add(
+            responses.GET,
+            datasets_url,
+            json={
+                "query": {"total": 5},
+                "items": [{"persistentId": i} for i in pids],
+            },
+            match=[matchers.query_param_matcher({"offset": str(offset), "limit": "10"})],
+        )
+
+    datasets = get_datasets(
+        datasets_url,
+        {},
+        pagination={"type": "offset", "limit": 10, "totalKey": "query.total"},
+    )
+
+    assert [i["persistentId"] for i in datasets] == ["abc", "def", "ghi", "jkl", "mno"]
+    assert len(responses.calls) == 3
+
+
+@responses.activate
+def test_get_datasets__skips_invalid_entries():
+    """
+    Function should skip catalogue entries that are not objects.
+    """
+    datasets_url = "http://custodian/datasets"
+
+    responses.add(
+        responses.GET,
+        datasets_url,
+        json={"items": [None, "abc", {"persistentId": "def"}]},
+        status=200,
+    )
+
+    assert get_datasets(datasets_url, {}) == [{"persistentId": "def"}]
+
+
+@responses.activate
+def test_get_datasets__params():
+    """
+    Function should send query params with every offset page.
+    """
+    datasets_url = "http://custodian/datasets"
+    since = "2022-05-02T11:00:00Z"
+
+    responses.add(
+        responses.GET,
+        datasets_url,
+        json={"items": [{"persistentId": "abc"}, {"persistentId": "def"}]},
+        match=[
+            matchers.query_param_matcher(
+                {"offset": "0", "limit": "2", "modified_since": since}
+            )
+        ],
+    )
+    responses.add(
+        responses.GET,
+        datasets_url,
+        json={"items": []},
+        match=[
+            matchers.query_param_matcher(
+                {"offset": "2", "limit": "2", "modified_since": since}
+            )
+        ],
+    )
+
+    datasets = get_datasets(
+        datasets_url,
+        {},
+        pagination={"type": "offset", "limit": 2},
+        params={"modified_since": since},
+    )
+
+    assert [i["persistentId"] for i in datasets] == ["abc", "def"]
+
+
+@responses.activate
+def test_get_datasets__cursor_pagination():
+    """
+    Function should page by cursor until no cursor is returned.
+    """
+    datasets_url = "http://custodian/datasets"
+
+    responses.add(
+        responses.GET,
+        datasets_url,
+        json={"nextCursor": "xyz", "items": [{"persistentId": "abc"}]},
+        match=[matchers.query_param_matcher({})],
+    )
+    responses.add(
+        responses.GET,
+        datasets_url,
+        json={"items": [{"persistentId": "def"}], "nextCursor": ""},
+        match=[matchers.query_param_matcher({"cursor": "xyz"})],
+    )
+
+    datasets = get_datasets(datasets_url, {}, pagination={"type": "cursor"})
+
+    assert [i["persistentId"] for i in datasets] == ["abc", "def"]
+
+
+def test_iter_json_items__split_chunks():
+    """
+    Function should decode items and metadata split at any point across chunks.
+    """
+    document = json.dumps(
+        {"count": 12345, "items": [{"persistentId": 'a"bc'}, 1.5, [], "x"], "next": None}
+    )
+
+    for size in [1, 2, 3, 7]:
+        meta = {}
+        chunks = [document[i : i + size] for i in range(0, len(document), size)]
+
+        items = list(_iter_json_items(chunks, meta=meta))
+
+        assert items == [{"persistentId": 'a"bc'}, 1.5, [], "x"]
+        assert meta == {"count": 12345, "next": None}
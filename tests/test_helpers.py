@@ -1,4 +1,5 @@
 from functions.helpers import *
+from functions.cache import sweep_response_cache
 
 custodian_datasets = [
     {"persistentId": "xyz"},
@@ -53,3 +54,263 @@ def test_extract_overlapping_datasets():
     assert len(datasets_2) == 3
     assert [a == b for a, b in zip(datasets_1, expected_datasets_1)]
     assert [a == b for a, b in zip(datasets_2, expected_datasets_2)]
+
+
+def test_get_fetch_concurrency():
+    """
+    Function should read the publisher concurrency limit, falling back to the default.
+    """
+    assert get_fetch_concurrency({"federation": {"concurrency": 8}}) == 8
+    assert get_fetch_concurrency({"federation": {"concurrency": 0}}) == 1
+    assert get_fetch_concurrency({"federation": {}}) == DEFAULT_FETCH_CONCURRENCY
+
+
+def test_diff_catalogues():
+    """
+    Function should split datasets into new, archived and overlapping pairs, de-duplicating PIDs.
+    """
+    new, archived, overlapping = diff_catalogues(
+        [*custodian_datasets, {"persistentId": "xyz", "version": "duplicate"}],
+        [*gateway_datasets, {"pid": "abc", "status": "duplicate"}],
+    )
+
+    assert new == [{"persistentId": "mno"}]
+    assert archived == [{"pid": "def"}]
+    assert overlapping == [
+        ({"persistentId": "xyz"}, {"pid": "xyz"}),
+        ({"persistentId": "abc"}, {"pid": "abc"}),
+        ({"persistentId": "pqr"}, {"pid": "pqr"}),
+    ]
+
+
+def test_diff_catalogues__changed_only():
+    """
+    Function should only return overlapping pairs with a new version or an unsettled status.
+    """
+    custodian = [
+        {"persistentId": "abc", "version": "1.0.0"},
+        {"persistentId": "def", "version": "2.0.0"},
+        {"persistentId": "ghi", "version": "1.0.0"},
+        {"persistentId": "jkl", "version": "1.0.0"},
+    ]
+    gateway = [
+        {"pid": "abc", "version": "1.0.0", "status": "ok"},
+        {"pid": "def", "version": "1.0.0", "status": "ok"},
+        {"pid": "ghi", "version": "1.0.0", "status": "fetch_failed"},
+        {"pid": "jkl", "version": "1.0.0", "status": "validation_failed"},
+    ]
+
+    _, _, overlapping = diff_catalogues(custodian, gateway, changed_only=True)
+
+    assert overlapping == [(custodian[1], gateway[1]), (custodian[2], gateway[2])]
+
+
+def test_diff_catalogue_columns():
+    """
+    Function should compute the diff as index arrays over the catalogue columns.
+    """
+    custodian = to_catalogue_columns(
+        [
+            {"persistentId": "b", "version": "1", "@schema": "s"},
+            {"persistentId": "a", "version": "2", "@schema": "s"},
+            {"persistentId": "c", "version": "1"},
+        ]
+    )
+    gateway = to_catalogue_columns(
+        [
+            {"pid": "a", "version": "1", "status": "ok"},
+            {"pid": "d", "version": "1", "status": "ok"},
+            {"pid": "b", "version": "1", "status": "ok"},
+        ],
+        pid_key="pid",
+    )
+
+    assert list(custodian["schemas"][custodian["schema"]]) == ["s", "s", ""]
+
+    diff = diff_catalogue_columns(custodian, gateway)
+
+    assert diff["new"].tolist() == [2]
+    assert diff["archived"].tolist() == [1]
+    assert diff["overlap_custodian"].tolist() == [1, 0]
+    assert diff["overlap_gateway"].tolist() == [0, 2]
+    assert diff["changed"].tolist() == [True, False]
+
+    diff = diff_catalogue_columns(to_catalogue_columns([]), gateway)
+
+    assert diff["new"].tolist() == []
+    assert diff["archived"].tolist() == [0, 1, 2]
+    assert diff["changed"].tolist() == []
+
+
+def test_get_content_hash():
+    """
+    Function should hash datasets by content, independent of key order.
+    """
+    assert get_content_hash({"a": 1, "b": [1, 2]}) == get_content_hash(
+        {"b": [1, 2], "a": 1}
+    )
+    assert get_content_hash({"a": 1}) != get_content_hash({"a": 2})
+
+
+def test_is_content_unchanged():
+    """
+    Function should compare content hashes, falling back to versions for older sync entries.
+    """
+    custodian_version = {"persistentId": "abc", "version": "2.0.0"}
+
+    assert is_content_unchanged(
+        {"status": "ok", "version": "1.0.0", "contentHash": "hash"},
+        custodian_version,
+        "hash",
+    )
+    assert not is_content_unchanged(
+        {"status": "ok", "version": "2.0.0", "contentHash": "other"},
+        custodian_version,
+        "hash",
+    )
+    assert not is_content_unchanged(
+        {"status": "fetch_failed", "contentHash": "hash"}, custodian_version, "hash"
+    )
+    assert is_content_unchanged({"status": "ok", "version": "2.0.0"}, custodian_version, "")
+    assert not is_content_unchanged({"status": "ok", "version": "1.0.0"}, custodian_version, "")
+
+
+def test_transform_dataset_cached(tmp_path, monkeypatch):
+    """
+    Function should reuse transformed datasets for the same content, refreshing timestamps.
+    """
+    monkeypatch.setattr("functions.cache.RESPONSE_CACHE_DIR", str(tmp_path))
+
+    calls = []
+
+    def transform(publisher=None, dataset=None, pid="", previous_version=None):
+        calls.append(pid)
+        return {
+            "pid": pid,
+            "name": dataset["title"],
+            "timestamps": {"created": datetime(2020, 1, 1)},
+            "createdAt": datetime(2020, 1, 1),
+            "updatedAt": datetime(2020, 1, 1),
+        }
+
+    monkeypatch.setattr("functions.helpers.transform_dataset", transform)
+
+    publisher = {"_id": "123", "uses5Safes": False}
+
+    first = transform_dataset_cached(publisher, {"title": "a"}, pid="abc")
+    second = transform_dataset_cached(publisher, {"title": "a"}, pid="abc")
+
+    assert calls == ["abc"]
+    assert second["name"] == "a"
+    assert second["createdAt"] > first["createdAt"]
+    assert second["timestamps"]["created"] > datetime(2020, 1, 1)
+
+    transform_dataset_cached(publisher, {"title": "b"}, pid="abc")
+    transform_dataset_cached({**publisher, "uses5Safes": True}, {"title": "a"}, pid="abc")
+    transform_dataset_cached({**publisher, "name": "renamed"}, {"title": "a"}, pid="abc")
+
+    assert calls == ["abc", "abc", "abc", "abc"]
+
+    # Transforms are evicted with the response cache
+    sweep_response_cache(max_bytes=0)
+    transform_dataset_cached(publisher, {"title": "a"}, pid="abc")
+
+    assert len(calls) == 5
+
+
+def test_create_sync_array__content_hashes():
+    """
+    Function should record the content hash of each given PID.
+    """
+    sync_list = create_sync_array(
+        datasets=[
+            {"persistentId": "abc", "name": "A", "version": "1"},
+            {"persistentId": "def", "name": "D", "version": "1"},
+        ],
+        publisher={"publisherDetails": {"name": "publisher"}},
+        content_hashes={"abc": "hash"},
+    )
+
+    assert sync_list[0]["contentHash"] == "hash"
+    assert "contentHash" not in sync_list[1]
+
+
+def test_get_incremental_params():
+    """
+    Function should return modified-since params until a full sync is due.
+    """
+    now = datetime(2022, 5, 2, 12, 0, 0)
+    publisher = {
+        "federation": {
+            "endpoints": {"modifiedSince": "modified_since"},
+            "syncWatermark": datetime(2022, 5, 2, 11, 0, 0),
+            "lastFullSync": datetime(2022, 5, 2, 0, 0, 0),
+            "fullSyncInterval": 86400,
+        }
+    }
+
+    assert get_incremental_params(publisher, now=now) == {
+        "modified_since": "2022-05-02T11:00:00Z"
+    }
+
+    publisher["federation"]["fullSyncInterval"] = 3600
+    assert get_incremental_params(publisher, now=now) is None
+
+    publisher["federation"]["fullSyncInterval"] = 86400
+    publisher["federation"]["endpoints"] = {}
+    assert get_incremental_params(publisher, now=now) is None
+
+    assert (
+        get_incremental_params(
+            {"federation": {"endpoints": {"modifiedSince": "modified_since"}}}, now=now
+        )
+        is None
+    )
+
+
+def test_merge_dictionaries():
+    """
+    Function should fill the missing and empty fields of the minimum viable datasetv2 only.
+    """
+    from functions.helpers import _merge_dictionaries
+
+    dataset = {
+        "identifier": "abc",
+        "version": "",
+        "summary": {"title": "Title", "publisher": {}},
+        "structuralMetadata": [{"name": "table"}],
+    }
+
+    merged = _merge_dictionaries(dataset)
+
+    assert merged["identifier"] == "abc"
+    assert merged["version"] == ""
+    assert merged["summary"]["title"] == "Title"
+    assert merged["summary"]["publisher"]["contactPoint"] == []
+    assert merged["provenance"]["temporal"]["startDate"] == ""
+    assert merged["structuralMetadata"] == [{"name": "table"}]
+
+    # Defaults are not shared between datasets
+    merged["observations"].append({"observedNode": "PERSONS"})
+
+    assert _merge_dictionaries({})["observations"] == []
+
+
+def test_sanitise():
+    """
+    Function should replace unstorable characters in place, keeping other strings as they are.
+    """
+    from functions.helpers import _sanitise
+
+    title = "Cymraeg: Ysbyty Athrofaol, café"
+    dataset = {
+        "summary": {"title": title, "keywords": ["a\ud800b", "ok"]},
+        "bad\udc00key": 1,
+    }
+
+    sanitised = _sanitise(dataset)
+
+    assert sanitised is dataset
+    assert sanitised["summary"]["title"] is title
+    assert sanitised["summary"]["keywords"] == ["a?b", "ok"]
+    assert list(sanitised) == ["summary", "bad?key"]
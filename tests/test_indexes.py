@@ -0,0 +1,98 @@
+import mongomock
+
+from functions.exceptions import CriticalError
+from functions.indexes import *
+from functions.indexes import _get_plan_stages
+
+
+def test_ensure_indexes():
+    """
+    Function should create the declared indexes and be safe to repeat.
+    """
+    db = mongomock.MongoClient()["indexes"]
+
+    ensure_indexes(db)
+    created = ensure_indexes(db)
+
+    assert {
+        collection: list(indexes) for collection, indexes in created.items()
+    } == {
+        "sync_status": ["fma_publisherName_pid", "fma_pid"],
+        "tools": ["fma_type_pid_createdAt", "fma_pid"],
+        "sync_runs": ["fma_publisherId_running", "fma_publisherId_status_startedAt"],
+        "sync_run_checkpoints": ["fma_runId_pid"],
+    }
+    assert all(i == "ok" for indexes in created.values() for i in indexes.values())
+    assert "fma_type_pid_createdAt" in db.tools.index_information()
+
+
+def test_ensure_indexes__conflict():
+    """
+    Function should create the other indexes when one conflicts with an existing index.
+    """
+    db = mongomock.MongoClient()["indexes"]
+    db.tools.create_index([("name", 1)], name="fma_pid")
+
+    created = ensure_indexes(db)
+
+    assert created["tools"]["fma_pid"] != "ok"
+    assert created["tools"]["fma_type_pid_createdAt"] == "ok"
+    assert "fma_type_pid_createdAt" in db.tools.index_information()
+
+
+def test_get_plan_stages():
+    """
+    Function should list winning plan stages, ignoring rejected plans.
+    """
+    plan = {
+        "queryPlanner": {
+            "winningPlan": {
+                "stage": "FETCH",
+                "inputStage": {"stage": "IXSCAN", "indexName": "fma_pid"},
+            },
+            "rejectedPlans": [{"stage": "COLLSCAN"}],
+        }
+    }
+
+    assert _get_plan_stages(plan) == ["FETCH", "IXSCAN"]
+
+
+def test_check_query_plans__collection_scan():
+    """
+    Function should raise if a query would scan a whole collection.
+    """
+
+    class Cursor:
+        def __init__(self, stage):
+            self.stage = stage
+
+        def sort(self, *args):
+            return self
+
+        def explain(self):
+            return {"queryPlanner": {"winningPlan": {"stage": self.stage}}}
+
+    class Collection:
+        def __init__(self, stage):
+            self.stage = stage
+
+        def find(self, *args):
+            return Cursor(self.stage)
+
+    class Database:
+        sync_status = Collection("IXSCAN")
+        tools = Collection("COLLSCAN")
+
+        def command(self, *args, **kwargs):
+            return {"stages": [{"$cursor": {"queryPlanner": {"winningPlan": {"stage": "IXSCAN"}}}}]}
+
+    try:
+        check_query_plans(Database(), publisher_name="FAKEY", pid="pid1")
+        assert False
+    except CriticalError as error:
+        assert "get_latest_gateway_dataset" in str(error)
+        assert "get_gateway_datasets" not in str(error)
+
+    Database.tools = Collection("IXSCAN")
+
+    assert check_query_plans(Database())["sync_datasets"] == ["IXSCAN"]
@@ -0,0 +1,140 @@
+import mongomock
+import responses
+
+from functions.exceptions import AuthError
+from functions.pipeline import *
+
+publisher = {
+    "_id": "6421d1025a55d137b0fa0b89",
+    "publisherDetails": {"name": "PIPELINE"},
+    "uses5Safes": False,
+}
+schema = "https://example.org/schema/2.1.0/dataset.schema.json"
+
+
+def _transform(publisher=None, dataset=None, pid="", previous_version=None, content_hash=None):
+    return {
+        "pid": pid,
+        "name": dataset["title"],
+        "datasetVersion": dataset["version"],
+        "datasetid": dataset["title"],
+        "activeflag": "active" if previous_version else "inReview",
+    }
+
+
+def test_write_batcher():
+    """
+    Class should hand out batches capped by document count and keep a slim summary.
+    """
+    writer = WriteBatcher(publisher, max_documents=3)
+    transformed = _transform(dataset={"title": "a", "version": "1"}, pid="abc")
+
+    assert writer.add("new", transformed, None, {"persistentId": "abc"}, "hash") is None
+
+    batch = writer.add(
+        "fetch_failed", None, {"pid": "def", "name": "d", "version": "1"}, {"persistentId": "def"}
+    )
+
+    assert batch["insert"] == [transformed]
+    assert [(i["pid"], i["status"]) for i in batch["sync"]] == [
+        ("abc", "ok"),
+        ("def", "fetch_failed"),
+    ]
+    assert batch["sync"][0]["contentHash"] == "hash"
+    assert writer.drain() == {"previous": [], "insert": [], "sync": [], "checkpoint": []}
+    assert writer.summary["new"][0]["pid"] == "abc"
+    assert writer.summary["fetch_failed"] == 1
+
+
+def test_write_batcher__bytes():
+    """
+    Class should hand out a batch once the inserted datasets reach the byte limit.
+    """
+    writer = WriteBatcher(publisher, max_bytes=1)
+    transformed = _transform(dataset={"title": "a", "version": "1"}, pid="abc")
+
+    batch = writer.add(
+        "updated", transformed, {"pid": "abc"}, {"persistentId": "abc"}, "hash"
+    )
+
+    assert batch["previous"] == [{"pid": "abc"}]
+    assert batch["insert"] == [transformed]
+
+
+@responses.activate
+def test_run_pipeline(monkeypatch):
+    """
+    Function should fetch, process and write every dataset in batches.
+    """
+    monkeypatch.setattr("functions.pipeline.validate_json", lambda *args: None)
+    monkeypatch.setattr("functions.pipeline.transform_dataset_cached", _transform)
+
+    db = mongomock.MongoClient()["pipeline"]
+    db.tools.insert_one({"pid": "ghi", "activeflag": "active"})
+
+    for pid in ["abc", "def", "ghi"]:
+        responses.add(
+            responses.GET,
+            f"http://custodian/datasets/{pid}",
+            json={"title": pid, "version": "2"},
+        )
+    responses.add(responses.GET, "http://custodian/datasets/jkl", status=500)
+
+    summary = run_pipeline(
+        db=db,
+        publisher=publisher,
+        url="http://custodian/datasets/{id}",
+        headers={},
+        jobs=[
+            (None, {"persistentId": "abc", "@schema": schema}),
+            (None, {"persistentId": "def", "@schema": schema}),
+            (
+                {"pid": "ghi", "name": "ghi", "version": "1", "status": "ok"},
+                {"persistentId": "ghi", "@schema": schema},
+            ),
+            (
+                {"pid": "jkl", "name": "jkl", "version": "1", "status": "ok"},
+                {"persistentId": "jkl", "@schema": schema},
+            ),
+        ],
+        latest_datasets={"ghi": {"pid": "ghi", "activeflag": "active"}},
+        max_workers=2,
+        writer=WriteBatcher(publisher, max_documents=2),
+    )
+
+    assert [i["pid"] for i in summary["new"]] == ["abc", "def"]
+    assert [i["pid"] for i in summary["updated"]] == ["ghi"]
+    assert summary["fetch_failed"] == 1
+    assert db.tools.count_documents({"pid": "ghi", "activeflag": "archive"}) == 1
+    assert db.tools.count_documents({"pid": "ghi", "activeflag": "active"}) == 1
+    assert db.tools.count_documents({}) == 4
+    assert {i["pid"]: i["status"] for i in db.sync_status.find()} == {
+        "abc": "ok",
+        "def": "ok",
+        "ghi": "ok",
+        "jkl": "fetch_failed",
+    }
+
+
+@responses.activate
+def test_run_pipeline__auth_error():
+    """
+    Function should stop every stage and raise an AuthError.
+    """
+    responses.add(responses.GET, "http://custodian/datasets/abc", status=401)
+
+    db = mongomock.MongoClient()["pipeline"]
+
+    try:
+        run_pipeline(
+            db=db,
+            publisher=publisher,
+            url="http://custodian/datasets/{id}",
+            headers={},
+            jobs=[(None, {"persistentId": "abc", "@schema": schema})],
+        )
+        assert False
+    except AuthError as error:
+        assert error is not None
+
+    assert db.sync_status.count_documents({}) == 0
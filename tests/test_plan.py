@@ -0,0 +1,131 @@
+import json
+import mongomock
+import responses
+
+from mongomock import ObjectId
+
+from functions.cache import set_cached_response
+from functions.plan import *
+
+publisher = {
+    "_id": ObjectId("6421d1025a55d137b0fa0b89"),
+    "publisherDetails": {"name": "PLANNER"},
+    "federation": {
+        "active": True,
+        "auth": {"type": "NO_AUTH"},
+        "endpoints": {
+            "baseURL": "http://custodian",
+            "datasets": "/datasets",
+            "dataset": "/datasets/{id}",
+        },
+    },
+}
+
+
+def test_create_sync_plan():
+    """
+    Function should split datasets into archive, new and update decisions.
+    """
+    plan = create_sync_plan(
+        publisher,
+        [
+            {"persistentId": "abc", "version": "2.0.0"},
+            {"persistentId": "def", "version": "1.0.0"},
+            {"persistentId": "ghi", "version": "1.0.0"},
+        ],
+        [
+            {"pid": "abc", "version": "1.0.0", "status": "ok"},
+            {"pid": "def", "version": "1.0.0", "status": "ok"},
+            {"pid": "xyz", "version": "1.0.0", "status": "ok"},
+        ],
+    )
+
+    assert plan["mode"] == "full"
+    assert [i["pid"] for i in plan["archive"]] == ["xyz"]
+    assert [i["persistentId"] for i in plan["new"]] == ["ghi"]
+    assert [i["persistentId"] for i, _ in plan["update"]] == ["abc"]
+
+
+def test_serialise_sync_plan(tmp_path, monkeypatch):
+    """
+    Function should list PIDs and the fetch bytes, known only if every response is cached.
+    """
+    monkeypatch.setattr("functions.cache.RESPONSE_CACHE_DIR", str(tmp_path))
+
+    set_cached_response("PLANNER", "abc", b"x" * 100, etag='"1"')
+    set_cached_response("PLANNER", "def", b"x" * 300, etag='"1"')
+
+    serialised = serialise_sync_plan(
+        {
+            "publisher": "PLANNER",
+            "mode": "full",
+            "modifiedSince": None,
+            "archive": [{"pid": "xyz"}],
+            "new": [{"persistentId": "abc"}, {"persistentId": "ghi"}],
+            "update": [({"persistentId": "def"}, {"pid": "def"})],
+        }
+    )
+
+    assert json.loads(json.dumps(serialised)) == {
+        "publisher": "PLANNER",
+        "mode": "full",
+        "modifiedSince": None,
+        "archive": ["xyz"],
+        "new": ["abc", "ghi"],
+        "update": ["def"],
+        "expectedFetches": 3,
+        "cachedFetches": 2,
+        "cachedBytes": 400,
+        "expectedBytes": None,
+    }
+
+    set_cached_response("PLANNER", "ghi", b"x" * 200, etag='"1"')
+    serialised = serialise_sync_plan(
+        {
+            "publisher": "PLANNER",
+            "mode": "full",
+            "modifiedSince": None,
+            "archive": [],
+            "new": [{"persistentId": "abc"}, {"persistentId": "ghi"}],
+            "update": [({"persistentId": "def"}, {"pid": "def"})],
+        }
+    )
+
+    assert (serialised["cachedFetches"], serialised["expectedBytes"]) == (3, 600)
+
+
+@responses.activate
+def test_plan_sync(tmp_path, monkeypatch):
+    """
+    Function should plan a sync without modifying the database.
+    """
+    monkeypatch.setattr("functions.cache.RESPONSE_CACHE_DIR", str(tmp_path))
+
+    db = mongomock.MongoClient()["plan"]
+    db.publishers.insert_one(publisher)
+    db.sync_status.insert_many(
+        [
+            {"pid": "abc", "publisherName": "PLANNER", "version": "1", "status": "ok"},
+            {"pid": "xyz", "publisherName": "PLANNER", "version": "1", "status": "ok"},
+        ]
+    )
+
+    responses.add(
+        responses.GET,
+        "http://custodian/datasets",
+        json={
+            "items": [
+                {"persistentId": "abc", "version": "1"},
+                {"persistentId": "def", "version": "1"},
+            ]
+        },
+    )
+
+    sync_plan = plan_sync(db=db, custodian_id=str(publisher["_id"]))
+
+    assert sync_plan["archive"] == ["xyz"]
+    assert sync_plan["new"] == ["def"]
+    assert sync_plan["update"] == []
+    assert sync_plan["expectedFetches"] == 1
+    assert set(sync_plan["timings"]) == {"catalogue", "gateway", "plan"}
+    assert db.sync_status.count_documents({}) == 2
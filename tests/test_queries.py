@@ -1,3 +1,5 @@
+import mongomock
+
 from mongomock import ObjectId
 from bson.json_util import loads, dumps
 
@@ -85,6 +87,42 @@ def test_archive_gateway_datasets(initialise_db):
     assert archived_dataset["activeflag"] == "archive"
 
 
+def test_archive_gateway_datasets__chunks():
+    """
+    Function should archive in chunks, only updating versions not archived yet.
+    """
+    db = mongomock.MongoClient()["archive"]
+    db.tools.insert_many(
+        [
+            {"pid": "a", "activeflag": "active"},
+            {"pid": "a", "activeflag": "archive"},
+            {"pid": "b", "activeflag": "active"},
+            {"pid": "c", "activeflag": "active"},
+        ]
+    )
+    db.sync_status.insert_many([{"pid": "a"}, {"pid": "c"}])
+
+    counts = archive_gateway_datasets(
+        db, [{"pid": "a"}, {"pid": "c"}], [{"pid": "b"}, {"pid": "a"}], batch_size=2
+    )
+
+    assert counts["chunks"] == [
+        {"matched": 2, "modified": 2, "deleted": 2},
+        {"matched": 1, "modified": 1, "deleted": 0},
+    ]
+    assert (counts["matched"], counts["modified"], counts["deleted"]) == (3, 3, 2)
+    assert db.tools.count_documents({"activeflag": "archive"}) == 4
+    assert db.sync_status.count_documents({}) == 0
+
+
+def test_get_archive_chunks():
+    """
+    Function should split PIDs into chunks, dropping repeats.
+    """
+    assert get_archive_chunks(["a", "b", "a", "c"], 2) == [["a", "b"], ["c"]]
+    assert get_archive_chunks([], 2) == []
+
+
 def test_archive_gateway_datasets__raise_exception():
     """
     Function should raise exception if error encountered.
@@ -195,6 +233,75 @@ def test_sync_datasets(initialise_db):
     assert sync_test["status"] == "ok"
 
 
+def test_sync_datasets__upsert():
+    """
+    Function should replace existing entries by (publisherName, pid), add new ones in batches
+    and delete the entries of their PIDs under another publisherName.
+    """
+    db = mongomock.MongoClient()["sync"]
+    db.sync_status.insert_many(
+        [
+            {"pid": "dataset1", "publisherName": "FAKEY", "status": "fetch_failed"},
+            {"pid": "dataset1", "publisherName": "OTHER", "status": "ok"},
+        ]
+    )
+
+    counts = sync_datasets(
+        db,
+        [
+            {"pid": "dataset1", "publisherName": "FAKEY", "status": "ok"},
+            {"pid": "dataset2", "publisherName": "FAKEY", "status": "ok"},
+            {"pid": "dataset3", "publisherName": "FAKEY", "status": "ok"},
+        ],
+        batch_size=2,
+    )
+
+    assert counts == {"matched": 1, "modified": 1, "upserted": 2, "deleted": 1}
+    assert db.sync_status.count_documents({"publisherName": "FAKEY", "status": "ok"}) == 3
+    # The entry of the same PID under a previous publisherName is stale
+    assert db.sync_status.find_one({"publisherName": "OTHER"}) is None
+
+
+def test_sync_datasets__write_errors():
+    """
+    Function should write every other entry and report the failed PIDs.
+    """
+    db = mongomock.MongoClient()["sync"]
+    db.sync_status.create_index("name", unique=True)
+
+    try:
+        sync_datasets(
+            db,
+            [
+                {"pid": "dataset1", "publisherName": "FAKEY", "name": "a"},
+                {"pid": "dataset2", "publisherName": "FAKEY", "name": "a"},
+                {"pid": "dataset3", "publisherName": "FAKEY", "name": "b"},
+            ],
+        )
+        assert False
+    except CriticalError as error:
+        assert "dataset2" in str(error)
+
+    assert db.sync_status.count_documents({}) == 2
+
+
+def test_get_sync_batches():
+    """
+    Function should batch one entry per (publisherName, pid), keeping the last entry.
+    """
+    batches = get_sync_batches(
+        [
+            {"pid": "dataset1", "publisherName": "FAKEY", "status": "fetch_failed"},
+            {"pid": "dataset2", "publisherName": "FAKEY", "status": "ok"},
+            {"pid": "dataset1", "publisherName": "FAKEY", "status": "ok"},
+        ],
+        batch_size=1,
+    )
+
+    assert [len(i) for i in batches] == [1, 1]
+    assert batches[0][0]["status"] == "ok"
+
+
 def test_sync_datasets__raise_exception():
     """
     Function should raise exception if error encountered.
@@ -203,3 +310,122 @@ def test_sync_datasets__raise_exception():
         get_publisher("badDB", [])
     except Exception as error:
         assert error is not None
+
+
+def test_get_gateway_datasets__pids(initialise_db):
+    """
+    Function should only return the sync entries of the given PIDs.
+    """
+    db = initialise_db
+
+    datasets = list(get_gateway_datasets(db, "FAKEY", pids=["dataset2", "other"]))
+
+    assert [i["pid"] for i in datasets] == ["dataset2"]
+
+
+def test_update_sync_watermark(initialise_db):
+    """
+    Function should record the sync watermark, and the last full sync for full syncs.
+    """
+    db = initialise_db
+    custodian_id = "6421d1025a55d137b0fa0b89"
+
+    update_sync_watermark(db, custodian_id, datetime(2022, 5, 1), full_sync=True)
+    update_sync_watermark(db, custodian_id, datetime(2022, 5, 2))
+
+    publisher = db.publishers.find_one({"_id": ObjectId(custodian_id)})
+
+    assert publisher["federation"]["syncWatermark"] == datetime(2022, 5, 2)
+    assert publisher["federation"]["lastFullSync"] == datetime(2022, 5, 1)
+
+
+def test_get_latest_gateway_datasets():
+    """
+    Function should return the latest version of each PID, aggregating the PIDs in chunks.
+    """
+    db = mongomock.MongoClient()["latest"]
+    db.tools.insert_many(
+        [
+            {
+                "type": "dataset",
+                "pid": "pid1",
+                "createdAt": "2021-10-05T16:25:43Z",
+                "activeflag": "archive",
+                "datasetfields": {"metadataquality": {"score": 1}},
+            },
+            {
+                "type": "dataset",
+                "pid": "pid1",
+                "createdAt": "2021-10-06T16:25:43Z",
+                "activeflag": "active",
+                "datasetfields": {"metadataquality": {"score": 2}},
+            },
+            {
+                "type": "dataset",
+                "pid": "pid2",
+                "createdAt": "2021-10-05T16:25:43Z",
+                "activeflag": "inReview",
+                "datasetfields": {"metadataquality": {"score": 3}},
+            },
+        ]
+    )
+
+    latest = get_latest_gateway_datasets(db, ["pid1", "pid2", "pid3"], chunk_size=2)
+
+    assert latest == {
+        "pid1": {
+            "pid": "pid1",
+            "activeflag": "active",
+            "datasetfields": {"metadataquality": {"score": 2}},
+        },
+        "pid2": {
+            "pid": "pid2",
+            "activeflag": "inReview",
+            "datasetfields": {"metadataquality": {"score": 3}},
+        },
+    }
+    assert get_latest_gateway_datasets(db, []) == {}
+
+
+def test_get_gateway_datasets__projection():
+    """
+    Function should only read the given fields, with any read preference and batch size.
+    """
+    db = mongomock.MongoClient()["projection"]
+    db.sync_status.insert_one(
+        {"pid": "dataset1", "publisherName": "FAKEY", "status": "ok", "lastSync": 1}
+    )
+
+    datasets = list(
+        get_gateway_datasets(
+            db,
+            "FAKEY",
+            fields=["pid", "status"],
+            read_preference="secondaryPreferred",
+            batch_size=100,
+        )
+    )
+
+    assert datasets == [{"pid": "dataset1", "status": "ok"}]
+
+
+def test_get_latest_gateway_dataset__projection(initialise_db):
+    """
+    Function should only read the given fields of the latest version.
+    """
+    dataset = get_latest_gateway_dataset(
+        initialise_db, "pid1", fields=LATEST_VERSION_FIELDS
+    )
+
+    assert dataset == {"pid": "pid1", "activeflag": "active"}
+
+
+def test_with_read_preference__unknown():
+    """
+    Function should raise for an unknown read preference.
+    """
+    try:
+        with_read_preference(mongomock.MongoClient()["db"].tools, "fastest")
+        assert False
+    except CriticalError as error:
+        assert "fastest" in str(error)
@@ -0,0 +1,159 @@
+import time
+import asyncio
+import responses
+
+from functions.ratelimit import *
+from functions.extract import get_dataset
+
+
+def test_host_rate_limiter__token_bucket():
+    """
+    Limiter should pace requests to the configured rate once the burst is spent.
+    """
+    limiter = HostRateLimiter(requests_per_second=50, burst=1)
+
+    start = time.monotonic()
+    for _ in range(5):
+        limiter.acquire()
+        limiter.release(200, 0.01)
+
+    assert time.monotonic() - start >= 0.07
+
+
+def test_host_rate_limiter__aimd():
+    """
+    Limiter should halve its concurrency on a 429 and recover additively on success.
+    """
+    limiter = HostRateLimiter(max_concurrency=8)
+
+    limiter.acquire()
+    limiter.release(429, 0.01, retry_after=0)
+
+    assert limiter.stats()["concurrency_limit"] == 4
+    assert limiter.stats()["throttled"] == 1
+
+    for _ in range(4):
+        limiter.acquire()
+        limiter.release(200, 0.01)
+
+    assert 4 < limiter.stats()["concurrency_limit"] <= 5
+
+
+def test_host_rate_limiter__latency_target():
+    """
+    Limiter should back off when responses are slower than the latency target.
+    """
+    limiter = HostRateLimiter(max_concurrency=4, latency_target=0.5)
+
+    limiter.acquire()
+    limiter.release(200, 1.0)
+
+    assert limiter.stats()["concurrency_limit"] == 2
+
+
+def test_host_rate_limiter__decrease_once_per_window():
+    """
+    Limiter should only halve its concurrency once for requests in flight together.
+    """
+    limiter = HostRateLimiter(max_concurrency=32, latency_target=0.05)
+
+    for _ in range(4):
+        limiter.acquire()
+    time.sleep(0.1)
+    for _ in range(4):
+        limiter.release(200, 0.1)
+
+    assert limiter.stats()["concurrency_limit"] == 16
+
+    # Sent after the decrease
+    limiter.acquire()
+    time.sleep(0.1)
+    limiter.release(429, 0.1, retry_after=0)
+
+    assert limiter.stats()["concurrency_limit"] == 8
+
+
+def test_configure_rate_limiter__keeps_state():
+    """
+    Function should update a host's limiter in place, keeping its learned limit and pause.
+    """
+    url = "http://configured.custodian/datasets/{id}"
+    limiter = configure_rate_limiter(url, {}, max_concurrency=8)
+
+    limiter.acquire()
+    limiter.acquire()
+    limiter.release(429, 0.01, retry_after=30)
+
+    configured = configure_rate_limiter(url, {"requestsPerSecond": 5}, max_concurrency=6)
+
+    assert configured is limiter is get_rate_limiter(url)
+    assert limiter.stats() == {
+        "concurrency_limit": 4,
+        "in_flight": 1,
+        "requests_per_second": 5,
+        "throttled": 1,
+    }
+    assert limiter.paused_until > time.monotonic()
+
+    configure_rate_limiter(url, {}, max_concurrency=2)
+
+    assert limiter.stats()["concurrency_limit"] == 2
+
+
+def test_parse_retry_after():
+    """
+    Function should parse Retry-After seconds and HTTP dates.
+    """
+    assert parse_retry_after("3") == 3
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
+
+
+@responses.activate
+def test_get_dataset__retries_429():
+    """
+    Function should retry a 429 after its Retry-After instead of failing the fetch.
+    """
+    configure_rate_limiter("http://throttled/datasets", {"maxRetries": 1})
+
+    responses.add(
+        responses.GET,
+        "http://throttled/datasets/abc",
+        status=429,
+        headers={"Retry-After": "0"},
+    )
+    responses.add(
+        responses.GET,
+        "http://throttled/datasets/abc",
+        json={"identifier": "abc"},
+        status=200,
+    )
+
+    dataset = get_dataset("http://throttled/datasets/{id}", {}, "abc")
+
+    assert dataset == {"identifier": "abc"}
+    assert get_rate_limiter("http://throttled/").stats()["throttled"] == 1
+
+
+def test_acquire_async__concurrency():
+    """
+    Method should wait on the event loop for a free request slot.
+    """
+    limiter = HostRateLimiter(max_concurrency=2)
+    peak = 0
+
+    async def _request():
+        nonlocal peak
+        await limiter.acquire_async()
+        peak = max(peak, limiter.in_flight)
+        await asyncio.sleep(0.01)
+        limiter.release(200)
+
+    async def _run():
+        await asyncio.gather(*[_request() for _ in range(6)])
+
+    asyncio.run(_run())
+
+    assert peak == 2
+    assert limiter.in_flight == 0
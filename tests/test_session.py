@@ -0,0 +1,81 @@
+import threading
+import requests
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from functions.session import *
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = b'{"items": []}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_get_session__reuses_connections():
+    """
+    Function should return a shared session which reuses a pooled connection per host.
+    """
+    server = HTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    close_session()
+    try:
+        url = f"http://127.0.0.1:{server.server_port}/datasets"
+
+        for _ in range(5):
+            assert get_session().get(url).status_code == 200
+
+        stats = get_pool_stats()[f"http://127.0.0.1:{server.server_port}"]
+
+        assert stats["connections_opened"] == 1
+        assert stats["requests"] == 5
+        assert stats["idle_connections"] == 1
+    finally:
+        close_session()
+        server.shutdown()
+        server.server_close()
+
+
+def test_get_session__resizes_pool():
+    """
+    Function should grow the per-host pool when a larger pool size is requested, closing
+    the replaced adapters.
+    """
+    close_session()
+
+    replaced = get_session(pool_maxsize=2).get_adapter("https://")
+    replaced.poolmanager.connection_from_url("https://custodian")
+    session = get_session(pool_maxsize=8)
+
+    assert len(replaced.poolmanager.pools) == 0
+
+    assert session.get_adapter("https://")._pool_maxsize == 8
+    assert get_session(pool_maxsize=4) is session
+    assert session.get_adapter("https://")._pool_maxsize == 8
+
+    close_session()
+
+
+def test_set_session():
+    """
+    Function should allow a session to be injected.
+    """
+    session = requests.Session()
+
+    set_session(session)
+
+    assert get_session() is session
+    assert get_pool_stats() == {}
+
+    close_session()
@@ -1,5 +1,9 @@
 import json
 import pytest
+import responses
+
+from concurrent.futures import ThreadPoolExecutor
+from responses import matchers
 
 from functions.validate import *
 
@@ -82,3 +86,104 @@ def test_validate_json__invalid_dataset(invalid_dataset, schema_urls):
         errors[2]["error"] == "'THIS SHOULD BE A NUMBER TYPE' is not of type 'integer'"
     )
     assert errors[2]["path"] == ["observations", 0, "measuredValue"]
+
+
+@responses.activate
+def test_get_validator__cached():
+    """
+    Function should fetch and compile a schema once and serve later calls from the cache.
+    """
+    clear_validators()
+    schema_url = "http://schemata/2.1.0/dataset.schema.json"
+
+    responses.add(
+        responses.GET,
+        schema_url,
+        json={"type": "object", "required": ["identifier"]},
+        status=200,
+    )
+
+    assert validate_json(schema_url, {"identifier": "abc"}) is None
+    assert validate_json(schema_url, {})["validation_errors"][0]["path"] == []
+    assert len(responses.calls) == 1
+
+    clear_validators()
+
+
+@responses.activate
+def test_get_validator__revalidates_expired(monkeypatch):
+    """
+    Function should revalidate an expired schema with its ETag and reuse it on a 304.
+    """
+    clear_validators()
+    schema_url = "http://schemata/latest/dataset.schema.json"
+
+    responses.add(
+        responses.GET,
+        schema_url,
+        json={"type": "object"},
+        status=200,
+        headers={"ETag": '"v1"'},
+    )
+    responses.add(
+        responses.GET,
+        schema_url,
+        status=304,
+        match=[matchers.header_matcher({"If-None-Match": '"v1"'})],
+    )
+
+    validator = get_validator(schema_url)
+
+    monkeypatch.setattr("functions.validate.SCHEMA_CACHE_TTL", 0)
+
+    assert get_validator(schema_url) is validator
+    assert len(responses.calls) == 2
+
+    clear_validators()
+
+
+@responses.activate
+def test_get_validator__eviction(monkeypatch):
+    """
+    Function should evict the least recently used schema once the cache is full.
+    """
+    clear_validators()
+    monkeypatch.setattr("functions.validate.SCHEMA_CACHE_MAXSIZE", 1)
+
+    for version in ["2.0.2", "2.1.0"]:
+        responses.add(
+            responses.GET, f"http://schemata/{version}", json={"type": "object"}
+        )
+
+    warm_validators(["http://schemata/2.0.2", "http://schemata/2.1.0", "bad"])
+    get_validator("http://schemata/2.1.0")
+    get_validator("http://schemata/2.0.2")
+
+    assert len(responses.calls) == 3
+
+    clear_validators()
+
+
+@responses.activate
+def test_get_validator__single_flight_after_eviction(monkeypatch):
+    """
+    Function should fetch an evicted schema once, however many threads ask for it at once.
+    """
+    clear_validators()
+    monkeypatch.setattr("functions.validate.SCHEMA_CACHE_MAXSIZE", 1)
+
+    for version in ["2.0.2", "2.1.0"]:
+        responses.add(
+            responses.GET, f"http://schemata/{version}", json={"type": "object"}
+        )
+
+    get_validator("http://schemata/2.0.2")
+    get_validator("http://schemata/2.1.0")
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        validators = list(executor.map(get_validator, ["http://schemata/2.0.2"] * 8))
+
+    assert len({id(i) for i in validators}) == 1
+    assert len(responses.calls) == 3
+
+    clear_validators()